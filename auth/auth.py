@@ -1,8 +1,12 @@
 import os
 import jwt
 import uuid
+import asyncio
 import hashlib
 import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional, Dict
 from fastapi import HTTPException
@@ -11,6 +15,8 @@ from sqlalchemy import select
 from dotenv import load_dotenv
 from databases.database import User
 from .dependencies import *
+from .user_cache import UserSnapshot, get_cached_claims, cache_claims, get_user_snapshot
+from monitoring.metrics import PASSWORD_HASH_SECONDS, PASSWORD_HASH_QUEUE_SECONDS, PASSWORD_HASH_REJECTED
 
 load_dotenv()
 
@@ -21,6 +27,11 @@ if not JWT_SECRET_KEY:
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 REFRESH_TOKEN_EXPIRE_DAYS = 30
+
+# PBKDF2 runs on a bounded worker pool so hashing never blocks the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "2"))
 # ================================================================================================
 # JWT TOKEN FUNCTIONS
 # ================================================================================================
@@ -74,6 +85,45 @@ def verify_password(password: str, hashed_password: str) -> bool:
         return stored_hash == pwd_hash.hex()
     except ValueError:
         return False
+
+class PasswordHashingBusy(Exception):
+    """Raised when the hashing queue is full; callers should answer 503 + Retry-After"""
+    def __init__(self, retry_after: int = PASSWORD_HASH_RETRY_AFTER):
+        super().__init__("Too many concurrent login attempts, please retry shortly")
+        self.retry_after = retry_after
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="pbkdf2")
+# running + queued jobs; released from the worker thread once a job really finishes
+_hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_PENDING)
+
+def _timed_hash_job(operation: str, submitted_at: float, fn, *args):
+    started = time.perf_counter()
+    PASSWORD_HASH_QUEUE_SECONDS.observe(started - submitted_at)
+    try:
+        return fn(*args)
+    finally:
+        PASSWORD_HASH_SECONDS.labels(operation).observe(time.perf_counter() - started)
+
+async def _run_hash_job(operation: str, fn, *args):
+    if not _hash_slots.acquire(blocking=False):
+        PASSWORD_HASH_REJECTED.inc()
+        raise PasswordHashingBusy()
+    try:
+        future = _hash_executor.submit(_timed_hash_job, operation, time.perf_counter(), fn, *args)
+    except Exception:
+        _hash_slots.release()
+        raise
+    future.add_done_callback(lambda _: _hash_slots.release())
+    return await asyncio.wrap_future(future)
+
+async def hash_password_async(password: str) -> str:
+    return await _run_hash_job("hash", hash_password, password)
+
+async def verify_password_async(password: str, hashed_password: str) -> bool:
+    return await _run_hash_job("verify", verify_password, password, hashed_password)
+
+def shutdown_password_hasher():
+    _hash_executor.shutdown(wait=False, cancel_futures=True)
     
 # ================================================================================================
 # AUTHENTICATION FUNCTIONS
@@ -92,7 +142,7 @@ async def register_user(
         raise ValueError("User with this email already exists")
     
     user_id = str(uuid.uuid4())
-    hashed_pwd = hash_password(password)
+    hashed_pwd = await hash_password_async(password)
 
     user_data = {
         'user_id':user_id,
@@ -127,7 +177,7 @@ async def login_user(db: AsyncSession, email: str, password: str) -> dict:
     if not user:
         raise ValueError("Invalid email or password")
     
-    if not verify_password(password, user.password_hash):
+    if not await verify_password_async(password, user.password_hash):
         raise ValueError("Invalid email or password")
     
     if not user.is_active:
@@ -148,18 +198,24 @@ async def login_user(db: AsyncSession, email: str, password: str) -> dict:
         "token_type": "bearer"
     }
 
-async def get_current_user(db: AsyncSession, token: str) -> User:
-    payload = verify_token(token, "access")
-    if not payload:
-        raise ValueError("Invalid or expired access token")
+async def get_current_user(db: AsyncSession, token: str) -> UserSnapshot:
+    payload = get_cached_claims(token)
+    if payload is None:
+        payload = verify_token(token, "access")
+        if not payload:
+            raise ValueError("Invalid or expired access token")
+        cache_claims(token, payload)
     
     user_id = payload.get("sub")
     if not user_id:
         raise ValueError("Invalid token")
     
-    user = await get_user_by_id(db, user_id)
+    user = await get_user_snapshot(db, user_id)
     if not user:
         raise ValueError("User not found")
+
+    if not user.is_active:
+        raise ValueError("Account is deactivated")
     
     return user
 
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from typing import Optional, Dict, Any, Iterable
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from cache.ttl_cache import TTLCache
+from monitoring.metrics import CACHE_REQUESTS
+from databases.database import User, redis_client
+from .dependencies import get_user_by_id
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Tier 1: per-process LRU. Verified claims live until the JWT expires; user snapshots
+# only briefly, since other workers can't reach this tier when a user changes.
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_TOKEN_CACHE_TTL = int(os.getenv("AUTH_TOKEN_CACHE_TTL", "3600"))
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "10000"))
+AUTH_USER_LOCAL_TTL = int(os.getenv("AUTH_USER_LOCAL_TTL", "15"))
+# Tier 2: shared Redis snapshot, dropped explicitly whenever a cached field changes
+AUTH_USER_REDIS_TTL = int(os.getenv("AUTH_USER_REDIS_TTL", "300"))
+
+USER_KEY_PREFIX = "auth:user:"
+_DIRTY_USERS_KEY = "auth_cache_dirty_users"
+
+_token_claims = TTLCache(maxsize=AUTH_TOKEN_CACHE_SIZE, ttl=AUTH_TOKEN_CACHE_TTL)
+_user_snapshots = TTLCache(maxsize=AUTH_USER_CACHE_SIZE, ttl=AUTH_USER_LOCAL_TTL)
+_pending_invalidations = set()
+
+
+class UserSnapshot:
+    """Compact, detached view of a user row; what protected routes actually read"""
+    __slots__ = (
+        "user_id", "email", "username", "first_name", "last_name", "display_name",
+        "created_at", "whoop_user_id", "spotify_user_id", "is_active"
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        return cls(**{name: getattr(user, name) for name in cls.__slots__})
+
+    @classmethod
+    def from_json(cls, raw: bytes) -> "UserSnapshot":
+        fields = json.loads(raw)
+        if fields.get("created_at"):
+            fields["created_at"] = datetime.fromisoformat(fields["created_at"])
+        return cls(**fields)
+
+    def to_json(self) -> str:
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        if self.created_at:
+            fields["created_at"] = self.created_at.isoformat()
+        return json.dumps(fields)
+
+
+def token_cache_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def get_cached_claims(token: str) -> Optional[Dict[str, Any]]:
+    claims = _token_claims.get(token_cache_key(token))
+    CACHE_REQUESTS.labels("auth_claims", "hit" if claims is not None else "miss").inc()
+    return claims
+
+def cache_claims(token: str, claims: Dict[str, Any]):
+    # never let a cached verification outlive the token itself
+    remaining = claims.get("exp", 0) - time.time()
+    _token_claims.set(token_cache_key(token), claims, ttl=remaining)
+
+async def get_user_snapshot(db: AsyncSession, user_id: str) -> Optional[UserSnapshot]:
+    """Local LRU -> Redis -> Postgres, filling the faster tiers on the way back"""
+    snapshot = _user_snapshots.get(user_id)
+    if snapshot is not None:
+        CACHE_REQUESTS.labels("auth_user", "local_hit").inc()
+        return snapshot
+
+    try:
+        raw = await redis_client.get(USER_KEY_PREFIX + user_id)
+        if raw:
+            snapshot = UserSnapshot.from_json(raw)
+            _user_snapshots.set(user_id, snapshot)
+            CACHE_REQUESTS.labels("auth_user", "redis_hit").inc()
+            return snapshot
+    except Exception as e:
+        logger.warning("Auth cache Redis read failed: %s", e)
+    CACHE_REQUESTS.labels("auth_user", "miss").inc()
+
+    user = await get_user_by_id(db, user_id)
+    if not user:
+        return None
+
+    snapshot = UserSnapshot.from_user(user)
+    _user_snapshots.set(user_id, snapshot)
+    try:
+        await redis_client.set(USER_KEY_PREFIX + user_id, snapshot.to_json(), ex=AUTH_USER_REDIS_TTL)
+    except Exception as e:
+        logger.warning("Auth cache Redis write failed: %s", e)
+    return snapshot
+
+async def invalidate_users(user_ids: Iterable[str]):
+    user_ids = list(user_ids)
+    for user_id in user_ids:
+        _user_snapshots.delete(user_id)
+    try:
+        await redis_client.delete(*[USER_KEY_PREFIX + user_id for user_id in user_ids])
+    except Exception as e:
+        logger.warning("Auth cache Redis invalidation failed: %s", e)
+
+async def invalidate_user(user_id: str):
+    await invalidate_users([user_id])
+
+# ================================================================================================
+# INVALIDATION HOOKS
+# Any ORM write to a cached, security-relevant column marks the user dirty on its session;
+# the snapshot is dropped from both tiers once that session commits.
+# ================================================================================================
+def _mark_user_dirty(target, value, oldvalue, initiator):
+    if value == oldvalue or not target.user_id:
+        return
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_DIRTY_USERS_KEY, set()).add(target.user_id)
+
+for _attribute in (User.whoop_user_id, User.spotify_user_id, User.is_active):
+    event.listen(_attribute, "set", _mark_user_dirty)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    dirty = session.info.pop(_DIRTY_USERS_KEY, None)
+    if not dirty:
+        return
+
+    for user_id in dirty:
+        _user_snapshots.delete(user_id)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    task = loop.create_task(invalidate_users(dirty))
+    _pending_invalidations.add(task)
+    task.add_done_callback(_pending_invalidations.discard)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_dirty_on_rollback(session):
+    session.info.pop(_DIRTY_USERS_KEY, None)
@@ -0,0 +1,71 @@
+"""Flags regressions between two benchmark runs: python -m benchmarks.compare before.json after.json"""
+from typing import Any, Dict, List, Tuple
+
+import argparse
+import json
+import sys
+
+WATCHED_PERCENTILES = ("p50", "p95", "p99")
+GATED_PERCENTILES = ("p95", "p99")
+
+
+def _change(before: float, after: float) -> float:
+    return (after - before) / before if before else 0.0
+
+def compare(baseline: Dict[str, Any], candidate: Dict[str, Any], threshold: float) -> Tuple[List[str], List[str]]:
+    lines, regressions = [], []
+    before_levels = {level["concurrency"]: level for level in baseline["levels"]}
+
+    for after in candidate["levels"]:
+        before = before_levels.get(after["concurrency"])
+        if before is None:
+            continue
+        concurrency = after["concurrency"]
+        lines.append(f"concurrency {concurrency}")
+
+        rows = [("all", before, after)] + [
+            (name, before["operations"][name], op)
+            for name, op in after["operations"].items() if name in before["operations"]
+        ]
+        for name, old, new in rows:
+            change = _change(old["throughput_rps"], new["throughput_rps"])
+            cells = [f"{old['throughput_rps']:>9.1f} -> {new['throughput_rps']:<9.1f} rps ({change:+.1%})"]
+            if name == "all" and change < -threshold:
+                regressions.append(f"c={concurrency} throughput {change:+.1%}")
+            for pct in WATCHED_PERCENTILES:
+                old_ms, new_ms = old["latency_ms"][pct], new["latency_ms"][pct]
+                change = _change(old_ms, new_ms)
+                cells.append(f"{pct} {old_ms:.1f}->{new_ms:.1f}ms ({change:+.1%})")
+                if pct in GATED_PERCENTILES and change > threshold:
+                    regressions.append(f"c={concurrency} {name} {pct} {change:+.1%}")
+            lines.append(f"  {name:<16} " + "  ".join(cells))
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark runs")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative regression (default: 0.10)")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"baseline  {baseline['meta'].get('commit')}  {baseline['meta'].get('started_at')}")
+    print(f"candidate {candidate['meta'].get('commit')}  {candidate['meta'].get('started_at')}")
+    lines, regressions = compare(baseline, candidate, args.threshold)
+    print("\n".join(lines))
+
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        sys.exit(1)
+    print(f"\n✅ no regressions beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+"""Local Whoop and Spotify stand-ins for benchmarks: python -m benchmarks.fake_providers --port 8020"""
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+import argparse
+import asyncio
+import hashlib
+import random
+import secrets
+import time
+import uuid
+import os
+
+import uvicorn
+
+CONFIG = {
+    "latency_ms": float(os.getenv("FAKE_LATENCY_MS", "50")),
+    "latency_jitter_ms": float(os.getenv("FAKE_LATENCY_JITTER_MS", "25")),
+    "token_latency_ms": float(os.getenv("FAKE_TOKEN_LATENCY_MS", "100")),
+    "token_ttl": int(os.getenv("FAKE_TOKEN_TTL", "3600")),
+    # probability that an API call finds its access token revoked (forces a refresh)
+    "error_401_rate": float(os.getenv("FAKE_401_RATE", "0")),
+    # probability of a spurious 429, on top of the per-minute limit below
+    "error_429_rate": float(os.getenv("FAKE_429_RATE", "0")),
+    "retry_after": int(os.getenv("FAKE_RETRY_AFTER", "1")),
+    # requests per minute across all Whoop calls; 0 disables the limit
+    "whoop_rate_limit": int(os.getenv("FAKE_WHOOP_RATE_LIMIT", "0")),
+    "whoop_days": int(os.getenv("FAKE_WHOOP_DAYS", "90")),
+    "spotify_plays_per_day": int(os.getenv("FAKE_SPOTIFY_PLAYS_PER_DAY", "40")),
+    "spotify_idle_rate": float(os.getenv("FAKE_SPOTIFY_IDLE_RATE", "0.3")),
+}
+
+WHOOP_MAX_PAGE = 25
+SPOTIFY_MAX_LIMIT = 50
+SPORTS = ["running", "cycling", "weightlifting", "functional-fitness", "yoga", "swimming"]
+
+app = FastAPI(title="Fake Whoop/Spotify")
+
+_access_tokens: Dict[str, Dict[str, Any]] = {}
+_refresh_tokens: Dict[str, Dict[str, Any]] = {}
+_datasets: Dict[tuple, Any] = {}
+_whoop_window = deque()
+stats = Counter()
+
+
+def _account_id(code: str) -> int:
+    return int(hashlib.sha1(code.encode()).hexdigest()[:8], 16)
+
+def _iso(value: datetime) -> str:
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+def _parse(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+
+def _issue_tokens(provider: str, account_id: int) -> Dict[str, Any]:
+    access_token = secrets.token_urlsafe(24)
+    refresh_token = secrets.token_urlsafe(24)
+    grant = {"provider": provider, "account_id": account_id}
+    _access_tokens[access_token] = {**grant, "expires_at": time.time() + CONFIG["token_ttl"]}
+    _refresh_tokens[refresh_token] = grant
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "expires_in": CONFIG["token_ttl"],
+        "token_type": "bearer",
+    }
+
+def _grant_for(request: Request, provider: str) -> Optional[Dict[str, Any]]:
+    token = request.headers.get("authorization", "").removeprefix("Bearer ")
+    grant = _access_tokens.get(token)
+    if not grant or grant["provider"] != provider or grant["expires_at"] < time.time():
+        return None
+    if CONFIG["error_401_rate"] and random.random() < CONFIG["error_401_rate"]:
+        _access_tokens.pop(token, None)
+        return None
+    return grant
+
+def _unauthorized() -> JSONResponse:
+    return JSONResponse({"error": "invalid_token"}, status_code=401)
+
+
+@app.middleware("http")
+async def inject_latency_and_limits(request: Request, call_next):
+    path = request.url.path
+    provider = path.strip("/").split("/")[0]
+    is_token = path.endswith("/token")
+    headers = {}
+
+    if provider in ("whoop", "spotify"):
+        base = CONFIG["token_latency_ms"] if is_token else CONFIG["latency_ms"]
+        jitter = random.uniform(0, CONFIG["latency_jitter_ms"])
+        await asyncio.sleep((base + jitter) / 1000)
+
+        if provider == "whoop" and CONFIG["whoop_rate_limit"]:
+            now = time.monotonic()
+            while _whoop_window and _whoop_window[0] <= now - 60:
+                _whoop_window.popleft()
+            remaining = CONFIG["whoop_rate_limit"] - len(_whoop_window)
+            reset = int(60 - (now - _whoop_window[0])) + 1 if _whoop_window else 60
+            headers = {
+                "X-RateLimit-Limit": f"{CONFIG['whoop_rate_limit']}, {CONFIG['whoop_rate_limit']};window=60",
+                "X-RateLimit-Remaining": str(max(remaining - 1, 0)),
+                "X-RateLimit-Reset": str(reset),
+            }
+            if remaining <= 0:
+                stats[(provider, "429")] += 1
+                return JSONResponse({"error": "rate_limited"}, status_code=429, headers={**headers, "Retry-After": str(reset)})
+            _whoop_window.append(now)
+
+        if CONFIG["error_429_rate"] and random.random() < CONFIG["error_429_rate"]:
+            stats[(provider, "429")] += 1
+            return JSONResponse(
+                {"error": "rate_limited"}, status_code=429, headers={"Retry-After": str(CONFIG["retry_after"])}
+            )
+
+    response = await call_next(request)
+    response.headers.update(headers)
+    stats[(provider, str(response.status_code))] += 1
+    return response
+
+
+# ------------------------------------------------------------------------------------------------
+# OAuth token endpoints
+# ------------------------------------------------------------------------------------------------
+async def _token_endpoint(request: Request, provider: str):
+    form = await request.form()
+    grant_type = form.get("grant_type")
+    if grant_type == "authorization_code":
+        return _issue_tokens(provider, _account_id(f"{provider}:{form.get('code')}"))
+    if grant_type == "refresh_token":
+        grant = _refresh_tokens.pop(form.get("refresh_token"), None)
+        if not grant or grant["provider"] != provider:
+            return JSONResponse({"error": "invalid_grant"}, status_code=400)
+        return _issue_tokens(provider, grant["account_id"])
+    return JSONResponse({"error": "unsupported_grant_type"}, status_code=400)
+
+@app.post("/whoop/oauth/oauth2/token")
+async def whoop_token(request: Request):
+    return await _token_endpoint(request, "whoop")
+
+@app.post("/spotify/api/token")
+async def spotify_token(request: Request):
+    return await _token_endpoint(request, "spotify")
+
+
+# ------------------------------------------------------------------------------------------------
+# Whoop
+# ------------------------------------------------------------------------------------------------
+def _whoop_dataset(account_id: int) -> Dict[str, List[Dict[str, Any]]]:
+    """Newest-first records for one account, one cycle/sleep/recovery/workout per day"""
+    key = ("whoop", account_id)
+    if key in _datasets:
+        return _datasets[key]
+
+    rng = random.Random(account_id)
+    today = datetime.now(timezone.utc).replace(hour=6, minute=0, second=0, microsecond=0)
+    data = {"cycle": [], "recovery": [], "activity/sleep": [], "activity/workout": []}
+    for day in range(CONFIG["whoop_days"]):
+        wake = today - timedelta(days=day)
+        sleep_start = wake - timedelta(hours=rng.uniform(6, 9))
+        cycle_id = account_id * 10000 + (CONFIG["whoop_days"] - day)
+        sleep_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        updated = _iso(wake + timedelta(minutes=30))
+
+        data["cycle"].append({
+            "id": cycle_id, "user_id": account_id, "created_at": _iso(sleep_start), "updated_at": updated,
+            "start": _iso(sleep_start), "end": None if day == 0 else _iso(sleep_start + timedelta(days=1)),
+            "timezone_offset": "+00:00", "score_state": "SCORED",
+            "score": {
+                "strain": round(rng.uniform(4, 19), 2), "kilojoule": round(rng.uniform(6000, 14000), 1),
+                "average_heart_rate": rng.randint(55, 80), "max_heart_rate": rng.randint(140, 190),
+            },
+        })
+        data["activity/sleep"].append({
+            "id": sleep_id, "cycle_id": cycle_id, "user_id": account_id, "created_at": _iso(wake),
+            "updated_at": updated, "start": _iso(sleep_start), "end": _iso(wake), "nap": False,
+            "timezone_offset": "+00:00", "score_state": "SCORED",
+            "score": {
+                "sleep_performance_percentage": rng.randint(50, 100),
+                "sleep_efficiency_percentage": round(rng.uniform(75, 98), 1),
+                "respiratory_rate": round(rng.uniform(13, 17), 1),
+            },
+        })
+        data["recovery"].append({
+            "cycle_id": cycle_id, "sleep_id": sleep_id, "user_id": account_id, "created_at": _iso(wake),
+            "updated_at": updated, "score_state": "SCORED",
+            "score": {
+                "user_calibrating": False, "recovery_score": rng.randint(20, 99),
+                "resting_heart_rate": rng.randint(42, 65), "hrv_rmssd_milli": round(rng.uniform(25, 140), 2),
+                "spo2_percentage": round(rng.uniform(94, 99), 1), "skin_temp_celsius": round(rng.uniform(33, 35), 2),
+            },
+        })
+        workout_start = wake + timedelta(hours=rng.uniform(2, 12))
+        data["activity/workout"].append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))), "user_id": account_id,
+            "created_at": _iso(workout_start), "updated_at": updated, "start": _iso(workout_start),
+            "end": _iso(workout_start + timedelta(minutes=rng.randint(25, 90))), "timezone_offset": "+00:00",
+            "sport_name": rng.choice(SPORTS), "score_state": "SCORED",
+            "score": {
+                "strain": round(rng.uniform(5, 17), 2), "average_heart_rate": rng.randint(110, 160),
+                "max_heart_rate": rng.randint(150, 195), "kilojoule": round(rng.uniform(800, 3500), 1),
+                "zone_durations": {
+                    f"zone_{name}_milli": rng.randint(0, 1200000)
+                    for name in ("zero", "one", "two", "three", "four", "five")
+                },
+            },
+        })
+    _datasets[key] = data
+    return data
+
+def _page(records: List[Dict[str, Any]], request: Request, time_field: str, max_limit: int) -> Dict[str, Any]:
+    start, end = _parse(request.query_params.get("start")), _parse(request.query_params.get("end"))
+    if start or end:
+        records = [
+            r for r in records
+            if (not start or _parse(r[time_field]) >= start) and (not end or _parse(r[time_field]) < end)
+        ]
+    limit = min(int(request.query_params.get("limit", 10)), max_limit)
+    offset = int(request.query_params.get("nextToken") or 0)
+    page = records[offset:offset + limit]
+    next_offset = offset + limit
+    return {"records": page, "next_token": str(next_offset) if next_offset < len(records) else None}
+
+@app.get("/whoop/developer/v2/user/profile/basic")
+async def whoop_profile(request: Request):
+    grant = _grant_for(request, "whoop")
+    if not grant:
+        return _unauthorized()
+    account_id = grant["account_id"]
+    return {"user_id": account_id, "email": f"{account_id}@whoop.fake", "first_name": "Bench", "last_name": str(account_id)}
+
+@app.get("/whoop/developer/v2/{collection:path}")
+async def whoop_collection(collection: str, request: Request):
+    grant = _grant_for(request, "whoop")
+    if not grant:
+        return _unauthorized()
+    data = _whoop_dataset(grant["account_id"])
+    if collection in data:
+        return _page(data[collection], request, "created_at" if collection == "recovery" else "start", WHOOP_MAX_PAGE)
+    # single record lookups, e.g. activity/workout/{id} and cycle/{id}/recovery
+    if collection.startswith("cycle/") and collection.endswith("/recovery"):
+        cycle_id = collection.split("/")[1]
+        for record in data["recovery"]:
+            if str(record["cycle_id"]) == cycle_id:
+                return record
+        return JSONResponse({"error": "not_found"}, status_code=404)
+    parent, _, record_id = collection.rpartition("/")
+    for record in data.get(parent, []):
+        if str(record.get("id")) == record_id:
+            return record
+    return JSONResponse({"error": "not_found"}, status_code=404)
+
+
+# ------------------------------------------------------------------------------------------------
+# Spotify
+# ------------------------------------------------------------------------------------------------
+def _track(rng: random.Random) -> Dict[str, Any]:
+    track_id = "".join(rng.choice("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789") for _ in range(22))
+    artist_id = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(22))
+    return {
+        "id": track_id,
+        "name": f"Track {track_id[:6]}",
+        "duration_ms": rng.randint(120000, 330000),
+        "artists": [{"id": artist_id, "name": f"Artist {artist_id[:4]}"}],
+        "album": {"id": artist_id[::-1], "name": f"Album {artist_id[:5]}"},
+        "uri": f"spotify:track:{track_id}",
+    }
+
+def _spotify_dataset(account_id: int) -> tuple:
+    """(track catalog, newest-first play history); tracks repeat so there is realistic overlap"""
+    key = ("spotify", account_id)
+    if key in _datasets:
+        return _datasets[key]
+
+    rng = random.Random(account_id)
+    catalog = [_track(rng) for _ in range(200)]
+    now = datetime.now(timezone.utc)
+    plays = []
+    played_at = now - timedelta(minutes=5)
+    for _ in range(CONFIG["spotify_plays_per_day"] * 14):
+        track = rng.choice(catalog)
+        plays.append({"track": track, "played_at": _iso(played_at), "context": None})
+        played_at -= timedelta(milliseconds=track["duration_ms"] + rng.randint(0, 3600000 * 24 // CONFIG["spotify_plays_per_day"]))
+    _datasets[key] = (catalog, plays)
+    return _datasets[key]
+
+def _ms(value: str) -> int:
+    return int(_parse(value).timestamp() * 1000)
+
+@app.get("/spotify/v1/me")
+async def spotify_me(request: Request):
+    grant = _grant_for(request, "spotify")
+    if not grant:
+        return _unauthorized()
+    account_id = grant["account_id"]
+    return {"id": f"bench{account_id}", "display_name": f"Bench {account_id}", "email": f"{account_id}@spotify.fake"}
+
+@app.get("/spotify/v1/me/player/recently-played")
+async def spotify_recently_played(request: Request):
+    grant = _grant_for(request, "spotify")
+    if not grant:
+        return _unauthorized()
+    _, plays = _spotify_dataset(grant["account_id"])
+    limit = min(int(request.query_params.get("limit", 20)), SPOTIFY_MAX_LIMIT)
+    after, before = request.query_params.get("after"), request.query_params.get("before")
+    if after:
+        # oldest plays right after the cursor, returned newest first like Spotify does
+        items = [p for p in plays if _ms(p["played_at"]) > int(after)][-limit:]
+    else:
+        items = [p for p in plays if not before or _ms(p["played_at"]) < int(before)][:limit]
+    cursors = {"after": str(_ms(items[0]["played_at"])), "before": str(_ms(items[-1]["played_at"]))} if items else None
+    return {"items": items, "limit": limit, "cursors": cursors}
+
+def _paged_items(request: Request, items: List[Any]) -> Dict[str, Any]:
+    limit = min(int(request.query_params.get("limit", 20)), SPOTIFY_MAX_LIMIT)
+    offset = int(request.query_params.get("offset", 0))
+    return {"items": items[offset:offset + limit], "limit": limit, "offset": offset, "total": len(items)}
+
+@app.get("/spotify/v1/me/top/tracks")
+async def spotify_top_tracks(request: Request):
+    grant = _grant_for(request, "spotify")
+    if not grant:
+        return _unauthorized()
+    _, plays = _spotify_dataset(grant["account_id"])
+    counts: Dict[str, int] = {}
+    tracks = {}
+    for play in plays:
+        counts[play["track"]["id"]] = counts.get(play["track"]["id"], 0) + 1
+        tracks[play["track"]["id"]] = play["track"]
+    top = sorted(tracks.values(), key=lambda t: counts[t["id"]], reverse=True)
+    return _paged_items(request, top)
+
+@app.get("/spotify/v1/me/tracks")
+async def spotify_saved_tracks(request: Request):
+    grant = _grant_for(request, "spotify")
+    if not grant:
+        return _unauthorized()
+    catalog, _ = _spotify_dataset(grant["account_id"])
+    # every third catalog track is "saved"
+    saved = [{"added_at": "2025-01-01T00:00:00Z", "track": track} for track in catalog[::3]]
+    return _paged_items(request, saved)
+
+@app.get("/spotify/v1/audio-features")
+async def spotify_audio_features(request: Request):
+    grant = _grant_for(request, "spotify")
+    if not grant:
+        return _unauthorized()
+    ids = [i for i in request.query_params.get("ids", "").split(",") if i][:100]
+    features = []
+    for track_id in ids:
+        rng = random.Random(track_id)
+        features.append({
+            "id": track_id, "type": "audio_features",
+            "tempo": round(rng.uniform(70, 180), 3), "energy": round(rng.random(), 3),
+            "valence": round(rng.random(), 3), "danceability": round(rng.random(), 3),
+            "acousticness": round(rng.random(), 3), "instrumentalness": round(rng.random() ** 3, 3),
+            "loudness": round(rng.uniform(-20, -3), 2), "duration_ms": rng.randint(120000, 330000),
+        })
+    return {"audio_features": features}
+
+@app.get("/spotify/v1/me/player/currently-playing")
+async def spotify_currently_playing(request: Request):
+    grant = _grant_for(request, "spotify")
+    if not grant:
+        return _unauthorized()
+    if random.random() < CONFIG["spotify_idle_rate"]:
+        return Response(status_code=204)
+    catalog, _ = _spotify_dataset(grant["account_id"])
+    # the same song for a few minutes at a time, so pollers see realistic change rates
+    slot = int(time.time() // 180)
+    track = catalog[(grant["account_id"] + slot) % len(catalog)]
+    return {
+        "is_playing": True,
+        "progress_ms": int(time.time() % 180 * 1000) % track["duration_ms"],
+        "timestamp": int(time.time() * 1000),
+        "currently_playing_type": "track",
+        "item": track,
+    }
+
+
+# ------------------------------------------------------------------------------------------------
+# Harness helpers
+# ------------------------------------------------------------------------------------------------
+@app.get("/_stats")
+async def get_stats():
+    return {"responses": {f"{provider}:{status}": count for (provider, status), count in stats.items()}}
+
+@app.post("/_config")
+async def update_config(request: Request):
+    """Change behaviour mid-run, e.g. switch on 429s for one benchmark phase"""
+    CONFIG.update({key: type(CONFIG[key])(value) for key, value in (await request.json()).items() if key in CONFIG})
+    return CONFIG
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Whoop/Spotify APIs for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8020)
+    for key, value in CONFIG.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+    CONFIG.update({key: getattr(args, key) for key in CONFIG})
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,329 @@
+"""Benchmark harness: python -m benchmarks.run --concurrency 1,10,50 --duration 30 --output bench.json"""
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+DEFAULT_MIX = "login=1,me=6,recovery=3,recently_played=3"
+
+# name -> (method, path); login is handled separately since it needs a body
+OPERATIONS = {
+    "login": ("POST", "/app/login"),
+    "me": ("GET", "/app/me"),
+    "recovery": ("GET", "/whoop/recovery"),
+    "recently_played": ("GET", "/spotify/recently-played"),
+}
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class BenchUser:
+    def __init__(self, email: str, password: str):
+        self.email = email
+        self.password = password
+        self.token: Optional[str] = None
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation '{name}', expected one of {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def parse_levels(value: str) -> List[int]:
+    return [int(level) for level in value.split(",") if level]
+
+def percentile(ordered: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    summary = {f"p{pct}": round(percentile(ordered, pct) * 1000, 3) for pct in PERCENTILES}
+    summary["max"] = round(ordered[-1] * 1000, 3) if ordered else 0.0
+    summary["mean"] = round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0
+    return summary
+
+def git_revision() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT, capture_output=True, text=True
+        ).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+@contextmanager
+def background_process(name: str, command: List[str], env: Dict[str, str], log_dir: Path):
+    log_path = log_dir / f"{name}.log"
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(command, cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    print(f"▶️  started {name} (pid {process.pid}), log: {log_path}")
+    try:
+        yield process
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+async def wait_until_up(client: httpx.AsyncClient, url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(url)).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.25)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+async def login(client: httpx.AsyncClient, user: BenchUser) -> httpx.Response:
+    response = await client.post("/app/login", json={"email": user.email, "password": user.password})
+    if response.status_code == 200:
+        user.token = response.json()["access_token"]
+    return response
+
+async def link_provider(client: httpx.AsyncClient, user: BenchUser, provider: str):
+    """Run the real OAuth callback; the fake accepts any code and maps it to a stable account"""
+    start = await client.get(f"/{provider}/auth/login", headers=user.headers)
+    start.raise_for_status()
+    callback = await client.get(
+        f"/{provider}/auth/callback", params={"code": user.email, "state": start.json()["state"]}
+    )
+    result = callback.json() if callback.headers.get("content-type", "").startswith("application/json") else {}
+    if not result.get("success"):
+        raise RuntimeError(f"linking {provider} for {user.email} failed: {callback.status_code} {callback.text[:200]}")
+
+async def seed_users(client: httpx.AsyncClient, count: int, prefix: str, password: str) -> List[BenchUser]:
+    users = [BenchUser(f"{prefix}-{i}@bench.fitpro.local", password) for i in range(count)]
+    # PBKDF2 is deliberately slow and bounded server-side; seed a few at a time
+    semaphore = asyncio.Semaphore(4)
+
+    async def seed(user: BenchUser):
+        async with semaphore:
+            registered = await client.post("/app/register", json={"email": user.email, "password": user.password})
+            if registered.status_code not in (200, 400):
+                registered.raise_for_status()
+            (await login(client, user)).raise_for_status()
+            await link_provider(client, user, "whoop")
+            await link_provider(client, user, "spotify")
+            # the first local-store read syncs inline; keep that out of the measurements
+            await client.get("/whoop/recovery", headers=user.headers)
+
+    await asyncio.gather(*(seed(user) for user in users))
+    return users
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    users: List[BenchUser],
+    mix: Dict[str, float],
+    concurrency: int,
+    duration: float,
+    seed: int
+) -> Dict[str, Any]:
+    samples: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Counter] = defaultdict(Counter)
+    names, weights = list(mix), list(mix.values())
+    deadline = time.monotonic() + duration
+
+    async def worker(index: int):
+        rng = random.Random(seed * 1000 + index)
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            user = rng.choice(users)
+            started = time.perf_counter()
+            try:
+                if name == "login":
+                    response = await login(client, user)
+                else:
+                    method, path = OPERATIONS[name]
+                    response = await client.request(method, path, headers=user.headers)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            samples[name].append(time.perf_counter() - started)
+            statuses[name][status] += 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.monotonic() - started
+
+    operations = {}
+    for name in names:
+        count = len(samples[name])
+        failed = sum(n for status, n in statuses[name].items() if not status.startswith("2"))
+        operations[name] = {
+            "requests": count,
+            "throughput_rps": round(count / elapsed, 2),
+            "error_rate": round(failed / count, 4) if count else 0.0,
+            "status": dict(statuses[name]),
+            "latency_ms": latency_summary(samples[name]),
+        }
+
+    all_samples = [value for values in samples.values() for value in values]
+    total_failed = sum(op["error_rate"] * op["requests"] for op in operations.values())
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "requests": len(all_samples),
+        "throughput_rps": round(len(all_samples) / elapsed, 2),
+        "error_rate": round(total_failed / len(all_samples), 4) if all_samples else 0.0,
+        "latency_ms": latency_summary(all_samples),
+        "operations": operations,
+    }
+
+
+async def benchmark(args, app_url: str, fake_url: Optional[str]) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=max(args.concurrency) + 10, max_keepalive_connections=max(args.concurrency) + 10)
+    async with httpx.AsyncClient(base_url=app_url, timeout=args.timeout, limits=limits) as client:
+        await wait_until_up(client, "/health")
+        print(f"🌱 seeding {args.users} users")
+        users = await seed_users(client, args.users, args.user_prefix, args.password)
+
+        if args.warmup:
+            print(f"🔥 warming up for {args.warmup}s")
+            await run_level(client, users, args.mix, max(args.concurrency), args.warmup, args.seed)
+
+        levels = []
+        for concurrency in args.concurrency:
+            print(f"⏱️  concurrency {concurrency} for {args.duration}s")
+            result = await run_level(client, users, args.mix, concurrency, args.duration, args.seed)
+            latency = result["latency_ms"]
+            print(
+                f"   {result['throughput_rps']} req/s, p50 {latency['p50']}ms, p95 {latency['p95']}ms, "
+                f"p99 {latency['p99']}ms, errors {result['error_rate']:.2%}"
+            )
+            levels.append(result)
+
+        providers = None
+        if fake_url:
+            async with httpx.AsyncClient(base_url=fake_url) as fake:
+                providers = (await fake.get("/_stats")).json()
+
+    return {"levels": levels, "providers": providers}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FitPro API benchmark")
+    parser.add_argument("--concurrency", type=parse_levels, default=parse_levels("1,10,50"),
+                        help="comma-separated concurrency levels (default: 1,10,50)")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per concurrency level")
+    parser.add_argument("--warmup", type=float, default=5, help="unrecorded seconds before the first level")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"operation weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--user-prefix", default="bench")
+    parser.add_argument("--password", default="bench-password")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+
+    parser.add_argument("--app-url", help="benchmark a running API instead of starting one")
+    parser.add_argument("--app-port", type=int, default=8100)
+    parser.add_argument("--app-workers", type=int, default=1)
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the API process, repeatable")
+    parser.add_argument("--fake-port", type=int, default=8120)
+    parser.add_argument("--provider-latency-ms", type=float, default=50)
+    parser.add_argument("--provider-jitter-ms", type=float, default=25)
+    parser.add_argument("--provider-401-rate", type=float, default=0.0)
+    parser.add_argument("--provider-429-rate", type=float, default=0.0)
+    parser.add_argument("--whoop-rate-limit", type=int, default=0, help="fake Whoop requests/minute (0: unlimited)")
+    parser.add_argument("--log-dir", help="where the API and fake provider logs go (default: a temp dir)")
+    args = parser.parse_args()
+
+    log_dir = Path(args.log_dir or tempfile.mkdtemp(prefix="fitpro-bench-"))
+    log_dir.mkdir(parents=True, exist_ok=True)
+    started_at = datetime.now(timezone.utc).isoformat()
+
+    if args.app_url:
+        results = asyncio.run(benchmark(args, args.app_url, None))
+    else:
+        fake_url = f"http://127.0.0.1:{args.fake_port}"
+        fake_env = {
+            **os.environ,
+            "FAKE_LATENCY_MS": str(args.provider_latency_ms),
+            "FAKE_LATENCY_JITTER_MS": str(args.provider_jitter_ms),
+            "FAKE_401_RATE": str(args.provider_401_rate),
+            "FAKE_429_RATE": str(args.provider_429_rate),
+            "FAKE_WHOOP_RATE_LIMIT": str(args.whoop_rate_limit),
+        }
+        app_env = {
+            **os.environ,
+            "WHOOP_CLIENT_ID": os.getenv("WHOOP_CLIENT_ID", "bench-whoop"),
+            "SPOTIFY_CLIENT_ID": os.getenv("SPOTIFY_CLIENT_ID", "bench-spotify"),
+            "WHOOP_TOKEN_URL": f"{fake_url}/whoop/oauth/oauth2/token",
+            "WHOOP_API_BASE_URL": f"{fake_url}/whoop/developer/v2",
+            "SPOTIFY_TOKEN_URL": f"{fake_url}/spotify/api/token",
+            "SPOTIFY_API_BASE_URL": f"{fake_url}/spotify/v1",
+            **dict(item.split("=", 1) for item in args.app_env),
+        }
+        app_command = [
+            sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.app_port),
+            "--workers", str(args.app_workers), "--log-level", "warning", "--no-access-log",
+        ]
+        fake_command = [sys.executable, "-m", "benchmarks.fake_providers", "--port", str(args.fake_port)]
+
+        with background_process("fake_providers", fake_command, fake_env, log_dir), \
+             background_process("api", app_command, app_env, log_dir):
+            results = asyncio.run(benchmark(args, f"http://127.0.0.1:{args.app_port}", fake_url))
+
+    report = {
+        "meta": {
+            **git_revision(),
+            "started_at": started_at,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": {
+                key: value for key, value in vars(args).items()
+                if key not in ("password", "output", "log_dir")
+            },
+        },
+        **results,
+    }
+
+    body = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(body)
+        print(f"📄 results written to {args.output}")
+    else:
+        print(body)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Optional
+from dotenv import load_dotenv
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import os
+
+from databases.database import redis_client
+from monitoring.metrics import CACHE_REQUESTS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+REVALIDATE_LOCK_SECONDS = 30
+
+# (provider, endpoint) -> seconds fresh, then seconds more it may be served stale while refetching.
+# Endpoints not listed here are never cached. `warm` lists the exact params callers request with
+# (they are part of the cache key), for the warm_cache job.
+RESPONSE_CACHE_POLICIES = {
+    ("whoop", "user/profile/basic"): {"ttl": 3600, "swr": 86400, "warm": [None]},
+    ("spotify", "me"): {"ttl": 3600, "swr": 86400, "warm": [None]},
+    ("spotify", "me/player/recently-played"): {"ttl": 60, "swr": 300, "warm": [{"limit": 20, "offset": 0}]},
+    # recommendation seed sources; top tracks only move over weeks, saved ones when the user saves
+    ("spotify", "me/top/tracks"): {"ttl": 3600, "swr": 86400, "warm": [{"limit": 50}]},
+    ("spotify", "me/tracks"): {"ttl": 600, "swr": 3600, "warm": [{"limit": 50}]},
+}
+
+
+class ResponseCache:
+    """
+    Redis cache for upstream GET responses keyed by (user, provider, endpoint, params).
+
+    Each (provider, user) keeps an index set of its keys, so relinking or unlinking an
+    account drops everything cached for it without scanning the keyspace.
+    """
+
+    def __init__(self, policies: Dict[tuple, Dict[str, int]]):
+        self.policies = policies
+        self.stats = defaultdict(lambda: {"hit": 0, "stale": 0, "miss": 0})
+        self._revalidating: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def _index_key(provider: str, user_id: str) -> str:
+        return f"resp_cache_index:{provider}:{user_id}"
+
+    @staticmethod
+    def _entry_key(provider: str, user_id: str, endpoint: str, params: Optional[dict]) -> str:
+        params_hash = hashlib.sha1(json.dumps(params or {}, sort_keys=True, default=str).encode()).hexdigest()
+        return f"resp_cache:{provider}:{user_id}:{endpoint}:{params_hash}"
+
+    async def _store(self, provider: str, user_id: str, key: str, data: Any, policy: Dict[str, int]):
+        ttl = policy["ttl"] + policy["swr"]
+        index_key = self._index_key(provider, user_id)
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.set(key, json.dumps({"data": data, "stored_at": time.time()}), ex=ttl)
+                pipe.sadd(index_key, key)
+                pipe.expire(index_key, ttl)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("Response cache write failed for %s: %s", key, e)
+
+    async def _revalidate(self, provider, user_id, key, policy, revalidate: Callable[[], Awaitable[Any]]):
+        try:
+            # one refetch per key across all workers
+            if not await redis_client.set(f"{key}:revalidating", 1, nx=True, ex=REVALIDATE_LOCK_SECONDS):
+                return
+            data = await revalidate()
+            await self._store(provider, user_id, key, data, policy)
+        except Exception as e:
+            logger.warning("Response cache revalidation failed for %s: %s", key, e)
+        finally:
+            self._revalidating.pop(key, None)
+
+    async def get_or_fetch(
+        self,
+        provider: str,
+        user_id: str,
+        endpoint: str,
+        params: Optional[dict],
+        fetch: Callable[[], Awaitable[Any]],
+        revalidate: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        fetch runs inline on a miss; revalidate runs in the background for stale hits,
+        so it must not depend on the caller's request-scoped resources.
+        """
+        endpoint = endpoint.strip("/")
+        policy = self.policies.get((provider, endpoint))
+        if not RESPONSE_CACHE_ENABLED or policy is None:
+            return await fetch()
+
+        stats = self.stats[f"{provider}:{endpoint}"]
+        key = self._entry_key(provider, user_id, endpoint, params)
+        try:
+            raw = await redis_client.get(key)
+        except Exception as e:
+            logger.warning("Response cache read failed for %s: %s", key, e)
+            raw = None
+
+        if raw:
+            entry = json.loads(raw)
+            age = time.time() - entry["stored_at"]
+            if age <= policy["ttl"]:
+                stats["hit"] += 1
+                CACHE_REQUESTS.labels("response", "hit").inc()
+                return entry["data"]
+
+            stats["stale"] += 1
+            CACHE_REQUESTS.labels("response", "stale").inc()
+            if key not in self._revalidating:
+                self._revalidating[key] = asyncio.create_task(
+                    self._revalidate(provider, user_id, key, policy, revalidate)
+                )
+            return entry["data"]
+
+        stats["miss"] += 1
+        CACHE_REQUESTS.labels("response", "miss").inc()
+        data = await fetch()
+        await self._store(provider, user_id, key, data, policy)
+        return data
+
+    async def invalidate(self, provider: str, user_id: str):
+        """Drop every cached response for this user's provider account"""
+        index_key = self._index_key(provider, user_id)
+        try:
+            keys = await redis_client.smembers(index_key)
+            await redis_client.delete(index_key, *keys)
+        except Exception as e:
+            logger.warning("Response cache invalidation failed for %s/%s: %s", provider, user_id, e)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        report = {}
+        for name, counts in self.stats.items():
+            total = counts["hit"] + counts["stale"] + counts["miss"]
+            report[name] = {
+                **counts,
+                "hit_ratio": round((counts["hit"] + counts["stale"]) / total, 4) if total else 0.0
+            }
+        return report
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_POLICIES)
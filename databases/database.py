@@ -1,25 +1,30 @@
 import os
 import uuid
+import logging
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import Column, String, DateTime, Text, Boolean, ForeignKey, Date
+from sqlalchemy import Column, String, DateTime, Text, Boolean, ForeignKey, Date, BigInteger, Float, Integer, Index, UniqueConstraint
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 import redis.asyncio as redis
 from cryptography.fernet import Fernet
 from dotenv import load_dotenv
+from monitoring.metrics import InstrumentedAsyncPool, register_pool_metrics
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv("DATABASE_URL")
-print(f"Using DATABASE_URL: {DATABASE_URL}") 
-engine = create_async_engine(DATABASE_URL, pool_size=20, max_overflow=0,pool_pre_ping=True,echo=False)
+engine = create_async_engine(DATABASE_URL, poolclass=InstrumentedAsyncPool, pool_size=20, max_overflow=0,pool_pre_ping=True,echo=False)
+register_pool_metrics(engine)
 AsyncSessionLocal = async_sessionmaker(engine, class_=AsyncSession)
 
 REDIS_URL = os.getenv("REDIS_URL")
 try:
     redis_client = redis.from_url(REDIS_URL)
 except Exception as e:
-    print(f"Redis connection failed: {e}")
+    logger.error("Redis connection failed: %s", e)
     redis_client = None
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable must be set")
@@ -80,6 +85,9 @@ class OAuthToken(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+    # one token per user per provider; store_oauth_token upserts against it
+    __table_args__ = (UniqueConstraint("user_id", "provider_name"),)
+
 class OAuthState(Base):
     __tablename__ = "oauth_states"
     
@@ -90,6 +98,154 @@ class OAuthState(Base):
     expires_at = Column(DateTime(timezone=True), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     extra_data = Column(Text, nullable=True) 
+
+# Local copies of Whoop v2 records; `data` keeps the raw API record, the other columns are for querying
+class WhoopCycle(Base):
+    __tablename__ = "whoop_cycles"
+
+    cycle_id = Column(BigInteger, primary_key=True)
+    user_id = Column(String(36), ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False)
+    start_time = Column(DateTime(timezone=True), nullable=False)
+    end_time = Column(DateTime(timezone=True), nullable=True)
+    score_state = Column(String(32), nullable=True)
+    strain = Column(Float, nullable=True)
+    kilojoule = Column(Float, nullable=True)
+    average_heart_rate = Column(Integer, nullable=True)
+    max_heart_rate = Column(Integer, nullable=True)
+    data = Column(JSONB, nullable=False)
+    whoop_updated_at = Column(DateTime(timezone=True), nullable=False)
+    synced_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (Index("idx_whoop_cycles_user_start", "user_id", "start_time"),)
+
+class WhoopRecovery(Base):
+    __tablename__ = "whoop_recoveries"
+
+    cycle_id = Column(BigInteger, primary_key=True)
+    sleep_id = Column(String(36), nullable=True)
+    user_id = Column(String(36), ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False)
+    score_state = Column(String(32), nullable=True)
+    recovery_score = Column(Float, nullable=True)
+    resting_heart_rate = Column(Float, nullable=True)
+    hrv_rmssd_milli = Column(Float, nullable=True)
+    spo2_percentage = Column(Float, nullable=True)
+    skin_temp_celsius = Column(Float, nullable=True)
+    data = Column(JSONB, nullable=False)
+    whoop_created_at = Column(DateTime(timezone=True), nullable=False)
+    whoop_updated_at = Column(DateTime(timezone=True), nullable=False)
+    synced_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (Index("idx_whoop_recoveries_user_created", "user_id", "whoop_created_at"),)
+
+class WhoopSleep(Base):
+    __tablename__ = "whoop_sleeps"
+
+    sleep_id = Column(String(36), primary_key=True)
+    cycle_id = Column(BigInteger, nullable=True)
+    user_id = Column(String(36), ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False)
+    start_time = Column(DateTime(timezone=True), nullable=False)
+    end_time = Column(DateTime(timezone=True), nullable=True)
+    nap = Column(Boolean, default=False)
+    score_state = Column(String(32), nullable=True)
+    sleep_performance_percentage = Column(Float, nullable=True)
+    sleep_efficiency_percentage = Column(Float, nullable=True)
+    data = Column(JSONB, nullable=False)
+    whoop_updated_at = Column(DateTime(timezone=True), nullable=False)
+    synced_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (Index("idx_whoop_sleeps_user_start", "user_id", "start_time"),)
+
+class WhoopWorkout(Base):
+    __tablename__ = "whoop_workouts"
+
+    workout_id = Column(String(36), primary_key=True)
+    user_id = Column(String(36), ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False)
+    start_time = Column(DateTime(timezone=True), nullable=False)
+    end_time = Column(DateTime(timezone=True), nullable=True)
+    sport_name = Column(String(100), nullable=True)
+    score_state = Column(String(32), nullable=True)
+    strain = Column(Float, nullable=True)
+    average_heart_rate = Column(Integer, nullable=True)
+    max_heart_rate = Column(Integer, nullable=True)
+    data = Column(JSONB, nullable=False)
+    whoop_updated_at = Column(DateTime(timezone=True), nullable=False)
+    synced_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (Index("idx_whoop_workouts_user_start", "user_id", "start_time"),)
+
+# Spotify listening history; `data` keeps the raw recently-played item
+class SpotifyPlay(Base):
+    __tablename__ = "spotify_plays"
+
+    user_id = Column(String(36), ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
+    played_at = Column(DateTime(timezone=True), primary_key=True)
+    track_id = Column(String(64), nullable=False)
+    track_name = Column(Text, nullable=True)
+    artist_names = Column(Text, nullable=True)
+    album_name = Column(Text, nullable=True)
+    duration_ms = Column(Integer, nullable=True)
+    context_uri = Column(Text, nullable=True)
+    data = Column(JSONB, nullable=False)
+    synced_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (Index("idx_spotify_plays_user_track", "user_id", "track_id", "played_at"),)
+
+# Whoop workouts joined with the Spotify plays that overlapped them, one row per (workout, play)
+class WorkoutSoundtrack(Base):
+    __tablename__ = "workout_soundtrack"
+
+    user_id = Column(String(36), ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
+    workout_id = Column(String(36), primary_key=True)
+    played_at = Column(DateTime(timezone=True), primary_key=True)
+    workout_start = Column(DateTime(timezone=True), nullable=False)
+    track_id = Column(String(64), nullable=False)
+    track_name = Column(Text, nullable=True)
+    artist_name = Column(Text, nullable=True)
+    tempo = Column(Float, nullable=True)
+    overlap_seconds = Column(Float, nullable=False)
+    strain = Column(Float, nullable=True)
+    average_heart_rate = Column(Integer, nullable=True)
+    high_zone_share = Column(Float, nullable=True)  # share of the workout spent in heart-rate zones 4-5
+
+    __table_args__ = (Index("idx_workout_soundtrack_user_start", "user_id", "workout_start"),)
+
+# Whoop metrics per user per cycle day, and per Monday-start week, behind the trends endpoint
+class WhoopDailyRollup(Base):
+    __tablename__ = "whoop_daily_rollups"
+
+    user_id = Column(String(36), ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)  # local calendar day of the Whoop cycle
+    recovery_score = Column(Float, nullable=True)
+    hrv_rmssd_milli = Column(Float, nullable=True)
+    resting_heart_rate = Column(Float, nullable=True)
+    sleep_performance_percentage = Column(Float, nullable=True)
+    strain = Column(Float, nullable=True)
+    workouts = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class WhoopWeeklyRollup(Base):
+    __tablename__ = "whoop_weekly_rollups"
+
+    user_id = Column(String(36), ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
+    week_start = Column(Date, primary_key=True)  # Monday
+    days = Column(Integer, nullable=False)  # days in the week with a rollup
+    recovery_score = Column(Float, nullable=True)
+    hrv_rmssd_milli = Column(Float, nullable=True)
+    resting_heart_rate = Column(Float, nullable=True)
+    sleep_performance_percentage = Column(Float, nullable=True)
+    strain = Column(Float, nullable=True)
+    workouts = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+# Per-user, per-source incremental sync bookkeeping (high-water mark + optional cursor)
+class DataSyncState(Base):
+    __tablename__ = "data_sync_state"
+
+    user_id = Column(String(36), ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
+    source = Column(String(50), primary_key=True)  # "whoop:recovery", "whoop:sleep", ...
+    high_water_mark = Column(DateTime(timezone=True), nullable=True)
+    cursor = Column(Text, nullable=True)
+    last_synced_at = Column(DateTime(timezone=True), nullable=True)
     
 async def get_db():
     async with AsyncSessionLocal() as session:
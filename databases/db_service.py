@@ -1,21 +1,64 @@
-from sqlalchemy import select
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
-from cryptography.fernet import Fernet
-from datetime import datetime, timedelta
+from cryptography.fernet import Fernet, MultiFernet
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
 
+import logging
 import os
 import uuid
 
+from cache.ttl_cache import TTLCache
+from monitoring.metrics import CACHE_REQUESTS
 from .database import User, OAuthToken
 
 load_dotenv()
 
-ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
-if not ENCRYPTION_KEY:
-    raise ValueError("ENCRYPTION_KEY environment variable must be set")
+logger = logging.getLogger(__name__)
 
-fernet = Fernet(ENCRYPTION_KEY.encode())
+# Keyring for rotation: ENCRYPTION_KEYS="new,old". New writes use the first (primary) key and
+# reads try each in turn, so old ciphertexts keep working until services.key_rotation rewrites them.
+ENCRYPTION_KEYS = [key.strip() for key in os.getenv("ENCRYPTION_KEYS", os.getenv("ENCRYPTION_KEY", "")).split(",") if key.strip()]
+if not ENCRYPTION_KEYS:
+    raise ValueError("ENCRYPTION_KEY (or ENCRYPTION_KEYS) environment variable must be set")
+
+primary_fernet = Fernet(ENCRYPTION_KEYS[0].encode())
+fernet = MultiFernet([primary_fernet] + [Fernet(key.encode()) for key in ENCRYPTION_KEYS[1:]])
+
+# Decrypted tokens cached per (user_id, provider); an entry never outlives expires_at
+OAUTH_TOKEN_CACHE_SIZE = int(os.getenv("OAUTH_TOKEN_CACHE_SIZE", "10000"))
+OAUTH_TOKEN_CACHE_TTL = int(os.getenv("OAUTH_TOKEN_CACHE_TTL", "300"))
+OAUTH_TOKEN_EXPIRY_SKEW = int(os.getenv("OAUTH_TOKEN_EXPIRY_SKEW", "30"))
+
+_token_cache = TTLCache(maxsize=OAUTH_TOKEN_CACHE_SIZE, ttl=OAUTH_TOKEN_CACHE_TTL)
+
+def _cache_token(user_id: str, provider: str, token_data: dict):
+    ttl = OAUTH_TOKEN_CACHE_TTL
+    expires_at = token_data.get('expires_at')
+    if expires_at:
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        remaining = (expires_at - datetime.now(timezone.utc)).total_seconds() - OAUTH_TOKEN_EXPIRY_SKEW
+        ttl = min(ttl, remaining)
+    _token_cache.set((user_id, provider), token_data, ttl=ttl)
+
+def invalidate_oauth_token(user_id: str, provider: str):
+    _token_cache.delete((user_id, provider))
+
+def _upsert_tokens_statement(rows: List[dict]):
+    """One INSERT ... ON CONFLICT (user_id, provider_name) DO UPDATE for any number of rows"""
+    stmt = pg_insert(OAuthToken).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=['user_id', 'provider_name'],
+        set_={
+            'access_token_encrypted': stmt.excluded.access_token_encrypted,
+            'refresh_token_encrypted': stmt.excluded.refresh_token_encrypted,
+            'expires_at': stmt.excluded.expires_at,
+            'updated_at': func.now(),
+        }
+    )
 
 async def store_oauth_token(
     db: AsyncSession,
@@ -25,51 +68,89 @@ async def store_oauth_token(
     refresh_token: str = None,
     expires_in: int = None
 ):
-    print(f"Storing OAuth token - User: {user_id}, Provider: {provider}")
-
     encrypted_access = fernet.encrypt(access_token.encode()).decode()
     encrypted_refresh = fernet.encrypt(refresh_token.encode()).decode() if refresh_token else None
 
     expires_at = datetime.utcnow() + timedelta(seconds=expires_in) if expires_in else None
 
-    try:
-        result = await db.execute(
-            select(OAuthToken).where(
-                OAuthToken.user_id == user_id,
-                OAuthToken.provider_name == provider
-            )
-        )
-        print("db results:", result)
-        existing_token = result.scalar_one_or_none()
-        if existing_token:
-            print(f"Updating existing {provider} token for user {user_id}")
-            # Update existing token
-            existing_token.access_token_encrypted = encrypted_access
-            existing_token.refresh_token_encrypted = encrypted_refresh
-            existing_token.expires_at = expires_at
-        else:
-            print(f"Creating new {provider} token for user {user_id}")
-            # Create new token with app-generated ID
-            token_id = str(uuid.uuid4())
-            new_token = OAuthToken(
-                token_id=token_id,
-                user_id=user_id,
-                provider_name=provider,
-                access_token_encrypted=encrypted_access,
-                refresh_token_encrypted=encrypted_refresh,
-                expires_at=expires_at
-            )
-            db.add(new_token)
+    # one round trip, and concurrent first links can't race each other into a duplicate
+    stmt = _upsert_tokens_statement([{
+        'token_id': str(uuid.uuid4()),
+        'user_id': user_id,
+        'provider_name': provider,
+        'access_token_encrypted': encrypted_access,
+        'refresh_token_encrypted': encrypted_refresh,
+        'expires_at': expires_at,
+    }])
 
+    try:
+        await db.execute(stmt)
         await db.commit()
-        print(f"Successfully stored {provider} OAuth token for user {user_id}")
+        _cache_token(user_id, provider, {
+            'access_token': access_token,
+            'refresh_token': refresh_token,
+            'expires_at': expires_at
+        })
+        logger.debug("Stored OAuth token", extra={"user_id": user_id, "provider": provider})
+
+    except Exception as db_error:
+        logger.error("Storing OAuth token failed: %s", db_error, extra={"user_id": user_id, "provider": provider})
+        await db.rollback()
+        invalidate_oauth_token(user_id, provider)
+        raise
 
+async def store_oauth_tokens(db: AsyncSession, tokens: List[dict]):
+    """
+    Upsert many tokens in one statement. Each entry has the keyword arguments of store_oauth_token
+    (user_id, provider, access_token, refresh_token, expires_in); a repeated (user_id, provider) keeps its last entry.
+    """
+    latest = {(token['user_id'], token['provider']): token for token in tokens}
+    if not latest:
+        return
+
+    rows = []
+    cached = {}
+    for (user_id, provider), token in latest.items():
+        refresh_token = token.get('refresh_token')
+        expires_in = token.get('expires_in')
+        expires_at = datetime.utcnow() + timedelta(seconds=expires_in) if expires_in else None
+        rows.append({
+            'token_id': str(uuid.uuid4()),
+            'user_id': user_id,
+            'provider_name': provider,
+            'access_token_encrypted': fernet.encrypt(token['access_token'].encode()).decode(),
+            'refresh_token_encrypted': fernet.encrypt(refresh_token.encode()).decode() if refresh_token else None,
+            'expires_at': expires_at,
+        })
+        cached[(user_id, provider)] = {
+            'access_token': token['access_token'],
+            'refresh_token': refresh_token,
+            'expires_at': expires_at
+        }
+
+    try:
+        await db.execute(_upsert_tokens_statement(rows))
+        await db.commit()
     except Exception as db_error:
-        print(f"Database query error: {db_error}")
+        logger.error("Storing %d OAuth tokens failed: %s", len(rows), db_error)
         await db.rollback()
+        for user_id, provider in latest:
+            invalidate_oauth_token(user_id, provider)
         raise
 
-async def get_oauth_token(db: AsyncSession, user_id: str, provider: str):
+    for (user_id, provider), token_data in cached.items():
+        _cache_token(user_id, provider, token_data)
+    logger.debug("Stored %d OAuth tokens", len(rows))
+
+async def get_oauth_token(db: AsyncSession, user_id: str, provider: str, use_cache: bool = True):
+    """Decrypted tokens for a user; use_cache=False forces a read of the stored row"""
+    if use_cache:
+        cached = _token_cache.get((user_id, provider))
+        if cached is not None:
+            CACHE_REQUESTS.labels("oauth_token", "hit").inc()
+            return dict(cached)
+        CACHE_REQUESTS.labels("oauth_token", "miss").inc()
+
     try:
         result = await db.execute(
             select(OAuthToken).where(
@@ -78,21 +159,59 @@ async def get_oauth_token(db: AsyncSession, user_id: str, provider: str):
             )
         )
 
-        print("db results:", result)
         token = result.scalar_one_or_none()
 
         if not token:
-            print(f"No {provider} token found for user {user_id}")
+            logger.debug("No OAuth token stored", extra={"user_id": user_id, "provider": provider})
             return None
         
         access_token = fernet.decrypt(token.access_token_encrypted.encode()).decode()
         refresh_token = fernet.decrypt(token.refresh_token_encrypted.encode()).decode() if token.refresh_token_encrypted else None
 
-        return {
+        token_data = {
             'access_token': access_token,
             'refresh_token': refresh_token,
             'expires_at': token.expires_at
         }
+        _cache_token(user_id, provider, token_data)
+        return dict(token_data)
+    except Exception as db_error:
+        logger.error("Reading OAuth token failed: %s", db_error, extra={"user_id": user_id, "provider": provider})
+        return None
+
+async def get_oauth_tokens(db: AsyncSession, user_id: str, providers: List[str]) -> Dict[str, dict]:
+    """
+    Decrypted tokens for several providers, with every cache miss read in one query.
+    Providers the user has no token for are left out of the result.
+    """
+    tokens = {}
+    missing = []
+    for provider in providers:
+        cached = _token_cache.get((user_id, provider))
+        if cached is not None:
+            CACHE_REQUESTS.labels("oauth_token", "hit").inc()
+            tokens[provider] = dict(cached)
+        else:
+            CACHE_REQUESTS.labels("oauth_token", "miss").inc()
+            missing.append(provider)
+    if not missing:
+        return tokens
+
+    try:
+        result = await db.execute(
+            select(OAuthToken).where(
+                OAuthToken.user_id == user_id,
+                OAuthToken.provider_name.in_(missing)
+            )
+        )
+        for token in result.scalars().all():
+            token_data = {
+                'access_token': fernet.decrypt(token.access_token_encrypted.encode()).decode(),
+                'refresh_token': fernet.decrypt(token.refresh_token_encrypted.encode()).decode() if token.refresh_token_encrypted else None,
+                'expires_at': token.expires_at
+            }
+            _cache_token(user_id, token.provider_name, token_data)
+            tokens[token.provider_name] = dict(token_data)
     except Exception as db_error:
-        print(f"Database error retrieving OAuth token: {db_error}")
-        return None
\ No newline at end of file
+        logger.error("Reading OAuth tokens failed: %s", db_error, extra={"user_id": user_id, "providers": missing})
+    return tokens
\ No newline at end of file
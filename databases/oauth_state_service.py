@@ -1,24 +1,37 @@
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, Any
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete
-from databases.database import OAuthState
+from sqlalchemy import select, delete, func
+from dotenv import load_dotenv
+from databases.database import OAuthState, redis_client
+import logging
 import json
+import os
 
-class OAuthStateService:
-    @staticmethod
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "redis" (default) keeps states in Redis with native TTLs; "postgres" uses the oauth_states table
+OAUTH_STATE_BACKEND = os.getenv("OAUTH_STATE_BACKEND", "redis").lower()
+# newest pending states kept per user; older ones are dropped when a new flow starts
+OAUTH_STATE_MAX_PENDING_PER_USER = int(os.getenv("OAUTH_STATE_MAX_PENDING_PER_USER", "5"))
+OAUTH_STATE_SWEEP_BATCH_SIZE = int(os.getenv("OAUTH_STATE_SWEEP_BATCH_SIZE", "1000"))
+
+class PostgresOAuthStateStore:
     async def store_state(
+        self,
         db: AsyncSession,
         state: str,
         provider_name: str,
         fitpro_user_id: str,
-        code_verifier: Optional[str] = None,
-        extra_data: Optional[Dict[str, Any]] = None,
-        expires_in_minutes: int = 10
+        code_verifier: Optional[str],
+        extra_data: Optional[Dict[str, Any]],
+        expires_in_minutes: int
     ) -> bool:
         try:
             expires_at = datetime.now(timezone.utc) + timedelta(minutes=expires_in_minutes)
-            
+
             oauth_state = OAuthState(
                 state=state,
                 provider_name=provider_name,
@@ -27,76 +40,78 @@ class OAuthStateService:
                 expires_at=expires_at,
                 extra_data=json.dumps(extra_data) if extra_data else None
             )
-            
+
             db.add(oauth_state)
+            await db.flush()
+            # cap the user's pending flows (idx_oauth_states_user_id), dropping the oldest
+            stale = (
+                select(OAuthState.state)
+                .where(OAuthState.fitpro_user_id == fitpro_user_id)
+                .order_by(OAuthState.expires_at.desc())
+                .offset(OAUTH_STATE_MAX_PENDING_PER_USER)
+            )
+            await db.execute(delete(OAuthState).where(OAuthState.state.in_(stale.scalar_subquery())))
             await db.commit()
             return True
         except Exception as e:
-            print(f"Error storing OAuth state: {e}")
+            logger.error("Storing OAuth state failed: %s", e, extra={"provider": provider_name})
             await db.rollback()
             return False
-        
-    @staticmethod
+
     async def get_and_delete_state(
+        self,
         db: AsyncSession,
         state: str,
         provider_name: str
     ) -> Optional[Dict[str, Any]]:
         try:
+            # one statement: the state is consumed whether or not it turns out to be expired
             result = await db.execute(
-                select(OAuthState).where(
+                delete(OAuthState)
+                .where(
                     OAuthState.state == state,
                     OAuthState.provider_name == provider_name
                 )
+                .returning(
+                    OAuthState.fitpro_user_id,
+                    OAuthState.code_verifier,
+                    OAuthState.created_at,
+                    OAuthState.expires_at,
+                    OAuthState.extra_data
+                )
             )
-            oauth_state = result.scalar_one_or_none()
-            print("🔗oauth state:", oauth_state)
-            
+            oauth_state = result.one_or_none()
+            await db.commit()
+            logger.debug("OAuth state consumed", extra={"provider": provider_name, "found": oauth_state is not None})
+
             if not oauth_state:
                 return None
-            
-            current_time = datetime.now(timezone.utc)
+
             # Check if expired
-            if current_time > oauth_state.expires_at:
-                # Delete expired state
-                await db.execute(
-                    delete(OAuthState).where(OAuthState.state == state)
-                )
-                await db.commit()
+            if datetime.now(timezone.utc) > oauth_state.expires_at:
                 return None
-            
-            # Extract data
-            state_data = {
+
+            return {
                 "fitpro_user_id": oauth_state.fitpro_user_id,
                 "code_verifier": oauth_state.code_verifier,
                 "created_at": oauth_state.created_at,
                 "extra_data": json.loads(oauth_state.extra_data) if oauth_state.extra_data else None
             }
-            
-            # Delete the state (one-time use)
-            await db.execute(
-                delete(OAuthState).where(OAuthState.state == state)
-            )
-            await db.commit()
-            
-            return state_data
         except Exception as e:
-            print(f"Error retrieving OAuth state: {e}")
+            logger.error("Consuming OAuth state failed: %s", e, extra={"provider": provider_name})
             await db.rollback()
             return None
-        
-    @staticmethod
-    async def get_user_pending_states(db: AsyncSession, fitpro_user_id: str) -> list:
-        """Get all pending OAuth states for a user (for debugging)"""
+
+    async def get_user_pending_states(self, db: AsyncSession, fitpro_user_id: str) -> list:
         try:
             result = await db.execute(
                 select(OAuthState).where(
                     OAuthState.fitpro_user_id == fitpro_user_id,
-                    OAuthState.expires_at > datetime.utcnow()
+                    OAuthState.expires_at > datetime.now(timezone.utc)
                 )
             )
             states = result.scalars().all()
-            
+
             return [
                 {
                     "state": state.state,
@@ -106,7 +121,160 @@ class OAuthStateService:
                 }
                 for state in states
             ]
-            
+
+        except Exception as e:
+            logger.error("Listing pending OAuth states failed: %s", e, extra={"user_id": fitpro_user_id})
+            return []
+
+    async def sweep_expired(self, db: AsyncSession, batch_size: int) -> int:
+        """
+        Delete expired rows in batches of batch_size, one short transaction each. Batches walk
+        idx_oauth_states_expires_at and skip rows another sweeper or a callback has locked.
+        """
+        deleted = 0
+        while True:
+            batch = (
+                select(OAuthState.state)
+                .where(OAuthState.expires_at < func.now())
+                .order_by(OAuthState.expires_at)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            result = await db.execute(delete(OAuthState).where(OAuthState.state.in_(batch.scalar_subquery())))
+            await db.commit()
+            deleted += result.rowcount
+            if result.rowcount < batch_size:
+                return deleted
+
+class RedisOAuthStateStore:
+    """
+    States live under their own key with a native TTL, so abandoned flows expire on
+    their own. Consuming a state is a single GETDEL. A per-user sorted set (scored by
+    expiry) indexes pending states for lookups and for the per-user cap.
+    """
+    STATE_PREFIX = "oauth_state:"
+    USER_INDEX_PREFIX = "oauth_states_user:"
+
+    def _state_key(self, provider_name: str, state: str) -> str:
+        return f"{self.STATE_PREFIX}{provider_name}:{state}"
+
+    def _user_index_key(self, fitpro_user_id: str) -> str:
+        return f"{self.USER_INDEX_PREFIX}{fitpro_user_id}"
+
+    async def store_state(
+        self,
+        db: AsyncSession,
+        state: str,
+        provider_name: str,
+        fitpro_user_id: str,
+        code_verifier: Optional[str],
+        extra_data: Optional[Dict[str, Any]],
+        expires_in_minutes: int
+    ) -> bool:
+        try:
+            now = datetime.now(timezone.utc)
+            ttl_seconds = expires_in_minutes * 60
+            payload = json.dumps({
+                "fitpro_user_id": fitpro_user_id,
+                "code_verifier": code_verifier,
+                "created_at": now.isoformat(),
+                "extra_data": extra_data
+            })
+            index_key = self._user_index_key(fitpro_user_id)
+
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.set(self._state_key(provider_name, state), payload, ex=ttl_seconds)
+                pipe.zadd(index_key, {f"{provider_name}:{state}": now.timestamp() + ttl_seconds})
+                pipe.zremrangebyscore(index_key, "-inf", now.timestamp())
+                pipe.expire(index_key, ttl_seconds)
+                # the ones past the cap, oldest first
+                pipe.zrange(index_key, 0, -(OAUTH_STATE_MAX_PENDING_PER_USER + 1))
+                evicted = (await pipe.execute())[-1]
+
+            if evicted:
+                async with redis_client.pipeline(transaction=True) as pipe:
+                    for member in evicted:
+                        provider, evicted_state = member.decode().split(":", 1)
+                        pipe.delete(self._state_key(provider, evicted_state))
+                    pipe.zrem(index_key, *evicted)
+                    await pipe.execute()
+            return True
         except Exception as e:
-            print(f"Error getting user pending states: {e}")
-            return []
\ No newline at end of file
+            logger.error("Storing OAuth state failed: %s", e, extra={"provider": provider_name})
+            return False
+
+    async def get_and_delete_state(
+        self,
+        db: AsyncSession,
+        state: str,
+        provider_name: str
+    ) -> Optional[Dict[str, Any]]:
+        try:
+            raw = await redis_client.getdel(self._state_key(provider_name, state))
+            if not raw:
+                return None
+
+            state_data = json.loads(raw)
+            state_data["created_at"] = datetime.fromisoformat(state_data["created_at"])
+            await redis_client.zrem(self._user_index_key(state_data["fitpro_user_id"]), f"{provider_name}:{state}")
+            return state_data
+        except Exception as e:
+            logger.error("Consuming OAuth state failed: %s", e, extra={"provider": provider_name})
+            return None
+
+    async def get_user_pending_states(self, db: AsyncSession, fitpro_user_id: str) -> list:
+        try:
+            now = datetime.now(timezone.utc).timestamp()
+            entries = await redis_client.zrangebyscore(
+                self._user_index_key(fitpro_user_id), now, "+inf", withscores=True
+            )
+            pending = []
+            for member, expires_at in entries:
+                provider, state = member.decode().split(":", 1)
+                pending.append({
+                    "state": state,
+                    "provider": provider,
+                    "expires_at": datetime.fromtimestamp(expires_at, timezone.utc)
+                })
+            return pending
+        except Exception as e:
+            logger.error("Listing pending OAuth states failed: %s", e, extra={"user_id": fitpro_user_id})
+            return []
+
+_postgres_store = PostgresOAuthStateStore()
+_state_store = RedisOAuthStateStore() if OAUTH_STATE_BACKEND == "redis" else _postgres_store
+
+class OAuthStateService:
+    @staticmethod
+    async def store_state(
+        db: AsyncSession,
+        state: str,
+        provider_name: str,
+        fitpro_user_id: str,
+        code_verifier: Optional[str] = None,
+        extra_data: Optional[Dict[str, Any]] = None,
+        expires_in_minutes: int = 10
+    ) -> bool:
+        return await _state_store.store_state(
+            db, state, provider_name, fitpro_user_id, code_verifier, extra_data, expires_in_minutes
+        )
+
+    @staticmethod
+    async def get_and_delete_state(
+        db: AsyncSession,
+        state: str,
+        provider_name: str
+    ) -> Optional[Dict[str, Any]]:
+        return await _state_store.get_and_delete_state(db, state, provider_name)
+
+    @staticmethod
+    async def get_user_pending_states(db: AsyncSession, fitpro_user_id: str) -> list:
+        """Get all pending OAuth states for a user (for debugging)"""
+        return await _state_store.get_user_pending_states(db, fitpro_user_id)
+
+    @staticmethod
+    async def sweep_expired_states(db: AsyncSession, batch_size: int = OAUTH_STATE_SWEEP_BATCH_SIZE) -> int:
+        """Delete abandoned (expired) rows from oauth_states; returns how many were removed"""
+        # Redis states expire on their own, but the table can still hold rows from before a
+        # switch to the Redis backend, so it is swept whichever backend is active
+        return await _postgres_store.sweep_expired(db, batch_size)
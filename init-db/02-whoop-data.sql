@@ -0,0 +1,78 @@
+-- Local Whoop data store (matches WhoopCycle / WhoopRecovery / WhoopSleep / WhoopWorkout models)
+-- `data` keeps the raw Whoop v2 record; the other columns exist for querying
+
+CREATE TABLE whoop_cycles (
+    cycle_id BIGINT PRIMARY KEY,
+    user_id VARCHAR(36) NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    start_time TIMESTAMPTZ NOT NULL,
+    end_time TIMESTAMPTZ,
+    score_state VARCHAR(32),
+    strain DOUBLE PRECISION,
+    kilojoule DOUBLE PRECISION,
+    average_heart_rate INTEGER,
+    max_heart_rate INTEGER,
+    data JSONB NOT NULL,
+    whoop_updated_at TIMESTAMPTZ NOT NULL,
+    synced_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE whoop_recoveries (
+    cycle_id BIGINT PRIMARY KEY,
+    sleep_id VARCHAR(36),
+    user_id VARCHAR(36) NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    score_state VARCHAR(32),
+    recovery_score DOUBLE PRECISION,
+    resting_heart_rate DOUBLE PRECISION,
+    hrv_rmssd_milli DOUBLE PRECISION,
+    spo2_percentage DOUBLE PRECISION,
+    skin_temp_celsius DOUBLE PRECISION,
+    data JSONB NOT NULL,
+    whoop_created_at TIMESTAMPTZ NOT NULL,
+    whoop_updated_at TIMESTAMPTZ NOT NULL,
+    synced_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE whoop_sleeps (
+    sleep_id VARCHAR(36) PRIMARY KEY,
+    cycle_id BIGINT,
+    user_id VARCHAR(36) NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    start_time TIMESTAMPTZ NOT NULL,
+    end_time TIMESTAMPTZ,
+    nap BOOLEAN DEFAULT FALSE,
+    score_state VARCHAR(32),
+    sleep_performance_percentage DOUBLE PRECISION,
+    sleep_efficiency_percentage DOUBLE PRECISION,
+    data JSONB NOT NULL,
+    whoop_updated_at TIMESTAMPTZ NOT NULL,
+    synced_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE whoop_workouts (
+    workout_id VARCHAR(36) PRIMARY KEY,
+    user_id VARCHAR(36) NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    start_time TIMESTAMPTZ NOT NULL,
+    end_time TIMESTAMPTZ,
+    sport_name VARCHAR(100),
+    score_state VARCHAR(32),
+    strain DOUBLE PRECISION,
+    average_heart_rate INTEGER,
+    max_heart_rate INTEGER,
+    data JSONB NOT NULL,
+    whoop_updated_at TIMESTAMPTZ NOT NULL,
+    synced_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Per-user incremental sync bookkeeping, shared by every synced source
+CREATE TABLE data_sync_state (
+    user_id VARCHAR(36) NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    source VARCHAR(50) NOT NULL,
+    high_water_mark TIMESTAMPTZ,
+    cursor TEXT,
+    last_synced_at TIMESTAMPTZ,
+    PRIMARY KEY (user_id, source)
+);
+
+CREATE INDEX idx_whoop_cycles_user_start ON whoop_cycles(user_id, start_time);
+CREATE INDEX idx_whoop_recoveries_user_created ON whoop_recoveries(user_id, whoop_created_at);
+CREATE INDEX idx_whoop_sleeps_user_start ON whoop_sleeps(user_id, start_time);
+CREATE INDEX idx_whoop_workouts_user_start ON whoop_workouts(user_id, start_time);
@@ -0,0 +1,19 @@
+-- Local Spotify listening history (matches the SpotifyPlay model)
+-- Spotify only exposes a user's last 50 plays, so anything not captured here is gone
+
+CREATE TABLE spotify_plays (
+    user_id VARCHAR(36) NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    played_at TIMESTAMPTZ NOT NULL,
+    track_id VARCHAR(64) NOT NULL,
+    track_name TEXT,
+    artist_names TEXT,
+    album_name TEXT,
+    duration_ms INTEGER,
+    context_uri TEXT,
+    data JSONB NOT NULL,
+    synced_at TIMESTAMPTZ DEFAULT NOW(),
+    -- one user can't play two tracks at the same instant, and this doubles as the (user, played_at) index
+    PRIMARY KEY (user_id, played_at)
+);
+
+CREATE INDEX idx_spotify_plays_user_track ON spotify_plays(user_id, track_id, played_at);
@@ -0,0 +1,20 @@
+-- Materialized join of Whoop workouts with the Spotify plays heard during them
+-- (matches the WorkoutSoundtrack model). Maintained incrementally by services.soundtrack_analytics.
+
+CREATE TABLE workout_soundtrack (
+    user_id VARCHAR(36) NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    workout_id VARCHAR(36) NOT NULL,
+    played_at TIMESTAMPTZ NOT NULL,
+    workout_start TIMESTAMPTZ NOT NULL,
+    track_id VARCHAR(64) NOT NULL,
+    track_name TEXT,
+    artist_name TEXT,
+    tempo DOUBLE PRECISION,
+    overlap_seconds DOUBLE PRECISION NOT NULL,
+    strain DOUBLE PRECISION,
+    average_heart_rate INTEGER,
+    high_zone_share DOUBLE PRECISION,
+    PRIMARY KEY (user_id, workout_id, played_at)
+);
+
+CREATE INDEX idx_workout_soundtrack_user_start ON workout_soundtrack(user_id, workout_start);
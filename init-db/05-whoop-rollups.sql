@@ -0,0 +1,30 @@
+-- Daily and weekly Whoop aggregates behind the trends endpoint (matches the WhoopDailyRollup /
+-- WhoopWeeklyRollup models). Maintained incrementally from the local Whoop store by services.whoop_rollups.
+-- A day is the Whoop cycle that wakes up on it (local time), weeks start on Monday.
+
+CREATE TABLE whoop_daily_rollups (
+    user_id VARCHAR(36) NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    recovery_score DOUBLE PRECISION,
+    hrv_rmssd_milli DOUBLE PRECISION,
+    resting_heart_rate DOUBLE PRECISION,
+    sleep_performance_percentage DOUBLE PRECISION,
+    strain DOUBLE PRECISION,
+    workouts INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (user_id, day)
+);
+
+CREATE TABLE whoop_weekly_rollups (
+    user_id VARCHAR(36) NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    week_start DATE NOT NULL,
+    days INTEGER NOT NULL,
+    recovery_score DOUBLE PRECISION,
+    hrv_rmssd_milli DOUBLE PRECISION,
+    resting_heart_rate DOUBLE PRECISION,
+    sleep_performance_percentage DOUBLE PRECISION,
+    strain DOUBLE PRECISION,
+    workouts INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (user_id, week_start)
+);
@@ -0,0 +1,82 @@
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+
+import httpx
+import os
+
+load_dotenv()
+
+# Pool config
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP_MAX_KEEPALIVE_PER_HOST = int(os.getenv("HTTP_MAX_KEEPALIVE_PER_HOST", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "5"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+
+
+class HTTPClientPool:
+    """
+    One keep-alive httpx.AsyncClient per upstream host.
+
+    Each host gets its own connection pool, so the per-host limits hold and a slow
+    provider can only exhaust its own connections. HTTP/2 is negotiated via ALPN
+    and silently falls back to HTTP/1.1 when the server does not offer it.
+    """
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def _build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_PER_HOST,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(
+                HTTP_READ_TIMEOUT,
+                connect=HTTP_CONNECT_TIMEOUT,
+                pool=HTTP_POOL_TIMEOUT
+            )
+        )
+
+    def get_client(self, url: str) -> httpx.AsyncClient:
+        """Get (or lazily create) the client that owns the host of `url`"""
+        parts = urlsplit(url)
+        host_key = f"{parts.scheme}://{parts.netloc}"
+
+        client = self._clients.get(host_key)
+        if client is None or client.is_closed:
+            client = self._build_client()
+            self._clients[host_key] = client
+        return client
+
+    async def close(self):
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
+
+
+http_pool = HTTPClientPool()
+
+
+async def request(
+    method: str,
+    url: str,
+    *,
+    params: Optional[dict] = None,
+    data: Optional[dict] = None,
+    headers: Optional[dict] = None
+) -> httpx.Response:
+    """Send a request through the shared pool for the url's host"""
+    client = http_pool.get_client(url)
+    return await client.request(method, url, params=params, data=data, headers=headers)
+
+
+async def close_http_clients():
+    await http_pool.close()
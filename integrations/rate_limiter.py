@@ -0,0 +1,225 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+import asyncio
+import heapq
+import random
+import time
+import os
+
+import httpx
+
+from integrations import http_client
+from monitoring.metrics import UPSTREAM_QUEUE_SECONDS, UPSTREAM_REQUEST_SECONDS, upstream_endpoint
+
+load_dotenv()
+
+# Lower value = served first. Background work (sync, proactive refresh, cache revalidation)
+# only gets upstream capacity that interactive requests are not waiting for.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+WHOOP_RATE_LIMIT_PER_MINUTE = float(os.getenv("WHOOP_RATE_LIMIT_PER_MINUTE", "100"))
+WHOOP_RATE_LIMIT_BURST = int(os.getenv("WHOOP_RATE_LIMIT_BURST", "20"))
+SPOTIFY_RATE_LIMIT_PER_MINUTE = float(os.getenv("SPOTIFY_RATE_LIMIT_PER_MINUTE", "600"))
+SPOTIFY_RATE_LIMIT_BURST = int(os.getenv("SPOTIFY_RATE_LIMIT_BURST", "50"))
+
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+# longest we hold a request waiting for upstream capacity before giving up with a 429
+INTERACTIVE_MAX_WAIT = float(os.getenv("UPSTREAM_INTERACTIVE_MAX_WAIT", "10"))
+BACKGROUND_MAX_WAIT = float(os.getenv("UPSTREAM_BACKGROUND_MAX_WAIT", "120"))
+
+PROVIDER_LIMITS = {
+    'whoop': (WHOOP_RATE_LIMIT_PER_MINUTE / 60, WHOOP_RATE_LIMIT_BURST),
+    'spotify': (SPOTIFY_RATE_LIMIT_PER_MINUTE / 60, SPOTIFY_RATE_LIMIT_BURST),
+}
+
+_request_priority: ContextVar[int] = ContextVar("upstream_request_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def background_priority():
+    """Upstream calls made inside this block (and tasks it spawns) queue behind interactive ones"""
+    token = _request_priority.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+class UpstreamRateLimited(ValueError):
+    """The provider (or our own budget for it) has no capacity left right now"""
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f"{provider.capitalize()} rate limit reached, retry in {int(retry_after) + 1}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Token bucket whose waiters are served by priority, then FIFO.
+
+    The bucket can also be paused outright when the provider says we are out of budget
+    (429 / Retry-After / rate-limit headers), which is a stronger signal than our own estimate.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._waiters = []
+        self._seq = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _refill(self, now: float):
+        # nothing accrues while paused
+        start = max(self.updated, self.paused_until)
+        if now > start:
+            self.tokens = min(self.capacity, self.tokens + (now - start) * self.rate)
+            self.updated = now
+
+    def _dispatch(self):
+        self._timer = None
+        now = time.monotonic()
+        self._refill(now)
+
+        if self.paused_until > now:
+            delay = self.paused_until - now
+        else:
+            while self._waiters and self.tokens >= 1:
+                _, _, future = heapq.heappop(self._waiters)
+                if future.done():
+                    continue
+                self.tokens -= 1
+                future.set_result(None)
+            while self._waiters and self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+            delay = (1 - self.tokens) / self.rate
+
+        if self._waiters:
+            self._timer = asyncio.get_running_loop().call_later(max(delay, 0.001), self._dispatch)
+
+    async def acquire(self, priority: int, timeout: float):
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (priority, self._seq, future))
+        if self._timer is None:
+            self._dispatch()
+        await asyncio.wait_for(future, timeout)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        # refill restarts from the end of the pause, so it can't burst past the provider's limit
+        self.updated = self.paused_until
+
+    def observe(self, remaining: Optional[int], reset_seconds: Optional[float]):
+        """Align our estimate with the provider's view of the remaining budget"""
+        if remaining is None:
+            return
+        self._refill(time.monotonic())
+        if remaining <= 0 and reset_seconds:
+            self.pause(reset_seconds)
+        else:
+            self.tokens = min(self.tokens, remaining)
+
+
+_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+def get_bucket(provider: str, credential: Optional[str]) -> TokenBucket:
+    """One bucket per provider and app credential (client id)"""
+    key = (provider, credential or "")
+    bucket = _buckets.get(key)
+    if bucket is None:
+        rate, capacity = PROVIDER_LIMITS[provider]
+        bucket = TokenBucket(rate, capacity)
+        _buckets[key] = bucket
+    return bucket
+
+
+def _header_number(response: httpx.Response, name: str) -> Optional[float]:
+    # Whoop sends e.g. "X-RateLimit-Limit: 100, 100;window=60, 10000;window=86400"
+    value = response.headers.get(name)
+    if not value:
+        return None
+    try:
+        return float(value.split(",")[0].split(";")[0].strip())
+    except ValueError:
+        return None
+
+def _backoff(attempt: int) -> float:
+    # full jitter keeps many retrying workers from re-synchronizing
+    return random.uniform(0, UPSTREAM_BACKOFF_BASE * (2 ** attempt))
+
+
+async def scheduled_request(
+    provider: str,
+    credential: Optional[str],
+    method: str,
+    url: str,
+    *,
+    params: Optional[dict] = None,
+    data: Optional[dict] = None,
+    headers: Optional[dict] = None
+) -> httpx.Response:
+    """
+    Send a provider request through its token bucket.
+
+    429s are retried after Retry-After (or the rate-limit reset) and 5xx / transport errors
+    with jittered exponential backoff. Non-idempotent requests are only retried on 429,
+    where the provider guarantees it did not process them.
+    """
+    bucket = get_bucket(provider, credential)
+    priority = _request_priority.get()
+    max_wait = INTERACTIVE_MAX_WAIT if priority == PRIORITY_INTERACTIVE else BACKGROUND_MAX_WAIT
+    idempotent = method.upper() == "GET"
+    queue_timer = UPSTREAM_QUEUE_SECONDS.labels(provider, "interactive" if priority == PRIORITY_INTERACTIVE else "background")
+    endpoint = upstream_endpoint(url)
+
+    attempt = 0
+    while True:
+        queued_at = time.perf_counter()
+        try:
+            await bucket.acquire(priority, timeout=max_wait)
+        except asyncio.TimeoutError:
+            raise UpstreamRateLimited(provider, max(bucket.paused_until - time.monotonic(), 1))
+        finally:
+            queue_timer.observe(time.perf_counter() - queued_at)
+
+        started = time.perf_counter()
+        try:
+            response = await http_client.request(method, url, params=params, data=data, headers=headers)
+        except httpx.TransportError:
+            UPSTREAM_REQUEST_SECONDS.labels(provider, method, endpoint, "error").observe(time.perf_counter() - started)
+            if not idempotent or attempt >= UPSTREAM_MAX_RETRIES:
+                raise
+            await asyncio.sleep(_backoff(attempt))
+            attempt += 1
+            continue
+        UPSTREAM_REQUEST_SECONDS.labels(provider, method, endpoint, str(response.status_code)).observe(
+            time.perf_counter() - started
+        )
+
+        reset_seconds = _header_number(response, "X-RateLimit-Reset")
+        bucket.observe(_header_number(response, "X-RateLimit-Remaining"), reset_seconds)
+
+        if response.status_code == 429:
+            retry_after = _header_number(response, "Retry-After") or reset_seconds or _backoff(attempt) + 1
+            bucket.pause(retry_after)
+            if attempt >= UPSTREAM_MAX_RETRIES or retry_after > max_wait:
+                raise UpstreamRateLimited(provider, retry_after)
+            # the bucket is paused, so the next acquire() waits out Retry-After for us
+            attempt += 1
+            continue
+
+        if response.status_code >= 500 and idempotent and attempt < UPSTREAM_MAX_RETRIES:
+            await asyncio.sleep(_backoff(attempt))
+            attempt += 1
+            continue
+
+        return response
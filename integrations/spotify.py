@@ -1,30 +1,36 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import delete
 from urllib.parse import urlencode,quote
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Awaitable, Callable
 from dotenv import load_dotenv
 
-import requests
+import httpx
 import secrets
 import hashlib
 import base64
+import logging
 import os
 
-from databases.database import get_db, User, OAuthToken
+from databases.database import AsyncSessionLocal, get_db, User, OAuthToken
 from databases.db_service import store_oauth_token, get_oauth_token
 from databases.oauth_state_service import OAuthStateService
+from integrations.rate_limiter import scheduled_request, background_priority
+from integrations.token_refresh import single_flight_refresh
+from cache.response_cache import response_cache
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Spotify config
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 SPOTIFY_REDIRECT_URI = os.getenv("SPOTIFY_REDIRECT_URI")
 
 # Spotify API URLs
-SPOTIFY_AUTH_URL = "https://accounts.spotify.com/authorize"
-SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
-SPOTIFY_API_BASE_URL = "https://api.spotify.com/v1"
+SPOTIFY_AUTH_URL = os.getenv("SPOTIFY_AUTH_URL", "https://accounts.spotify.com/authorize")
+SPOTIFY_TOKEN_URL = os.getenv("SPOTIFY_TOKEN_URL", "https://accounts.spotify.com/api/token")
+SPOTIFY_API_BASE_URL = os.getenv("SPOTIFY_API_BASE_URL", "https://api.spotify.com/v1")
 
 class SpotifyIntegration:
     @staticmethod
@@ -108,7 +114,6 @@ class SpotifyIntegration:
             }
         
         state_data = await OAuthStateService.get_and_delete_state(db, state, "spotify")
-        print("😂 State data:", state_data)
         if not state_data:
             return {
                 "success": False,
@@ -147,11 +152,13 @@ class SpotifyIntegration:
             }
 
             # Get access token
-            print(f"🔄 Exchanging code for access token...")
-            token_response = requests.post(SPOTIFY_TOKEN_URL, data=token_data, headers=headers)
+            token_response = await scheduled_request('spotify', SPOTIFY_CLIENT_ID, "POST", SPOTIFY_TOKEN_URL, data=token_data, headers=headers)
             
             if token_response.status_code != 200:
-                print(f"❌ Spotify Token exchange failed: {token_response.status_code} - {token_response.text}")
+                logger.warning(
+                    "Spotify token exchange failed",
+                    extra={"status": token_response.status_code, "body": token_response.text[:200]}
+                )
                 return {
                     "success": False,
                     "error": "token_exchange_failed",
@@ -162,14 +169,19 @@ class SpotifyIntegration:
             access_token = token_info['access_token']
             
             # Get user profile
-            print(f"🔄 Fetching user profile...")
-            profile_response = requests.get(
+            profile_response = await scheduled_request(
+                'spotify',
+                SPOTIFY_CLIENT_ID,
+                "GET",
                 f"{SPOTIFY_API_BASE_URL}/me",
                 headers={'Authorization': f"Bearer {access_token}"}
             )
             
             if profile_response.status_code != 200:
-                print(f"❌ Profile fetch failed: {profile_response.status_code} - {profile_response.text}")
+                logger.warning(
+                    "Spotify profile fetch failed",
+                    extra={"status": profile_response.status_code, "body": profile_response.text[:200]}
+                )
                 return {
                     "success": False,
                     "error": "profile_fetch_failed",
@@ -192,6 +204,8 @@ class SpotifyIntegration:
                 refresh_token=token_info.get('refresh_token'),
                 expires_in=token_info.get('expires_in')
             )
+            # a relinked account may be a different Spotify user
+            await response_cache.invalidate('spotify', fitpro_user_id)
             
             
             display_name = spotify_profile.get('display_name', 'Spotify User')
@@ -205,15 +219,15 @@ class SpotifyIntegration:
                 "redirect_url": success_url
             }
         
-        except requests.RequestException as e:
-            print(f"❌ Network error during Spotify token exchange: {str(e)}")
+        except httpx.HTTPError as e:
+            logger.warning("Network error during Spotify token exchange: %s", e)
             return {
                 "success": False,
                 "error": "network_error",
                 "redirect_url": "fitpro://callback?error=network_error&message=Network error during authentication"
             }
         except Exception as e:
-            print(f"❌ Unexpected error during Spotify token exchange: {str(e)}")
+            logger.exception("Unexpected error during Spotify token exchange")
             return {
                 "success": False,
                 "error": "unexpected_error",
@@ -221,11 +235,37 @@ class SpotifyIntegration:
             }
 
     @staticmethod
-    async def refresh_spotify_token(db: AsyncSession, fitpro_user_id: str) -> bool:
-        """Refresh expired Spotify access token"""
-        token_data = await get_oauth_token(db, fitpro_user_id, 'spotify')
+    async def refresh_spotify_token(
+        db: AsyncSession,
+        fitpro_user_id: str,
+        stale_access_token: Optional[str] = None,
+        store_token: Optional[Callable[..., Awaitable[None]]] = None
+    ) -> bool:
+        """
+        Refresh expired Spotify access token, coalescing concurrent refreshes for the same user.
+        store_token replaces store_oauth_token for writing the new token, e.g. to batch writes.
+        """
+        return await single_flight_refresh(
+            'spotify',
+            fitpro_user_id,
+            lambda: SpotifyIntegration._refresh_spotify_token(db, fitpro_user_id, stale_access_token, store_token)
+        )
+
+    @staticmethod
+    async def _refresh_spotify_token(
+        db: AsyncSession,
+        fitpro_user_id: str,
+        stale_access_token: Optional[str] = None,
+        store_token: Optional[Callable[..., Awaitable[None]]] = None
+    ) -> bool:
+        # bypass the cache: another worker may already have rotated the refresh token
+        token_data = await get_oauth_token(db, fitpro_user_id, 'spotify', use_cache=False)
         if not token_data or not token_data.get('refresh_token'):
             return False
+
+        if stale_access_token and token_data['access_token'] != stale_access_token:
+            # refreshed by someone else while we waited for the lock
+            return True
         
         refresh_data = {
             'grant_type': 'refresh_token',
@@ -234,13 +274,13 @@ class SpotifyIntegration:
         }
         
         try:
-            response = requests.post(SPOTIFY_TOKEN_URL, data=refresh_data)
+            response = await scheduled_request('spotify', SPOTIFY_CLIENT_ID, "POST", SPOTIFY_TOKEN_URL, data=refresh_data)
             if response.status_code == 200:
                 new_token_info = response.json()
                 
                 # Update stored token
-                await store_oauth_token(
-                    db=db,
+                store = store_token or (lambda **token: store_oauth_token(db, **token))
+                await store(
                     user_id=fitpro_user_id,
                     provider='spotify',
                     access_token=new_token_info['access_token'],
@@ -249,13 +289,34 @@ class SpotifyIntegration:
                 )
                 return True
         except Exception as e:
-            print(f"Token refresh failed: {e}")
+            logger.warning("Spotify token refresh failed: %s", e, extra={"user_id": fitpro_user_id})
         
         return False  
     
     @staticmethod
-    async def make_spotify_api_request(db: AsyncSession, fitpro_user_id: str, endpoint: str, params: dict = None) -> Optional[Dict[str, Any]]:
-        """Make authenticated request to Spotify API with token refresh"""
+    async def make_spotify_api_request(db: AsyncSession, fitpro_user_id: str, endpoint: str, params: dict = None, use_cache: bool = True) -> Optional[Dict[str, Any]]:
+        """Authenticated GET against the Spotify API, served from the response cache where the endpoint allows it"""
+        if not use_cache:
+            return await SpotifyIntegration._send_api_request(db, fitpro_user_id, endpoint, params)
+
+        return await response_cache.get_or_fetch(
+            'spotify',
+            fitpro_user_id,
+            endpoint,
+            params,
+            fetch=lambda: SpotifyIntegration._send_api_request(db, fitpro_user_id, endpoint, params),
+            revalidate=lambda: SpotifyIntegration._send_api_request_detached(fitpro_user_id, endpoint, params)
+        )
+
+    @staticmethod
+    async def _send_api_request_detached(fitpro_user_id: str, endpoint: str, params: dict = None) -> Optional[Dict[str, Any]]:
+        """Same request on its own session and at background priority, for work that outlives the calling request"""
+        with background_priority():
+            async with AsyncSessionLocal() as db:
+                return await SpotifyIntegration._send_api_request(db, fitpro_user_id, endpoint, params)
+
+    @staticmethod
+    async def _send_api_request(db: AsyncSession, fitpro_user_id: str, endpoint: str, params: dict = None) -> Optional[Dict[str, Any]]:
         token_data = await get_oauth_token(db, fitpro_user_id, 'spotify')
         if not token_data:
             raise ValueError("User not authenticated with Spotify")
@@ -268,25 +329,29 @@ class SpotifyIntegration:
         url = f"{SPOTIFY_API_BASE_URL}/{endpoint.lstrip('/')}"
         
         try:
-            response = requests.get(url, headers=headers, params=params)
+            response = await scheduled_request('spotify', SPOTIFY_CLIENT_ID, "GET", url, headers=headers, params=params)
             
             # If token expired, try to refresh
             if response.status_code == 401:
-                print("Token expired, attempting refresh...")
-                if await SpotifyIntegration.refresh_spotify_token(db, fitpro_user_id):
+                logger.info("Spotify token rejected, refreshing", extra={"user_id": fitpro_user_id})
+                if await SpotifyIntegration.refresh_spotify_token(db, fitpro_user_id, token_data['access_token']):
                     # Retry with new token
                     token_data = await get_oauth_token(db, fitpro_user_id, 'spotify')
                     headers['Authorization'] = f"Bearer {token_data['access_token']}"
-                    response = requests.get(url, headers=headers, params=params)
+                    response = await scheduled_request('spotify', SPOTIFY_CLIENT_ID, "GET", url, headers=headers, params=params)
                 else:
                     raise ValueError("Access token expired and refresh failed. Please re-authenticate.")
             
+            # e.g. currently-playing when nothing is playing
+            if response.status_code == 204:
+                return None
+
             if response.status_code != 200:
                 raise ValueError(f"Spotify API error: {response.text}")
             
             return response.json()
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             raise ValueError(f"Failed to connect to Spotify: {str(e)}")
 
     @staticmethod   
@@ -0,0 +1,101 @@
+from typing import Awaitable, Callable, Dict, Tuple
+from dotenv import load_dotenv
+
+import asyncio
+import logging
+import secrets
+import os
+
+from databases.database import redis_client
+from databases.db_service import invalidate_oauth_token
+from monitoring.metrics import OAUTH_TOKEN_REFRESHES
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+REFRESH_LOCK_TTL_MS = int(os.getenv("REFRESH_LOCK_TTL_MS", "15000"))
+REFRESH_LOCK_POLL_SECONDS = float(os.getenv("REFRESH_LOCK_POLL_SECONDS", "0.1"))
+
+REFRESH_LOCK_PREFIX = "oauth_refresh_lock:"
+
+# Release the lock only if we still own it (it may have expired and been re-taken)
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+
+
+async def _wait_for_foreign_refresh(lock_key: str) -> bool:
+    """Another worker holds the lock; wait for it to finish instead of racing it"""
+    deadline = asyncio.get_running_loop().time() + REFRESH_LOCK_TTL_MS / 1000
+    while asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(REFRESH_LOCK_POLL_SECONDS)
+        if not await redis_client.exists(lock_key):
+            return True
+    return False
+
+
+async def _counted_refresh(provider: str, refresh: Callable[[], Awaitable[bool]]) -> bool:
+    refreshed = False
+    try:
+        refreshed = await refresh()
+        return refreshed
+    finally:
+        OAUTH_TOKEN_REFRESHES.labels(provider, "refreshed" if refreshed else "failed").inc()
+
+
+async def _refresh_across_workers(provider: str, user_id: str, refresh: Callable[[], Awaitable[bool]]) -> bool:
+    lock_key = f"{REFRESH_LOCK_PREFIX}{provider}:{user_id}"
+    lock_token = secrets.token_hex(16)
+
+    try:
+        acquired = await redis_client.set(lock_key, lock_token, nx=True, px=REFRESH_LOCK_TTL_MS)
+    except Exception as e:
+        logger.warning("Refresh lock unavailable, refreshing with in-process lock only: %s", e)
+        return await _counted_refresh(provider, refresh)
+
+    if not acquired:
+        finished = await _wait_for_foreign_refresh(lock_key)
+        OAUTH_TOKEN_REFRESHES.labels(provider, "other_worker" if finished else "wait_timeout").inc()
+        # the winner stored new tokens in Postgres; drop our stale cached copy
+        invalidate_oauth_token(user_id, provider)
+        return finished
+
+    try:
+        return await _counted_refresh(provider, refresh)
+    finally:
+        try:
+            await redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, lock_token)
+        except Exception as e:
+            logger.warning("Failed to release refresh lock %s: %s", lock_key, e)
+
+
+async def single_flight_refresh(provider: str, user_id: str, refresh: Callable[[], Awaitable[bool]]) -> bool:
+    """
+    Run at most one token refresh per (user, provider) at a time.
+
+    Concurrent callers in this process await the in-flight refresh; callers in other
+    workers are serialized by a Redis lock and reuse whatever the winner stored.
+    """
+    key = (user_id, provider)
+    inflight = _inflight.get(key)
+    if inflight is not None:
+        OAUTH_TOKEN_REFRESHES.labels(provider, "coalesced").inc()
+        return await asyncio.shield(inflight)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        result = await _refresh_across_workers(provider, user_id, refresh)
+        future.set_result(result)
+        return result
+    except BaseException:
+        future.set_result(False)
+        raise
+    finally:
+        _inflight.pop(key, None)
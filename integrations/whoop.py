@@ -1,32 +1,68 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import delete
+from sqlalchemy import select, delete, func, or_
 from urllib.parse import urlencode,quote
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator, Awaitable, Callable, List
 from dotenv import load_dotenv
 
-import requests
+import asyncio
+import httpx
 import secrets
 import hashlib
+import hmac
 import base64
+import logging
+import time
 import os
 
-from databases.database import get_db, User, OAuthToken
-from databases.db_service import store_oauth_token, get_oauth_token
+from databases.database import (
+    AsyncSessionLocal, get_db, User, OAuthToken, DataSyncState,
+    WhoopCycle, WhoopRecovery, WhoopSleep, WhoopWorkout, WhoopDailyRollup, WhoopWeeklyRollup, WorkoutSoundtrack
+)
+from databases.db_service import store_oauth_token, get_oauth_token, invalidate_oauth_token
 from databases.oauth_state_service import OAuthStateService
+from integrations.rate_limiter import scheduled_request, background_priority
+from integrations.token_refresh import single_flight_refresh
+from cache.response_cache import response_cache
+from services.soundtrack_analytics import SOUNDTRACK_SOURCE
+from services.whoop_rollups import ROLLUP_SOURCE
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Whoop config
 WHOOP_CLIENT_ID = os.getenv("WHOOP_CLIENT_ID")
 WHOOP_CLIENT_SECRET = os.getenv("WHOOP_CLIENT_SECRET")
 WHOOP_REDIRECT_URI = os.getenv("WHOOP_REDIRECT_URI")
 
 # whoop api urls
-WHOOP_AUTH_URL = "https://api.prod.whoop.com/oauth/oauth2/auth"
-WHOOP_TOKEN_URL = "https://api.prod.whoop.com/oauth/oauth2/token"
-WHOOP_API_BASE_URL = "https://api.prod.whoop.com/developer/v2"
+WHOOP_AUTH_URL = os.getenv("WHOOP_AUTH_URL", "https://api.prod.whoop.com/oauth/oauth2/auth")
+WHOOP_TOKEN_URL = os.getenv("WHOOP_TOKEN_URL", "https://api.prod.whoop.com/oauth/oauth2/token")
+WHOOP_API_BASE_URL = os.getenv("WHOOP_API_BASE_URL", "https://api.prod.whoop.com/developer/v2")
+WHOOP_PAGE_SIZE = 25  # Whoop's maximum page size
+# webhooks signed longer ago than this are rejected as replays
+WHOOP_WEBHOOK_TOLERANCE_SECONDS = int(os.getenv("WHOOP_WEBHOOK_TOLERANCE_SECONDS", "300"))
 
 class WhoopIntegration:
+    @staticmethod
+    def verify_webhook_signature(body: bytes, timestamp: Optional[str], signature: Optional[str]) -> bool:
+        """
+        Whoop signs webhooks with base64(HMAC-SHA256(timestamp + raw body, client secret)), sending
+        the result in X-WHOOP-Signature and the millisecond timestamp in X-WHOOP-Signature-Timestamp
+        """
+        if not timestamp or not signature or not WHOOP_CLIENT_SECRET:
+            return False
+        try:
+            age = abs(time.time() - int(timestamp) / 1000)
+        except ValueError:
+            return False
+        if age > WHOOP_WEBHOOK_TOLERANCE_SECONDS:
+            return False
+        expected = base64.b64encode(
+            hmac.new(WHOOP_CLIENT_SECRET.encode(), timestamp.encode() + body, hashlib.sha256).digest()
+        ).decode()
+        return hmac.compare_digest(expected, signature)
+
     @staticmethod
     def generate_code_verifier():
         """Generate PKCE code verifier"""
@@ -76,8 +112,7 @@ class WhoopIntegration:
     
     @staticmethod
     async def whoop_callback(db: AsyncSession, code: str, state: str, error: Optional[str] = None) -> Dict[str, Any]:
-        print("👍 Code:", code)
-        print("👌🏾 State:", state)
+        logger.debug("Whoop OAuth callback", extra={"has_code": bool(code), "has_state": bool(state), "error": error})
         if error == "access_denied":
             return {
                 "success": False,
@@ -100,7 +135,6 @@ class WhoopIntegration:
             }
         
         state_data = await OAuthStateService.get_and_delete_state(db, state, "whoop")
-        print("😂 State data:", state_data)
         if not state_data:
             return {
                 "success": False,
@@ -122,10 +156,13 @@ class WhoopIntegration:
                 'code_verifier': code_verifier
             }
             
-            token_response = requests.post(WHOOP_TOKEN_URL, data=token_data)
+            token_response = await scheduled_request('whoop', WHOOP_CLIENT_ID, "POST", WHOOP_TOKEN_URL, data=token_data)
             
             if token_response.status_code != 200:
-                print(f"❌ Token exchange failed: {token_response.status_code} - {token_response.text}")
+                logger.warning(
+                    "Whoop token exchange failed",
+                    extra={"status": token_response.status_code, "body": token_response.text[:200]}
+                )
                 return {
                     "success": False,
                     "error": "token_exchange_failed",
@@ -136,13 +173,19 @@ class WhoopIntegration:
             access_token = tokens['access_token']
             
             # Get Whoop user profile
-            profile_response = requests.get(
+            profile_response = await scheduled_request(
+                'whoop',
+                WHOOP_CLIENT_ID,
+                "GET",
                 f"{WHOOP_API_BASE_URL}/user/profile/basic",
                 headers={'Authorization': f'Bearer {access_token}'}
             )
             
             if profile_response.status_code != 200:
-                print(f"❌ Profile fetch failed: {profile_response.status_code} - {profile_response.text}")
+                logger.warning(
+                    "Whoop profile fetch failed",
+                    extra={"status": profile_response.status_code, "body": profile_response.text[:200]}
+                )
                 return {
                     "success": False,
                     "error": "profile_fetch_failed",
@@ -166,6 +209,8 @@ class WhoopIntegration:
                 refresh_token=tokens.get('refresh_token'),
                 expires_in=tokens.get('expires_in')
             )
+            # a relinked account may be a different Whoop user
+            await response_cache.invalidate('whoop', fitpro_user_id)
             
             display_name = whoop_profile.get('first_name', 'Whoop User')
             
@@ -181,26 +226,52 @@ class WhoopIntegration:
                 "redirect_url": success_url
             }
             
-        except requests.RequestException as e:
-            print(f"❌ Network error during token exchange: {str(e)}")
+        except httpx.HTTPError as e:
+            logger.warning("Network error during Whoop token exchange: %s", e)
             return {
                 "success": False,
                 "error": "network_error",
                 "redirect_url": "fitpro://callback?error=network_error&message=Network error during authentication"
             }
         except Exception as e:
-            print(f"❌ Unexpected error during token exchange: {str(e)}")
+            logger.exception("Unexpected error during Whoop token exchange")
             return {
                 "success": False,
                 "error": "unexpected_error",
                 "redirect_url": "fitpro://callback?error=unexpected_error&message=Unexpected error occurred"
             }
     @staticmethod
-    async def refresh_whoop_token(db: AsyncSession, fitpro_user_id: str) -> bool:
-        """Refresh expired Whoop access token"""
-        token_data = await get_oauth_token(db, fitpro_user_id, 'whoop')
+    async def refresh_whoop_token(
+        db: AsyncSession,
+        fitpro_user_id: str,
+        stale_access_token: Optional[str] = None,
+        store_token: Optional[Callable[..., Awaitable[None]]] = None
+    ) -> bool:
+        """
+        Refresh expired Whoop access token, coalescing concurrent refreshes for the same user.
+        store_token replaces store_oauth_token for writing the new token, e.g. to batch writes.
+        """
+        return await single_flight_refresh(
+            'whoop',
+            fitpro_user_id,
+            lambda: WhoopIntegration._refresh_whoop_token(db, fitpro_user_id, stale_access_token, store_token)
+        )
+
+    @staticmethod
+    async def _refresh_whoop_token(
+        db: AsyncSession,
+        fitpro_user_id: str,
+        stale_access_token: Optional[str] = None,
+        store_token: Optional[Callable[..., Awaitable[None]]] = None
+    ) -> bool:
+        # bypass the cache: another worker may already have rotated the refresh token
+        token_data = await get_oauth_token(db, fitpro_user_id, 'whoop', use_cache=False)
         if not token_data or not token_data.get('refresh_token'):
             return False
+
+        if stale_access_token and token_data['access_token'] != stale_access_token:
+            # refreshed by someone else while we waited for the lock
+            return True
         
         refresh_data = {
             'grant_type': 'refresh_token',
@@ -210,12 +281,12 @@ class WhoopIntegration:
         }
         
         try:
-            response = requests.post(WHOOP_TOKEN_URL, data=refresh_data)
+            response = await scheduled_request('whoop', WHOOP_CLIENT_ID, "POST", WHOOP_TOKEN_URL, data=refresh_data)
             if response.status_code == 200:
                 new_token_info = response.json()
                 
-                await store_oauth_token(
-                    db=db,
+                store = store_token or (lambda **token: store_oauth_token(db, **token))
+                await store(
                     user_id=fitpro_user_id,
                     provider='whoop',
                     access_token=new_token_info['access_token'],
@@ -224,11 +295,33 @@ class WhoopIntegration:
                 )
                 return True
         except Exception as e:
-            print(f"Whoop token refresh failed: {e}")
+            logger.warning("Whoop token refresh failed: %s", e, extra={"user_id": fitpro_user_id})
         
         return False
     @staticmethod
-    async def make_api_request(db: AsyncSession, fitpro_user_id: str, endpoint: str, params: dict = None) -> Optional[Dict[str, Any]]:
+    async def make_api_request(db: AsyncSession, fitpro_user_id: str, endpoint: str, params: dict = None, use_cache: bool = True) -> Optional[Dict[str, Any]]:
+        """Authenticated GET against the Whoop API, served from the response cache where the endpoint allows it"""
+        if not use_cache:
+            return await WhoopIntegration._send_api_request(db, fitpro_user_id, endpoint, params)
+
+        return await response_cache.get_or_fetch(
+            'whoop',
+            fitpro_user_id,
+            endpoint,
+            params,
+            fetch=lambda: WhoopIntegration._send_api_request(db, fitpro_user_id, endpoint, params),
+            revalidate=lambda: WhoopIntegration._send_api_request_detached(fitpro_user_id, endpoint, params)
+        )
+
+    @staticmethod
+    async def _send_api_request_detached(fitpro_user_id: str, endpoint: str, params: dict = None) -> Optional[Dict[str, Any]]:
+        """Same request on its own session and at background priority, for work that outlives the calling request"""
+        with background_priority():
+            async with AsyncSessionLocal() as db:
+                return await WhoopIntegration._send_api_request(db, fitpro_user_id, endpoint, params)
+
+    @staticmethod
+    async def _send_api_request(db: AsyncSession, fitpro_user_id: str, endpoint: str, params: dict = None) -> Optional[Dict[str, Any]]:
         token_data = await get_oauth_token(db, fitpro_user_id, 'whoop')
         if not token_data:
             raise ValueError("User not authenticated with Whoop")
@@ -241,15 +334,15 @@ class WhoopIntegration:
         url = f"{WHOOP_API_BASE_URL}/{endpoint.lstrip('/')}"
         
         try:
-            response = requests.get(url, headers=headers, params=params)
+            response = await scheduled_request('whoop', WHOOP_CLIENT_ID, "GET", url, headers=headers, params=params)
             
             # Add token refresh logic
             if response.status_code == 401:
-                print("Whoop token expired, attempting refresh...")
-                if await WhoopIntegration.refresh_whoop_token(db, fitpro_user_id):
+                logger.info("Whoop token rejected, refreshing", extra={"user_id": fitpro_user_id})
+                if await WhoopIntegration.refresh_whoop_token(db, fitpro_user_id, token_data['access_token']):
                     token_data = await get_oauth_token(db, fitpro_user_id, 'whoop')
                     headers['Authorization'] = f"Bearer {token_data['access_token']}"
-                    response = requests.get(url, headers=headers, params=params)
+                    response = await scheduled_request('whoop', WHOOP_CLIENT_ID, "GET", url, headers=headers, params=params)
                 else:
                     raise ValueError("Access token expired and refresh failed. Please re-authenticate.")
             
@@ -258,7 +351,7 @@ class WhoopIntegration:
             
             return response.json()
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             raise ValueError(f"Failed to connect to Whoop: {str(e)}")
     
     # Specific API methods
@@ -282,6 +375,45 @@ class WhoopIntegration:
         """Get user's workout data"""
         return await WhoopIntegration.make_api_request(db, fitpro_user_id, "activity/workout")
     
+    @staticmethod
+    async def _fetch_page(fitpro_user_id: str, endpoint: str, params: dict) -> Dict[str, Any]:
+        # a page on its own short-lived session, so a long stream never pins a pool connection
+        async with AsyncSessionLocal() as db:
+            return await WhoopIntegration._send_api_request(db, fitpro_user_id, endpoint, params) or {}
+
+    @staticmethod
+    async def iter_collection_pages(
+        fitpro_user_id: str,
+        endpoint: str,
+        start: Optional[str] = None,
+        end: Optional[str] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Every page of a Whoop collection, following next_token. The next page is requested while
+        the caller consumes the current one, and at most those two pages are held at a time.
+        """
+        params = {"limit": WHOOP_PAGE_SIZE}
+        if start:
+            params["start"] = start
+        if end:
+            params["end"] = end
+
+        pending = asyncio.create_task(WhoopIntegration._fetch_page(fitpro_user_id, endpoint, dict(params)))
+        try:
+            while pending is not None:
+                page = await pending
+                pending = None
+                next_token = page.get("next_token")
+                if next_token:
+                    pending = asyncio.create_task(
+                        WhoopIntegration._fetch_page(fitpro_user_id, endpoint, {**params, "nextToken": next_token})
+                    )
+                yield page.get("records", [])
+        finally:
+            # consumer stopped early (client went away): don't leave the read-ahead running
+            if pending is not None and not pending.done():
+                pending.cancel()
+
     @staticmethod
     async def get_specific_workout(db: AsyncSession, fitpro_user_id: str, workout_id: str) -> Optional[Dict[str, Any]]:
         """Get specific workout by ID"""
@@ -300,16 +432,36 @@ class WhoopIntegration:
                 )
             )
             
+            # Drop the local copy of the user's Whoop data and what is derived from it; the rollup
+            # lock makes an in-flight rollup refresh finish first instead of re-adding old days
+            await db.execute(select(func.pg_advisory_xact_lock(func.hashtext(f"{ROLLUP_SOURCE}:{fitpro_user_id}"))))
+            for model in (
+                WhoopCycle, WhoopRecovery, WhoopSleep, WhoopWorkout,
+                WhoopDailyRollup, WhoopWeeklyRollup, WorkoutSoundtrack
+            ):
+                await db.execute(delete(model).where(model.user_id == fitpro_user_id))
+            await db.execute(
+                delete(DataSyncState).where(
+                    DataSyncState.user_id == fitpro_user_id,
+                    or_(
+                        DataSyncState.source.like('whoop:%'),
+                        DataSyncState.source.in_([ROLLUP_SOURCE, SOUNDTRACK_SOURCE])
+                    )
+                )
+            )
+            
             # Clear Whoop user ID from user record
             fitpro_user = await db.get(User, fitpro_user_id)
             if fitpro_user:
                 fitpro_user.whoop_user_id = None
             
             await db.commit()
+            invalidate_oauth_token(fitpro_user_id, 'whoop')
+            await response_cache.invalidate('whoop', fitpro_user_id)
             return True
             
         except Exception as e:
-            print(f"Error unlinking Whoop: {e}")
+            logger.error("Unlinking Whoop failed: %s", e, extra={"user_id": fitpro_user_id})
             await db.rollback()
             return False
 
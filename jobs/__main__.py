@@ -0,0 +1,25 @@
+"""Background job worker: python -m jobs [--types whoop_sync,warm_cache] [--no-periodic]"""
+import argparse
+import asyncio
+
+from integrations.http_client import close_http_clients
+from jobs.queue import job_queue
+from jobs.worker import JobWorker
+from monitoring.log import setup_logging
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run background jobs from the job queue")
+    parser.add_argument("--types", help="comma-separated job types to run (default: all)")
+    parser.add_argument("--no-periodic", action="store_true", help="don't enqueue periodic jobs from this worker")
+    args = parser.parse_args()
+    setup_logging()
+
+    async def main():
+        job_types = [name.strip() for name in args.types.split(",") if name.strip()] if args.types else None
+        try:
+            await JobWorker(job_queue, job_types, periodic=not args.no_periodic).run()
+        finally:
+            await close_http_clients()
+
+    asyncio.run(main())
@@ -0,0 +1,169 @@
+"""Job queue storage: Redis streams with a consumer group per job type, or in-memory for tests"""
+from typing import Any, Dict, List, Optional, Tuple
+from redis.exceptions import ResponseError
+
+import asyncio
+import heapq
+import itertools
+import json
+import time
+
+
+STREAM_PREFIX = "jobs:stream:"
+DELAYED_KEY = "jobs:delayed"
+DEAD_LETTER_KEY = "jobs:dead"
+IDEMPOTENCY_PREFIX = "jobs:idempotency:"
+CONSUMER_GROUP = "job-workers"
+STREAM_MAXLEN = 100000
+
+# move due delayed jobs onto their type's stream atomically, so two workers never both promote one;
+# the member is the job's JSON
+_PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(due) do
+    redis.call('ZREM', KEYS[1], member)
+    local job = cjson.decode(member)
+    redis.call('XADD', ARGV[3] .. job['type'], 'MAXLEN', '~', ARGV[4], '*', 'job', member)
+end
+return #due
+"""
+
+# (entry id, job, times delivered)
+Reserved = Tuple[str, Dict[str, Any], int]
+
+
+class RedisJobBackend:
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def _stream(job_type: str) -> str:
+        return STREAM_PREFIX + job_type
+
+    async def ensure_group(self, job_type: str):
+        try:
+            await self.client.xgroup_create(self._stream(job_type), CONSUMER_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def claim_idempotency_key(self, key: str, job_id: str, ttl: int) -> Optional[str]:
+        """None if the key is now ours, else the id of the job that already holds it"""
+        if await self.client.set(IDEMPOTENCY_PREFIX + key, job_id, nx=True, ex=ttl):
+            return None
+        existing = await self.client.get(IDEMPOTENCY_PREFIX + key)
+        return existing.decode() if existing else job_id
+
+    async def push(self, job: Dict[str, Any]):
+        await self.client.xadd(self._stream(job["type"]), {"job": json.dumps(job)}, maxlen=STREAM_MAXLEN, approximate=True)
+
+    async def schedule(self, job: Dict[str, Any], run_at: float):
+        await self.client.zadd(DELAYED_KEY, {json.dumps(job): run_at})
+
+    async def promote_due(self, limit: int = 100) -> int:
+        return await self.client.eval(_PROMOTE_SCRIPT, 1, DELAYED_KEY, time.time(), limit, STREAM_PREFIX, STREAM_MAXLEN)
+
+    async def reserve(self, job_type: str, consumer: str, block_ms: int) -> Optional[Reserved]:
+        response = await self.client.xreadgroup(
+            CONSUMER_GROUP, consumer, {self._stream(job_type): ">"}, count=1, block=block_ms
+        )
+        for _, entries in response or []:
+            for entry_id, fields in entries:
+                return entry_id.decode(), json.loads(fields[b"job"]), 1
+        return None
+
+    async def ack(self, job_type: str, entry_id: str):
+        await self.client.xack(self._stream(job_type), CONSUMER_GROUP, entry_id)
+
+    async def reclaim(self, job_type: str, consumer: str, idle_ms: int, limit: int = 50) -> List[Reserved]:
+        """Take over entries whose worker stopped acking them (crashed or hung past idle_ms)"""
+        stream = self._stream(job_type)
+        pending = await self.client.xpending_range(stream, CONSUMER_GROUP, min="-", max="+", count=limit, idle=idle_ms)
+        reclaimed = []
+        for entry in pending:
+            # claiming with a minimum idle time means only one worker wins each entry
+            for entry_id, fields in await self.client.xclaim(stream, CONSUMER_GROUP, consumer, idle_ms, [entry["message_id"]]):
+                if not fields:
+                    # trimmed from the stream; nothing left to run
+                    await self.client.xack(stream, CONSUMER_GROUP, entry_id)
+                    continue
+                reclaimed.append((entry_id.decode(), json.loads(fields[b"job"]), entry["times_delivered"] + 1))
+        return reclaimed
+
+    async def dead_letter(self, job: Dict[str, Any], error: str):
+        await self.client.xadd(
+            DEAD_LETTER_KEY, {"job": json.dumps(job), "error": error}, maxlen=STREAM_MAXLEN, approximate=True
+        )
+
+
+class MemoryJobBackend:
+    """Single-process stand-in for RedisJobBackend; nothing survives a restart"""
+
+    def __init__(self):
+        self.ready: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+        # entry id -> (job type, job, consumer, delivered at, times delivered)
+        self.pending: Dict[str, Tuple[str, Dict[str, Any], str, float, int]] = {}
+        self.delayed: List[Tuple[float, int, Dict[str, Any]]] = []
+        self.dead: List[Tuple[Dict[str, Any], str]] = []
+        self.idempotency: Dict[str, Tuple[str, float]] = {}
+        self._ids = itertools.count(1)
+        self._available: Dict[str, asyncio.Event] = {}
+
+    def _event(self, job_type: str) -> asyncio.Event:
+        return self._available.setdefault(job_type, asyncio.Event())
+
+    async def ensure_group(self, job_type: str):
+        self.ready.setdefault(job_type, [])
+
+    async def claim_idempotency_key(self, key: str, job_id: str, ttl: int) -> Optional[str]:
+        held = self.idempotency.get(key)
+        if held and held[1] > time.monotonic():
+            return held[0]
+        self.idempotency[key] = (job_id, time.monotonic() + ttl)
+        return None
+
+    async def push(self, job: Dict[str, Any]):
+        self.ready.setdefault(job["type"], []).append((f"{next(self._ids)}-0", job))
+        self._event(job["type"]).set()
+
+    async def schedule(self, job: Dict[str, Any], run_at: float):
+        heapq.heappush(self.delayed, (run_at, next(self._ids), job))
+
+    async def promote_due(self, limit: int = 100) -> int:
+        promoted = 0
+        while self.delayed and self.delayed[0][0] <= time.time() and promoted < limit:
+            _, _, job = heapq.heappop(self.delayed)
+            await self.push(job)
+            promoted += 1
+        return promoted
+
+    async def reserve(self, job_type: str, consumer: str, block_ms: int) -> Optional[Reserved]:
+        queue = self.ready.setdefault(job_type, [])
+        if not queue:
+            event = self._event(job_type)
+            event.clear()
+            try:
+                await asyncio.wait_for(event.wait(), block_ms / 1000)
+            except asyncio.TimeoutError:
+                return None
+            if not queue:
+                return None
+        entry_id, job = queue.pop(0)
+        self.pending[entry_id] = (job_type, job, consumer, time.monotonic(), 1)
+        return entry_id, job, 1
+
+    async def ack(self, job_type: str, entry_id: str):
+        self.pending.pop(entry_id, None)
+
+    async def reclaim(self, job_type: str, consumer: str, idle_ms: int, limit: int = 50) -> List[Reserved]:
+        now = time.monotonic()
+        reclaimed = []
+        for entry_id, (pending_type, job, _, delivered_at, deliveries) in list(self.pending.items()):
+            if pending_type != job_type or (now - delivered_at) * 1000 < idle_ms or len(reclaimed) >= limit:
+                continue
+            self.pending[entry_id] = (job_type, job, consumer, now, deliveries + 1)
+            reclaimed.append((entry_id, job, deliveries + 1))
+        return reclaimed
+
+    async def dead_letter(self, job: Dict[str, Any], error: str):
+        self.dead.append((job, error))
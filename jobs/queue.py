@@ -0,0 +1,98 @@
+"""Durable background jobs, e.g. await job_queue.enqueue("whoop_sync", {"user_id": user_id})"""
+from typing import Any, Dict, Optional
+from dotenv import load_dotenv
+
+import logging
+import random
+import time
+import uuid
+import os
+
+from databases.database import redis_client
+from jobs.backends import MemoryJobBackend, RedisJobBackend
+from services.token_refresher import TOKEN_REFRESH_INTERVAL_SECONDS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+JOB_BACKEND = os.getenv("JOB_BACKEND", "redis")  # "redis" or "memory"
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "3600"))
+JOB_IDEMPOTENCY_TTL = int(os.getenv("JOB_IDEMPOTENCY_TTL", "3600"))
+
+JOB_DEFAULTS = {"concurrency": 1, "max_attempts": 5, "timeout": 300}
+
+# job type -> limits. concurrency is per worker process, timeout is seconds per attempt, and
+# types with `every` are also enqueued by the workers on that interval (once per interval in total)
+JOB_TYPES = {
+    "refresh_token": {"concurrency": 4, "max_attempts": 3, "timeout": 60},
+    "refresh_expiring_tokens": {"concurrency": 1, "max_attempts": 1, "timeout": 600, "every": TOKEN_REFRESH_INTERVAL_SECONDS},
+    "whoop_sync": {"concurrency": 4, "max_attempts": 5, "timeout": 300},
+    "spotify_history_sync": {"concurrency": 4, "max_attempts": 5, "timeout": 300},
+    "spotify_history_sync_all": {"concurrency": 1, "max_attempts": 1, "timeout": 1800, "every": 1800},
+    "warm_cache": {"concurrency": 2, "max_attempts": 2, "timeout": 60},
+    "cleanup_oauth_states": {"concurrency": 1, "max_attempts": 1, "timeout": 300, "every": 600},
+}
+
+
+def job_config(job_type: str) -> Dict[str, Any]:
+    return {**JOB_DEFAULTS, **JOB_TYPES[job_type]}
+
+def retry_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Exponential backoff with jitter after the given (1-based) failed attempt"""
+    delay = min(JOB_RETRY_BASE_SECONDS * 2 ** (attempt - 1), JOB_RETRY_MAX_SECONDS)
+    delay *= random.uniform(0.5, 1.0)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class JobQueue:
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def enqueue(
+        self,
+        job_type: str,
+        payload: Optional[Dict[str, Any]] = None,
+        delay: float = 0,
+        idempotency_key: Optional[str] = None,
+        idempotency_ttl: int = JOB_IDEMPOTENCY_TTL
+    ) -> str:
+        """
+        Queue a job, to run after `delay` seconds; returns its id. With an idempotency key that is
+        already held, nothing is queued and the id of the job holding it is returned.
+        """
+        if job_type not in JOB_TYPES:
+            raise ValueError(f"Unknown job type: {job_type}")
+        job = {
+            "id": uuid.uuid4().hex,
+            "type": job_type,
+            "payload": payload or {},
+            "attempt": 1,
+            "enqueued_at": time.time(),
+        }
+        if idempotency_key:
+            existing = await self.backend.claim_idempotency_key(idempotency_key, job["id"], idempotency_ttl)
+            if existing:
+                logger.debug("Job already queued", extra={"job_type": job_type, "job_id": existing})
+                return existing
+            job["idempotency_key"] = idempotency_key
+
+        if delay > 0:
+            await self.backend.schedule(job, time.time() + delay)
+        else:
+            await self.backend.push(job)
+        return job["id"]
+
+    async def retry(self, job: Dict[str, Any], delay: float):
+        await self.backend.schedule({**job, "attempt": job["attempt"] + 1}, time.time() + delay)
+
+
+def _backend():
+    if JOB_BACKEND == "memory":
+        return MemoryJobBackend()
+    return RedisJobBackend(redis_client)
+
+job_queue = JobQueue(_backend())
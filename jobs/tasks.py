@@ -0,0 +1,93 @@
+"""Job handlers, one per type in jobs.queue.JOB_TYPES; raising fails the attempt"""
+from typing import Any, Awaitable, Callable, Dict
+from dotenv import load_dotenv
+
+import logging
+
+from cache.response_cache import RESPONSE_CACHE_POLICIES
+from databases.database import AsyncSessionLocal, User
+from databases.oauth_state_service import OAuthStateService
+from integrations.whoop import WhoopIntegration
+from integrations.spotify import SpotifyIntegration
+from monitoring.metrics import OAUTH_STATES_SWEPT
+from services.spotify_history import SpotifyHistorySync, sync_all_users
+from services.token_refresher import (
+    REFRESHERS,
+    TOKEN_REFRESH_INTERVAL_SECONDS,
+    acquire_refresher_leadership,
+    refresh_expiring_tokens as refresh_expiring,
+)
+from services.whoop_sync import WhoopSyncEngine
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# provider -> how to GET one of its endpoints through the response cache
+CACHE_FETCHERS = {
+    "whoop": WhoopIntegration.make_api_request,
+    "spotify": SpotifyIntegration.make_spotify_api_request,
+}
+
+
+async def refresh_token(payload: Dict[str, Any]):
+    """{"user_id", "provider"}: refresh one OAuth token now"""
+    async with AsyncSessionLocal() as db:
+        if not await REFRESHERS[payload["provider"]](db, payload["user_id"]):
+            raise ValueError(f"{payload['provider']} token refresh failed")
+
+async def refresh_expiring_tokens(payload: Dict[str, Any]):
+    """Refresh every token about to expire, as the in-API refresher does"""
+    # same leader lock as the in-API refresher, so only one of them scans per interval
+    if not await acquire_refresher_leadership(TOKEN_REFRESH_INTERVAL_SECONDS):
+        return
+    stats = await refresh_expiring()
+    logger.info("Token refresh job finished", extra=stats)
+
+async def whoop_sync(payload: Dict[str, Any]):
+    """{"user_id", "collection"?}: incremental sync of one collection, or all of them"""
+    async with AsyncSessionLocal() as db:
+        if payload.get("collection"):
+            await WhoopSyncEngine.sync_collection(db, payload["user_id"], payload["collection"])
+        else:
+            await WhoopSyncEngine.sync_user(db, payload["user_id"])
+
+async def spotify_history_sync(payload: Dict[str, Any]):
+    """{"user_id"}: capture the user's newest Spotify plays"""
+    async with AsyncSessionLocal() as db:
+        await SpotifyHistorySync.sync_user(db, payload["user_id"])
+
+async def spotify_history_sync_all(payload: Dict[str, Any]):
+    stats = await sync_all_users()
+    logger.info("Spotify history sync job finished", extra=stats)
+
+async def warm_cache(payload: Dict[str, Any]):
+    """{"user_id"}: fill the response cache for every cacheable endpoint of the user's linked providers"""
+    user_id = payload["user_id"]
+    async with AsyncSessionLocal() as db:
+        user = await db.get(User, user_id)
+        if user is None:
+            return
+        linked = {"whoop": user.whoop_user_id, "spotify": user.spotify_user_id}
+        for (provider, endpoint), policy in RESPONSE_CACHE_POLICIES.items():
+            if linked.get(provider):
+                for params in policy.get("warm", []):
+                    await CACHE_FETCHERS[provider](db, user_id, endpoint, params)
+
+async def cleanup_oauth_states(payload: Dict[str, Any]):
+    """Drop OAuth states whose login flow was never finished"""
+    async with AsyncSessionLocal() as db:
+        deleted = await OAuthStateService.sweep_expired_states(db)
+    OAUTH_STATES_SWEPT.inc(deleted)
+    logger.info("Expired OAuth states removed", extra={"deleted": deleted})
+
+
+HANDLERS: Dict[str, Callable[[Dict[str, Any]], Awaitable[None]]] = {
+    "refresh_token": refresh_token,
+    "refresh_expiring_tokens": refresh_expiring_tokens,
+    "whoop_sync": whoop_sync,
+    "spotify_history_sync": spotify_history_sync,
+    "spotify_history_sync_all": spotify_history_sync_all,
+    "warm_cache": warm_cache,
+    "cleanup_oauth_states": cleanup_oauth_states,
+}
@@ -0,0 +1,129 @@
+"""Runs jobs.tasks handlers from the queue, with promotion, reclaiming and periodic enqueues alongside"""
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+
+import asyncio
+import logging
+import socket
+import time
+import os
+
+from integrations.rate_limiter import background_priority
+from jobs.queue import JOB_TYPES, JobQueue, job_config, retry_delay
+from jobs.tasks import HANDLERS
+from monitoring.metrics import JOB_SECONDS, JOBS_PROCESSED
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKER_BLOCK_MS = int(os.getenv("JOB_WORKER_BLOCK_MS", "5000"))
+JOB_PROMOTE_INTERVAL_SECONDS = float(os.getenv("JOB_PROMOTE_INTERVAL_SECONDS", "1"))
+JOB_RECLAIM_INTERVAL_SECONDS = float(os.getenv("JOB_RECLAIM_INTERVAL_SECONDS", "30"))
+# a job unacked this long past its timeout belongs to a worker that is gone
+JOB_RECLAIM_GRACE_SECONDS = int(os.getenv("JOB_RECLAIM_GRACE_SECONDS", "60"))
+
+
+class JobWorker:
+    def __init__(self, queue: JobQueue, job_types: Optional[List[str]] = None, periodic: bool = True):
+        unknown = set(job_types or []) - set(JOB_TYPES)
+        if unknown:
+            raise ValueError(f"Unknown job types: {', '.join(sorted(unknown))}")
+        self.queue = queue
+        self.backend = queue.backend
+        self.job_types = job_types or list(JOB_TYPES)
+        self.periodic = periodic
+        self.name = f"{socket.gethostname()}-{os.getpid()}"
+        self._periodic_buckets: Dict[str, int] = {}
+
+    async def run(self):
+        for job_type in self.job_types:
+            await self.backend.ensure_group(job_type)
+        loops = [
+            self._consume(job_type, f"{self.name}-{job_type}-{i}")
+            for job_type in self.job_types
+            for i in range(job_config(job_type)["concurrency"])
+        ]
+        loops += [self._promote(), self._reclaim()]
+        if self.periodic:
+            loops.append(self._enqueue_periodic())
+        logger.info("Job worker started", extra={"worker": self.name, "job_types": self.job_types, "consumers": len(loops) - 2})
+        await asyncio.gather(*loops)
+
+    async def execute(self, job_type: str, entry_id: str, job: Dict[str, Any], deliveries: int = 1) -> str:
+        """Run one reserved job, then retry, dead-letter or finish it; returns the outcome"""
+        config = job_config(job_type)
+        started = time.monotonic()
+        try:
+            if deliveries > config["max_attempts"]:
+                # every delivery so far died with its worker or hung; don't hand it to another one
+                raise RuntimeError(f"delivered {deliveries} times without finishing")
+            with background_priority():
+                await asyncio.wait_for(HANDLERS[job_type](job["payload"]), config["timeout"])
+            outcome = "done"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            extra = {"job_type": job_type, "job_id": job["id"], "attempt": job["attempt"]}
+            if job["attempt"] < config["max_attempts"] and deliveries <= config["max_attempts"]:
+                # honour an upstream's Retry-After when it gave one
+                delay = retry_delay(job["attempt"], getattr(e, "retry_after", None))
+                await self.queue.retry(job, delay)
+                outcome = "retried"
+                logger.warning("Job failed, retrying in %.0fs: %s", delay, error, extra=extra)
+            else:
+                await self.backend.dead_letter(job, error)
+                outcome = "dead_lettered"
+                logger.error("Job failed for good: %s", error, extra=extra)
+        await self.backend.ack(job_type, entry_id)
+        JOBS_PROCESSED.labels(job_type, outcome).inc()
+        JOB_SECONDS.labels(job_type).observe(time.monotonic() - started)
+        return outcome
+
+    async def _consume(self, job_type: str, consumer: str):
+        while True:
+            try:
+                reserved = await self.backend.reserve(job_type, consumer, JOB_WORKER_BLOCK_MS)
+                if reserved:
+                    await self.execute(job_type, *reserved)
+            except Exception as e:
+                # an unacked job is reclaimed later
+                logger.warning("Job consumer error: %s", e, extra={"job_type": job_type})
+                await asyncio.sleep(1)
+
+    async def _promote(self):
+        while True:
+            try:
+                while await self.backend.promote_due() > 0:
+                    pass
+            except Exception as e:
+                logger.warning("Promoting delayed jobs failed: %s", e)
+            await asyncio.sleep(JOB_PROMOTE_INTERVAL_SECONDS)
+
+    async def _reclaim(self):
+        while True:
+            await asyncio.sleep(JOB_RECLAIM_INTERVAL_SECONDS)
+            for job_type in self.job_types:
+                idle_ms = (job_config(job_type)["timeout"] + JOB_RECLAIM_GRACE_SECONDS) * 1000
+                try:
+                    for reserved in await self.backend.reclaim(job_type, f"{self.name}-reclaim", idle_ms):
+                        logger.info("Reclaimed unfinished job", extra={"job_type": job_type, "job_id": reserved[1]["id"]})
+                        await self.execute(job_type, *reserved)
+                except Exception as e:
+                    logger.warning("Reclaiming jobs failed: %s", e, extra={"job_type": job_type})
+
+    async def _enqueue_periodic(self):
+        periodic = {job_type: job_config(job_type)["every"] for job_type in self.job_types if "every" in JOB_TYPES[job_type]}
+        while True:
+            now = time.time()
+            for job_type, every in periodic.items():
+                bucket = int(now // every)
+                if self._periodic_buckets.get(job_type) == bucket:
+                    continue
+                try:
+                    await self.queue.enqueue(
+                        job_type, idempotency_key=f"periodic:{job_type}:{bucket}", idempotency_ttl=int(every * 2)
+                    )
+                    self._periodic_buckets[job_type] = bucket
+                except Exception as e:
+                    logger.warning("Enqueueing periodic job failed: %s", e, extra={"job_type": job_type})
+            await asyncio.sleep(1)
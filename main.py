@@ -1,6 +1,6 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, Response
 import requests
 import secrets
 import hashlib
@@ -8,12 +8,27 @@ import base64
 import os
 from typing import Optional
 import json
+import logging
 import uvicorn
 
 from databases.database import engine, Base
 from routers.app_routes import router
 from routers.whoop_routes import whoop_router
 from routers.spotify_routes import spotify_router
+from routers.dashboard_routes import dashboard_router
+from routers.webhook_routes import webhook_router
+from integrations.http_client import close_http_clients
+from auth.auth import shutdown_password_hasher
+from services.token_refresher import start_token_refresher, stop_token_refresher
+from services.now_playing import now_playing_hub
+from services.whoop_webhooks import start_webhook_consumers, stop_webhook_consumers
+from cache.response_cache import response_cache
+from monitoring.middleware import MetricsMiddleware, RequestIdMiddleware
+from monitoring.metrics import render_metrics
+from monitoring.log import setup_logging, shutdown_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="FitPro API", 
@@ -29,16 +44,32 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
 
 app.include_router(spotify_router, prefix="/spotify", tags=["spotify"])
 app.include_router(whoop_router, prefix="/whoop", tags=["whoop"])
 app.include_router(router, prefix="/app", tags=["app"])
+app.include_router(dashboard_router, prefix="/app", tags=["app"])
+app.include_router(webhook_router, prefix="/webhooks", tags=["webhooks"])
 
 @app.on_event("startup")
 async def create_tables():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-    print("✅ Database tables created/verified")
+    logger.info("Database tables created/verified", extra={"database": engine.url.render_as_string(hide_password=True)})
+    start_token_refresher()
+    start_webhook_consumers()
+
+@app.on_event("shutdown")
+async def close_http_pool():
+    await stop_token_refresher()
+    await stop_webhook_consumers()
+    await now_playing_hub.close()
+    await close_http_clients()
+    shutdown_password_hasher()
+    logger.info("Upstream HTTP connections closed")
+    shutdown_logging()
 
 @app.get("/")
 async def root():
@@ -58,7 +89,18 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+@app.get("/health/cache")
+async def cache_stats():
+    """Per-endpoint upstream response cache counters for this worker"""
+    return {"response_cache": response_cache.get_stats()}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 if __name__ == "__main__":
-    print("🚀 Starting FitPro API...")
+    logger.info("Starting FitPro API")
     uvicorn.run(app, host="0.0.0.0", port=8000)
 
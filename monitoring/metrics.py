@@ -0,0 +1,168 @@
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from urllib.parse import urlsplit
+
+import time
+import re
+import os
+
+# Sub-millisecond resolution for the fast paths (pool checkout, cache hits); the default
+# buckets cover request and upstream latency.
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "API request latency by route template and status",
+    ["method", "route", "status"]
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "API requests currently being served",
+    multiprocess_mode="livesum"
+)
+
+UPSTREAM_REQUEST_SECONDS = Histogram(
+    "upstream_request_duration_seconds",
+    "Provider API call latency by endpoint and status",
+    ["provider", "method", "endpoint", "status"]
+)
+UPSTREAM_QUEUE_SECONDS = Histogram(
+    "upstream_rate_limit_wait_seconds",
+    "Time spent waiting for provider rate-limit capacity",
+    ["provider", "priority"],
+    buckets=FAST_BUCKETS
+)
+
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds",
+    "Time to obtain a connection from the SQLAlchemy pool",
+    buckets=FAST_BUCKETS
+)
+DB_POOL_CHECKOUT_TIMEOUTS = Counter(
+    "db_pool_checkout_timeouts_total",
+    "Pool checkouts that timed out waiting for a connection"
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "SQLAlchemy pool connections by state",
+    ["state"],
+    multiprocess_mode="livesum"
+)
+
+OAUTH_TOKEN_REFRESHES = Counter(
+    "oauth_token_refresh_total",
+    "OAuth token refresh attempts by outcome",
+    ["provider", "outcome"]
+)
+
+OAUTH_STATES_SWEPT = Counter(
+    "oauth_states_swept_total",
+    "Expired oauth_states rows deleted by the sweeper"
+)
+
+NOW_PLAYING_STREAMS = Gauge(
+    "now_playing_streams",
+    "Open currently-playing event streams",
+    multiprocess_mode="livesum"
+)
+NOW_PLAYING_POLLERS = Gauge(
+    "now_playing_pollers",
+    "Users whose Spotify currently-playing this worker polls",
+    multiprocess_mode="livesum"
+)
+
+WHOOP_WEBHOOK_EVENTS = Counter(
+    "whoop_webhook_events_total",
+    "Whoop webhook events by type and outcome",
+    ["type", "outcome"]
+)
+
+JOBS_PROCESSED = Counter(
+    "jobs_processed_total",
+    "Background job attempts by type and outcome",
+    ["type", "outcome"]
+)
+JOB_SECONDS = Histogram(
+    "job_seconds",
+    "Background job attempt duration",
+    ["type"]
+)
+
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Cache lookups by cache and result",
+    ["cache", "result"]
+)
+
+PASSWORD_HASH_SECONDS = Histogram(
+    "password_hash_seconds",
+    "PBKDF2 computation time",
+    ["operation"],
+    buckets=FAST_BUCKETS
+)
+PASSWORD_HASH_QUEUE_SECONDS = Histogram(
+    "password_hash_queue_seconds",
+    "Time a PBKDF2 job waited for a hashing thread",
+    buckets=FAST_BUCKETS
+)
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total",
+    "Log records dropped because the logging queue was full"
+)
+
+PASSWORD_HASH_REJECTED = Counter(
+    "password_hash_rejected_total",
+    "PBKDF2 jobs rejected because the hashing queue was full"
+)
+
+
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    """Times every checkout, including waits for a free connection"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            DB_POOL_CHECKOUT_TIMEOUTS.inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
+
+def register_pool_metrics(engine: AsyncEngine):
+    """Pool gauges are read at scrape time rather than updated on every checkout"""
+    pool = engine.pool
+    DB_POOL_CONNECTIONS.labels("checked_out").set_function(pool.checkedout)
+    DB_POOL_CONNECTIONS.labels("idle").set_function(pool.checkedin)
+    DB_POOL_CONNECTIONS.labels("overflow").set_function(lambda: max(pool.overflow(), 0))
+    DB_POOL_CONNECTIONS.labels("size").set_function(pool.size)
+
+
+_ID_SEGMENT = re.compile(r"^(?=.*\d)[\w-]{8,}$|^[A-Za-z0-9]{16,}$")
+
+def upstream_endpoint(url: str) -> str:
+    """URL path with ids collapsed, so per-record calls share one label"""
+    segments = urlsplit(url).path.strip("/").split("/")
+    return "/" + "/".join("{id}" if _ID_SEGMENT.match(segment) else segment for segment in segments)
+
+
+def render_metrics() -> tuple:
+    # under gunicorn/uvicorn workers each process writes to PROMETHEUS_MULTIPROC_DIR
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
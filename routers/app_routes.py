@@ -9,7 +9,8 @@ from auth.auth import (
     register_user, 
     refresh_access_token, 
     login_user,
-    get_current_user
+    get_current_user,
+    PasswordHashingBusy
 )
 
 router = APIRouter()
@@ -36,6 +37,8 @@ async def register(user_data: UserRegistration, db: AsyncSession = Depends(get_d
         return result
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except PasswordHashingBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     
 @router.post("/login")
 async def login(login_data: UserLogin, db: AsyncSession = Depends(get_db)):
@@ -44,6 +47,8 @@ async def login(login_data: UserLogin, db: AsyncSession = Depends(get_db)):
         return result
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except PasswordHashingBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     
 @router.post("/refresh")
 async def refresh_token_endpoint(token_request: RefreshTokenRequest, db: AsyncSession = Depends(get_db)):
@@ -66,21 +71,25 @@ async def get_current_user_profile(
         token = credentials.credentials
         current_user = await get_current_user(db, token)
         
-        return {
-            "user_id": current_user.user_id,
-            "email": current_user.email,
-            "username": current_user.username,
-            "first_name": current_user.first_name,
-            "last_name": current_user.last_name,
-            "display_name": current_user.display_name or current_user.first_name or current_user.username,
-            "created_at": current_user.created_at,
-            "linked_accounts": {
-                "whoop": current_user.whoop_user_id is not None,
-                "spotify": current_user.spotify_user_id is not None
-            }
-        }
+        return user_profile(current_user)
     except ValueError as e:
         raise HTTPException(status_code=401, detail=str(e))   
+
+def user_profile(current_user) -> Dict:
+    """Profile fields shared by /me and /dashboard"""
+    return {
+        "user_id": current_user.user_id,
+        "email": current_user.email,
+        "username": current_user.username,
+        "first_name": current_user.first_name,
+        "last_name": current_user.last_name,
+        "display_name": current_user.display_name or current_user.first_name or current_user.username,
+        "created_at": current_user.created_at,
+        "linked_accounts": {
+            "whoop": current_user.whoop_user_id is not None,
+            "spotify": current_user.spotify_user_id is not None
+        }
+    }
     
 # ============================================================================
 # HELPER DEPENDENCY FOR OTHER ROUTERS
@@ -100,4 +109,4 @@ async def get_authenticated_user(
         return user
     except ValueError as e:
         raise HTTPException(status_code=401, detail="Authentication required")
-__all__ = ["router", "get_authenticated_user"]
\ No newline at end of file
+__all__ = ["router", "get_authenticated_user", "user_profile"]
\ No newline at end of file
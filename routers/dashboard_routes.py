@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from databases.database import get_db
+from services.dashboard import build_dashboard
+from .app_routes import get_authenticated_user, user_profile
+
+dashboard_router = APIRouter()
+
+@dashboard_router.get("/dashboard")
+async def get_dashboard(
+    limit: int = Query(7, ge=1, le=100),
+    db: AsyncSession = Depends(get_db),
+    current_user = Depends(get_authenticated_user)
+):
+    """
+    Profile, Whoop recovery/sleep/workouts and Spotify currently-playing in one call.
+    Sections load concurrently; each reports ok, not_linked, rate_limited, timeout or error.
+    """
+    return {
+        "user": user_profile(current_user),
+        "sections": await build_dashboard(db, current_user, limit)
+    }
@@ -1,23 +1,32 @@
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import RedirectResponse
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import RedirectResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 import requests
 import secrets
 import hashlib
 import base64
 import os
+import json
+import logging
 from dotenv import load_dotenv
 from urllib.parse import urlencode
+from datetime import datetime
 from typing import Optional
 
 
 from databases.database import get_db, User
 from databases.db_service import store_oauth_token, get_oauth_token
 from integrations.spotify import SpotifyIntegration
+from integrations.rate_limiter import UpstreamRateLimited
+from services.now_playing import now_playing_hub
+from services.recommendations import recommend
+from services.spotify_history import SpotifyHistorySync, play_to_dict
 from .app_routes import get_authenticated_user
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 spotify_router = APIRouter()
 
 @spotify_router.get("/auth/login")
@@ -50,7 +59,7 @@ async def spotify_callback(
         # return RedirectResponse(url=result["redirect_url"])
         return result
     except Exception as e:
-        print(f"❌ Unexpected error in OAuth callback: {str(e)}")
+        logger.exception("Unexpected error in OAuth callback")
         error_url = "fitpro://callback?error=unexpected_error&message=Unexpected error occurred"
         return RedirectResponse(url=error_url)
 
@@ -85,8 +94,10 @@ async def spotify_user_profile(
         result = await SpotifyIntegration.get_user_profile(db, current_user.user_id)
 
         return result
+    except UpstreamRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
     except Exception as e:
-        print(f"❌ Unexpected error in OAuth callback: {str(e)}")
+        logger.exception("Unexpected error fetching profile")
         error_url = "fitpro://callback?error=unexpected_error&message=Unexpected error occurred"
         return RedirectResponse(url=error_url)
     
@@ -98,9 +109,70 @@ async def spotify_recently_played(
     try:
         result = await SpotifyIntegration.get_recently_played(db, current_user.user_id, limit=20)
         return result
+    except UpstreamRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get recently played: {str(e)}")
 
+@spotify_router.get("/history")
+async def spotify_history(
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[datetime] = None,
+    after: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user = Depends(get_authenticated_user)
+):
+    """
+    Listening history from the local store, newest first. Pass next_before back as `before`
+    for the next page.
+    """
+    if not current_user.spotify_user_id:
+        raise HTTPException(status_code=400, detail="Spotify account not linked")
+    try:
+        await SpotifyHistorySync.ensure_synced(db, current_user.user_id)
+        plays = await SpotifyHistorySync.get_plays(db, current_user.user_id, limit, before, after)
+        return {
+            "plays": [play_to_dict(play) for play in plays],
+            "next_before": plays[-1].played_at.isoformat() if len(plays) == limit else None
+        }
+    except UpstreamRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get listening history: {str(e)}")
+
+@spotify_router.get("/history/top-tracks")
+async def spotify_history_top_tracks(
+    days: int = Query(30, ge=1, le=365),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db),
+    current_user = Depends(get_authenticated_user)
+):
+    """Most played tracks over the last `days` days, from the local store"""
+    if not current_user.spotify_user_id:
+        raise HTTPException(status_code=400, detail="Spotify account not linked")
+    try:
+        await SpotifyHistorySync.ensure_synced(db, current_user.user_id)
+        return {"tracks": await SpotifyHistorySync.get_top_tracks(db, current_user.user_id, days, limit)}
+    except UpstreamRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get top tracks: {str(e)}")
+
+@spotify_router.get("/recommendations")
+async def spotify_recommendations(
+    limit: int = Query(20, ge=1, le=100),
+    current_user = Depends(get_authenticated_user)
+):
+    """The user's own tracks ranked against audio features picked for today's Whoop recovery"""
+    if not current_user.spotify_user_id:
+        raise HTTPException(status_code=400, detail="Spotify account not linked")
+    try:
+        return await recommend(current_user, limit)
+    except UpstreamRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to build recommendations: {str(e)}")
+
 @spotify_router.get("/currently-playing")
 async def spotify_currently_playing(
     db: AsyncSession = Depends(get_db),
@@ -109,8 +181,37 @@ async def spotify_currently_playing(
     try:
         result = await SpotifyIntegration.get_currently_playing(db, current_user.user_id)
         return result or {"message": "No track currently playing"}
+    except UpstreamRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get currently playing: {str(e)}")
+
+@spotify_router.get("/currently-playing/stream")
+async def spotify_currently_playing_stream(
+    db: AsyncSession = Depends(get_db),
+    current_user = Depends(get_authenticated_user)
+):
+    """
+    Server-sent events: the current state right away, then one event per track or play/pause change.
+    All of a user's streams share a single upstream poller.
+    """
+    if not current_user.spotify_user_id:
+        raise HTTPException(status_code=400, detail="Spotify account not linked")
+    # the stream may stay open for hours; don't keep the request's session around for it
+    await db.close()
+
+    async def events():
+        async for state in now_playing_hub.subscribe(current_user.user_id):
+            if state is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: now_playing\ndata: {json.dumps(state)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 # @spotify_router.get("/api/user/{user_id}/profile")
 # async def get_user_profile(user_id: str):
 #     """Get user's Spotify profile"""
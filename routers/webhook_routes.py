@@ -0,0 +1,46 @@
+from fastapi import APIRouter, HTTPException, Request, Response
+import json
+import logging
+from dotenv import load_dotenv
+
+from integrations.whoop import WhoopIntegration
+from services.whoop_webhooks import EVENT_TYPES, enqueue_event
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+webhook_router = APIRouter()
+
+
+@webhook_router.post("/whoop", status_code=204)
+async def receive_whoop_webhook(request: Request):
+    """
+    Whoop record change notifications. Verified and queued only; the webhook consumers fetch the
+    changed record. Any 2xx tells Whoop the event was delivered, so nothing is retried after this.
+    """
+    body = await request.body()
+    if not WhoopIntegration.verify_webhook_signature(
+        body,
+        request.headers.get("X-WHOOP-Signature-Timestamp"),
+        request.headers.get("X-WHOOP-Signature")
+    ):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+
+    try:
+        event = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Webhook body must be JSON")
+    if not isinstance(event, dict) or event.get("user_id") is None or event.get("id") is None:
+        raise HTTPException(status_code=400, detail="Webhook is missing user_id or id")
+    if event.get("type") not in EVENT_TYPES:
+        logger.info("Ignoring Whoop webhook", extra={"event_type": event.get("type")})
+        return Response(status_code=204)
+
+    try:
+        await enqueue_event(event)
+    except Exception as e:
+        # a non-2xx makes Whoop retry the delivery later
+        logger.error("Queueing Whoop webhook failed: %s", e, extra={"event_type": event.get("type")})
+        raise HTTPException(status_code=503, detail="Webhook queue unavailable")
+    return Response(status_code=204)
@@ -1,26 +1,90 @@
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import RedirectResponse
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import RedirectResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 import requests
 import secrets
 import hashlib
 import base64
 import os
+import json
+import logging
 from dotenv import load_dotenv
 from urllib.parse import urlencode
+from datetime import datetime, timezone
 from typing import Optional
 
 from databases.database import get_db, User
 from databases.db_service import store_oauth_token, get_oauth_token
 from integrations.whoop import WhoopIntegration
+from integrations.rate_limiter import UpstreamRateLimited
+from services.whoop_sync import WhoopSyncEngine
+from services.soundtrack_analytics import SoundtrackAnalytics
+from services.whoop_rollups import WhoopRollups
 from .app_routes import get_authenticated_user
 
 
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 whoop_router = APIRouter()
 
+STREAM_FORMATS = {"ndjson": "application/x-ndjson", "json": "application/json"}
+
+def _whoop_time(value: Optional[datetime]) -> Optional[str]:
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+async def _stream_collection(user: User, endpoint: str, start: Optional[datetime], end: Optional[datetime], format: str):
+    """
+    Full history straight from Whoop, paged on the server. The first page is fetched before the
+    response starts so auth and rate-limit errors still get a proper status code.
+    """
+    if not user.whoop_user_id:
+        raise HTTPException(status_code=400, detail="Whoop account not linked")
+    pages = WhoopIntegration.iter_collection_pages(user.user_id, endpoint, _whoop_time(start), _whoop_time(end))
+    try:
+        first_page = await pages.__anext__()
+    except StopAsyncIteration:
+        first_page = []
+    except UpstreamRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to stream Whoop data: {str(e)}")
+
+    async def body():
+        page = first_page
+        first = True
+        try:
+            if format == "json":
+                yield "["
+            while True:
+                if page:
+                    if format == "json":
+                        chunk = ",".join(json.dumps(record) for record in page)
+                        yield chunk if first else "," + chunk
+                    else:
+                        yield "".join(json.dumps(record) + "\n" for record in page)
+                    first = False
+                try:
+                    page = await pages.__anext__()
+                except StopAsyncIteration:
+                    break
+            if format == "json":
+                yield "]"
+        except Exception:
+            # headers are gone; breaking off the body is the only way left to signal the failure
+            logger.exception("Whoop %s stream failed", endpoint, extra={"user_id": user.user_id})
+            raise
+        finally:
+            await pages.aclose()
+
+    return StreamingResponse(body(), media_type=STREAM_FORMATS[format])
+
 @whoop_router.get("/auth/login")
 async def initiate_whoop_login(
     current_user = Depends(get_authenticated_user),
@@ -55,7 +119,7 @@ async def whoop_auth_callback(
         return result
         
     except Exception as e:
-        print(f"❌ Unexpected error in OAuth callback: {str(e)}")
+        logger.exception("Unexpected error in OAuth callback")
         error_url = "fitpro://callback?error=unexpected_error&message=Unexpected error occurred"
         return RedirectResponse(url=error_url)
 
@@ -90,40 +154,121 @@ async def whoop_user_profile(
         result = await WhoopIntegration.get_user_profile(db, current_user.user_id)
 
         return result
+    except UpstreamRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
     except Exception as e:
-        print(f"❌ Unexpected error in OAuth callback: {str(e)}")
+        logger.exception("Unexpected error fetching profile")
         error_url = "fitpro://callback?error=unexpected_error&message=Unexpected error occurred"
         return RedirectResponse(url=error_url)
     
 @whoop_router.get("/recovery")
 async def get_whoop_recovery(
+    limit: int = Query(25, ge=1, le=100),
     db: AsyncSession = Depends(get_db),
     current_user = Depends(get_authenticated_user)
 ):
+    """Latest recoveries from the local Whoop store"""
     try:
-        result = await WhoopIntegration.get_recovery_data(db, current_user.user_id)
-        return result
+        await WhoopSyncEngine.ensure_synced(db, current_user.user_id, "recovery")
+        records = await WhoopSyncEngine.get_records(db, current_user.user_id, "recovery", limit)
+        return {"records": records, "next_token": None}
+    except UpstreamRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get recovery data: {str(e)}")
 
 @whoop_router.get("/workouts")
 async def get_whoop_workouts(
+    limit: int = Query(25, ge=1, le=100),
     db: AsyncSession = Depends(get_db),
     current_user = Depends(get_authenticated_user)
 ):
+    """Latest workouts from the local Whoop store"""
     try:
-        result = await WhoopIntegration.get_workout_data(db, current_user.user_id)
-        return result
+        await WhoopSyncEngine.ensure_synced(db, current_user.user_id, "workout")
+        records = await WhoopSyncEngine.get_records(db, current_user.user_id, "workout", limit)
+        return {"records": records, "next_token": None}
+    except UpstreamRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get workout data: {str(e)}")
 
+@whoop_router.get("/workouts/stream")
+async def stream_whoop_workouts(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: str = Query("ndjson", pattern="^(ndjson|json)$"),
+    db: AsyncSession = Depends(get_db),
+    current_user = Depends(get_authenticated_user)
+):
+    """Every workout in [start, end) as NDJSON (or one JSON array), paged from Whoop on the server"""
+    await db.close()
+    return await _stream_collection(current_user, "activity/workout", start, end, format)
+
+@whoop_router.get("/workouts/soundtrack")
+async def get_whoop_workout_soundtrack(
+    by: str = Query("track", pattern="^(track|artist|tempo)$"),
+    order: str = Query("strain", pattern="^(strain|minutes|workouts)$"),
+    min_strain: Optional[float] = Query(None, ge=0, le=21),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db),
+    current_user = Depends(get_authenticated_user)
+):
+    """
+    What was playing during workouts, per track, artist or 20 BPM tempo bucket. Use
+    min_strain (or order=strain) to see what soundtracks the hardest sessions.
+    """
+    if not current_user.whoop_user_id or not current_user.spotify_user_id:
+        raise HTTPException(status_code=400, detail="Both Whoop and Spotify accounts must be linked")
+    try:
+        await SoundtrackAnalytics.ensure_fresh(db, current_user.user_id)
+        return {
+            "by": by,
+            "results": await SoundtrackAnalytics.aggregate(db, current_user.user_id, by, min_strain, order, limit)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get workout soundtrack: {str(e)}")
+
 @whoop_router.get("/sleep")
 async def get_whoop_sleep(
+    limit: int = Query(25, ge=1, le=100),
     db: AsyncSession = Depends(get_db),
     current_user = Depends(get_authenticated_user)
 ):
+    """Latest sleeps from the local Whoop store"""
     try:
-        result = await WhoopIntegration.get_sleep_data(db, current_user.user_id)
-        return result
+        await WhoopSyncEngine.ensure_synced(db, current_user.user_id, "sleep")
+        records = await WhoopSyncEngine.get_records(db, current_user.user_id, "sleep", limit)
+        return {"records": records, "next_token": None}
+    except UpstreamRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to get sleep data: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to get sleep data: {str(e)}")
+
+@whoop_router.get("/trends")
+async def get_whoop_trends(
+    weeks: int = Query(12, ge=1, le=52),
+    db: AsyncSession = Depends(get_db),
+    current_user = Depends(get_authenticated_user)
+):
+    """
+    7/30/90-day averages, baseline and deltas for recovery, HRV, resting heart rate, sleep
+    performance and strain, plus weekly rollups. Read from precomputed rollups only.
+    """
+    try:
+        await WhoopRollups.ensure_fresh(db, current_user.user_id)
+        return await WhoopRollups.get_trends(db, current_user.user_id, weeks)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get trends: {str(e)}")
+
+@whoop_router.get("/sleep/stream")
+async def stream_whoop_sleep(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: str = Query("ndjson", pattern="^(ndjson|json)$"),
+    db: AsyncSession = Depends(get_db),
+    current_user = Depends(get_authenticated_user)
+):
+    """Every sleep in [start, end) as NDJSON (or one JSON array), paged from Whoop on the server"""
+    await db.close()
+    return await _stream_collection(current_user, "activity/sleep", start, end, format)
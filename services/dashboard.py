@@ -0,0 +1,72 @@
+from typing import Any, Awaitable, Callable, Dict
+from dotenv import load_dotenv
+
+import asyncio
+import logging
+import os
+
+from auth.user_cache import UserSnapshot
+from databases.database import AsyncSessionLocal
+from databases.db_service import get_oauth_tokens
+from integrations.spotify import SpotifyIntegration
+from integrations.rate_limiter import UpstreamRateLimited
+from services.whoop_sync import WhoopSyncEngine
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_SECTION_TIMEOUT = float(os.getenv("DASHBOARD_SECTION_TIMEOUT", "8"))
+
+# section name -> Whoop collection in the local store
+WHOOP_SECTIONS = {"recovery": "recovery", "sleep": "sleep", "workouts": "workout"}
+
+
+async def _whoop_section(user_id: str, collection: str, limit: int):
+    # sections run concurrently and an AsyncSession can't be shared, so each gets its own
+    async with AsyncSessionLocal() as db:
+        await WhoopSyncEngine.ensure_synced(db, user_id, collection)
+        return {"records": await WhoopSyncEngine.get_records(db, user_id, collection, limit)}
+
+async def _currently_playing_section(user_id: str):
+    async with AsyncSessionLocal() as db:
+        return await SpotifyIntegration.get_currently_playing(db, user_id)
+
+async def _run_section(name: str, user_id: str, load: Callable[[], Awaitable[Any]]) -> Dict[str, Any]:
+    """A failing section reports its own status instead of failing the whole dashboard"""
+    try:
+        return {"status": "ok", "data": await asyncio.wait_for(load(), DASHBOARD_SECTION_TIMEOUT)}
+    except UpstreamRateLimited as e:
+        return {"status": "rate_limited", "retry_after": int(e.retry_after) + 1}
+    except asyncio.TimeoutError:
+        logger.warning("Dashboard section %s timed out", name, extra={"user_id": user_id})
+        return {"status": "timeout"}
+    except Exception as e:
+        logger.warning("Dashboard section %s failed: %s", name, e, extra={"user_id": user_id})
+        return {"status": "error", "error": str(e)}
+
+
+async def build_dashboard(db, user: UserSnapshot, limit: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Every launch-screen section in one pass. Both provider tokens are loaded with a single
+    query up front, which primes the token cache the concurrent sections read from.
+    """
+    linked = [
+        provider for provider, account_id in (("whoop", user.whoop_user_id), ("spotify", user.spotify_user_id))
+        if account_id is not None
+    ]
+    tokens = await get_oauth_tokens(db, user.user_id, linked) if linked else {}
+
+    loaders = {}
+    for section, collection in WHOOP_SECTIONS.items():
+        if "whoop" in tokens:
+            loaders[section] = lambda collection=collection: _whoop_section(user.user_id, collection, limit)
+    if "spotify" in tokens:
+        loaders["currently_playing"] = lambda: _currently_playing_section(user.user_id)
+
+    results = await asyncio.gather(*(
+        _run_section(section, user.user_id, load) for section, load in loaders.items()
+    ))
+    sections = {section: {"status": "not_linked"} for section in (*WHOOP_SECTIONS, "currently_playing")}
+    sections.update(zip(loaders, results))
+    return sections
@@ -0,0 +1,156 @@
+"""Re-encrypts stored OAuth tokens under the primary key in ENCRYPTION_KEYS; resumable via a Redis checkpoint"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, update, bindparam
+from cryptography.fernet import InvalidToken
+from dotenv import load_dotenv
+
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+
+from databases.database import AsyncSessionLocal, OAuthToken, redis_client
+from databases.db_service import ENCRYPTION_KEYS, fernet, primary_fernet
+from monitoring.log import setup_logging
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+KEY_ROTATION_BATCH_SIZE = int(os.getenv("KEY_ROTATION_BATCH_SIZE", "500"))
+KEY_ROTATION_WORKERS = int(os.getenv("KEY_ROTATION_WORKERS", "4"))
+KEY_ROTATION_CHECKPOINT_TTL = int(os.getenv("KEY_ROTATION_CHECKPOINT_TTL", str(7 * 24 * 3600)))
+
+CHECKPOINT_KEY_PREFIX = "key_rotation:checkpoint:"
+
+_tokens = OAuthToken.__table__
+
+# only overwrite the row if its ciphertext is still the one we re-encrypted
+_REWRITE_STATEMENT = (
+    update(_tokens)
+    .where(
+        _tokens.c.token_id == bindparam("b_token_id"),
+        _tokens.c.access_token_encrypted == bindparam("b_old_access")
+    )
+    .values(
+        access_token_encrypted=bindparam("b_access"),
+        refresh_token_encrypted=bindparam("b_refresh")
+    )
+)
+
+
+def _checkpoint_key() -> str:
+    # a new primary key starts a fresh pass instead of resuming an older rotation
+    return CHECKPOINT_KEY_PREFIX + hashlib.sha256(ENCRYPTION_KEYS[0].encode()).hexdigest()[:16]
+
+def _rotate_value(ciphertext: Optional[str]) -> Optional[str]:
+    """The value under the primary key, or None when it already is (or there is nothing to rotate)"""
+    if ciphertext is None:
+        return None
+    try:
+        primary_fernet.decrypt(ciphertext.encode())
+        return None
+    except InvalidToken:
+        return fernet.rotate(ciphertext.encode()).decode()
+
+def _rotate_rows(rows: List[Tuple[str, str, Optional[str]]]) -> Tuple[List[dict], int]:
+    """Runs on the worker pool; returns (update parameters, rows no configured key can decrypt)"""
+    updates = []
+    unreadable = 0
+    for token_id, access, refresh in rows:
+        try:
+            new_access = _rotate_value(access)
+            new_refresh = _rotate_value(refresh)
+        except InvalidToken:
+            unreadable += 1
+            continue
+        if new_access is None and new_refresh is None:
+            continue
+        updates.append({
+            "b_token_id": token_id,
+            "b_old_access": access,
+            "b_access": new_access or access,
+            "b_refresh": new_refresh or refresh,
+        })
+    return updates, unreadable
+
+
+async def _load_checkpoint(key: str) -> Optional[str]:
+    try:
+        value = await redis_client.get(key)
+        return value.decode() if value else None
+    except Exception as e:
+        logger.warning("Key rotation checkpoint unavailable, starting from the beginning: %s", e)
+        return None
+
+async def _save_checkpoint(key: str, token_id: str):
+    try:
+        await redis_client.set(key, token_id, ex=KEY_ROTATION_CHECKPOINT_TTL)
+    except Exception as e:
+        # not fatal: a rerun re-reads rows that are already rotated and skips them
+        logger.warning("Saving key rotation checkpoint failed: %s", e)
+
+
+async def rotate_keys(
+    batch_size: int = KEY_ROTATION_BATCH_SIZE,
+    workers: int = KEY_ROTATION_WORKERS,
+    restart: bool = False
+) -> Dict[str, int]:
+    checkpoint_key = _checkpoint_key()
+    last_token_id = None if restart else await _load_checkpoint(checkpoint_key)
+    if last_token_id:
+        logger.info("Resuming key rotation", extra={"after_token_id": last_token_id})
+
+    stats = {"scanned": 0, "rewritten": 0, "unreadable": 0}
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="key-rotation")
+    try:
+        while True:
+            async with AsyncSessionLocal() as db:
+                query = (
+                    select(_tokens.c.token_id, _tokens.c.access_token_encrypted, _tokens.c.refresh_token_encrypted)
+                    .order_by(_tokens.c.token_id)
+                    .limit(batch_size)
+                )
+                if last_token_id:
+                    query = query.where(_tokens.c.token_id > last_token_id)
+                rows = [tuple(row) for row in (await db.execute(query)).all()]
+                if not rows:
+                    break
+
+                chunk = -(-len(rows) // workers)
+                results = await asyncio.gather(*(
+                    loop.run_in_executor(executor, _rotate_rows, rows[i:i + chunk])
+                    for i in range(0, len(rows), chunk)
+                ))
+                updates = [params for batch, _ in results for params in batch]
+                if updates:
+                    await db.execute(_REWRITE_STATEMENT, updates)
+                    await db.commit()
+
+            stats["scanned"] += len(rows)
+            stats["rewritten"] += len(updates)
+            stats["unreadable"] += sum(unreadable for _, unreadable in results)
+            last_token_id = rows[-1][0]
+            await _save_checkpoint(checkpoint_key, last_token_id)
+            logger.info("Re-encrypted token batch", extra={**stats, "after_token_id": last_token_id})
+    finally:
+        executor.shutdown(wait=False)
+
+    if stats["unreadable"]:
+        logger.warning("%d tokens could not be decrypted with any configured key", stats["unreadable"])
+    logger.info("Key rotation finished", extra=stats)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-encrypt stored OAuth tokens under the primary key")
+    parser.add_argument("--batch-size", type=int, default=KEY_ROTATION_BATCH_SIZE, help="rows read and written per batch")
+    parser.add_argument("--workers", type=int, default=KEY_ROTATION_WORKERS, help="re-encryption threads")
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint and scan from the start")
+    args = parser.parse_args()
+    setup_logging()
+
+    asyncio.run(rotate_keys(args.batch_size, args.workers, args.restart))
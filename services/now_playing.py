@@ -0,0 +1,240 @@
+"""Live Spotify currently-playing, polled once per user across workers and fanned out through Redis"""
+from typing import Any, AsyncIterator, Dict, Optional, Set
+from dotenv import load_dotenv
+
+import asyncio
+import json
+import logging
+import secrets
+import time
+import os
+
+from databases.database import AsyncSessionLocal, redis_client
+from integrations.spotify import SpotifyIntegration
+from integrations.rate_limiter import UpstreamRateLimited
+from monitoring.metrics import NOW_PLAYING_POLLERS, NOW_PLAYING_STREAMS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+NOW_PLAYING_MIN_INTERVAL = float(os.getenv("NOW_PLAYING_MIN_INTERVAL", "2"))
+# even mid-song, check this often so skips show up reasonably fast
+NOW_PLAYING_MAX_PLAYING_INTERVAL = float(os.getenv("NOW_PLAYING_MAX_PLAYING_INTERVAL", "20"))
+NOW_PLAYING_PAUSED_INTERVAL = float(os.getenv("NOW_PLAYING_PAUSED_INTERVAL", "20"))
+NOW_PLAYING_IDLE_INTERVAL = float(os.getenv("NOW_PLAYING_IDLE_INTERVAL", "30"))
+NOW_PLAYING_MAX_ERROR_INTERVAL = float(os.getenv("NOW_PLAYING_MAX_ERROR_INTERVAL", "120"))
+NOW_PLAYING_FOLLOW_INTERVAL = float(os.getenv("NOW_PLAYING_FOLLOW_INTERVAL", "1"))
+# keep polling briefly after the last stream closes, so app reconnects don't restart the poller
+NOW_PLAYING_LINGER_SECONDS = float(os.getenv("NOW_PLAYING_LINGER_SECONDS", "10"))
+NOW_PLAYING_KEEPALIVE_SECONDS = float(os.getenv("NOW_PLAYING_KEEPALIVE_SECONDS", "15"))
+
+POLLER_LOCK_PREFIX = "now_playing_poller:"
+LATEST_KEY_PREFIX = "now_playing_latest:"
+POLLER_LOCK_TTL_MS = int((max(NOW_PLAYING_IDLE_INTERVAL, NOW_PLAYING_MAX_ERROR_INTERVAL) + 30) * 1000)
+
+_RENEW_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def summarize(playing: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """The part of Spotify's payload clients need; progress lets them animate without polling"""
+    item = (playing or {}).get("item")
+    if not item:
+        return {"is_playing": False, "track": None, "progress_ms": None, "observed_at": int(time.time() * 1000)}
+    return {
+        "is_playing": bool(playing.get("is_playing")),
+        "track": {
+            "id": item.get("id"),
+            "name": item.get("name"),
+            "artists": [artist.get("name") for artist in item.get("artists", [])],
+            "album": (item.get("album") or {}).get("name"),
+            "duration_ms": item.get("duration_ms"),
+        },
+        "progress_ms": playing.get("progress_ms"),
+        "observed_at": int(time.time() * 1000),
+    }
+
+def _change_key(state: Dict[str, Any]) -> tuple:
+    return ((state.get("track") or {}).get("id"), state.get("is_playing"))
+
+def next_interval(state: Dict[str, Any]) -> float:
+    track = state.get("track")
+    if not track:
+        return NOW_PLAYING_IDLE_INTERVAL
+    if not state.get("is_playing"):
+        return NOW_PLAYING_PAUSED_INTERVAL
+    remaining = ((track.get("duration_ms") or 0) - (state.get("progress_ms") or 0)) / 1000
+    # wake up just after the song should end, which is when the next change is most likely
+    return min(max(remaining + 1, NOW_PLAYING_MIN_INTERVAL), NOW_PLAYING_MAX_PLAYING_INTERVAL)
+
+
+class _UserPoller:
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.latest: Optional[Dict[str, Any]] = None
+        self.task: Optional[asyncio.Task] = None
+        self._lock_key = f"{POLLER_LOCK_PREFIX}{user_id}"
+        self._latest_key = f"{LATEST_KEY_PREFIX}{user_id}"
+        self._lock_token = secrets.token_hex(16)
+        self._idle_since: Optional[float] = None
+
+    def publish(self, state: Dict[str, Any]):
+        if self.latest is not None and _change_key(self.latest) == _change_key(state):
+            # same track and play state; keep the fresher progress for new subscribers only
+            self.latest = state
+            return
+        self.latest = state
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()  # only the newest state matters to a slow client
+            queue.put_nowait(state)
+
+    async def _fetch(self) -> Dict[str, Any]:
+        async with AsyncSessionLocal() as db:
+            playing = await SpotifyIntegration.make_spotify_api_request(
+                db, self.user_id, "me/player/currently-playing", use_cache=False
+            )
+        return summarize(playing)
+
+    async def _is_leader(self) -> bool:
+        """Hold (or renew) this user's poller lock; without Redis every worker polls for itself"""
+        try:
+            if await redis_client.eval(_RENEW_LOCK_SCRIPT, 1, self._lock_key, self._lock_token, POLLER_LOCK_TTL_MS):
+                return True
+            return bool(await redis_client.set(self._lock_key, self._lock_token, nx=True, px=POLLER_LOCK_TTL_MS))
+        except Exception as e:
+            logger.warning("Now-playing poller lock unavailable, polling locally: %s", e)
+            return True
+
+    async def _lead_once(self, failures: int) -> tuple:
+        """One upstream poll; returns (seconds until the next one, consecutive failures)"""
+        try:
+            state = await self._fetch()
+        except UpstreamRateLimited as e:
+            return e.retry_after, failures
+        except Exception as e:
+            failures += 1
+            logger.warning("Now-playing poll failed: %s", e, extra={"user_id": self.user_id})
+            return min(NOW_PLAYING_MIN_INTERVAL * 2 ** failures, NOW_PLAYING_MAX_ERROR_INTERVAL), failures
+
+        self.publish(state)
+        interval = next_interval(state)
+        try:
+            await redis_client.set(self._latest_key, json.dumps(state), px=POLLER_LOCK_TTL_MS)
+        except Exception as e:
+            logger.warning("Now-playing state write failed: %s", e)
+        return interval, 0
+
+    async def _follow_once(self):
+        try:
+            raw = await redis_client.get(self._latest_key)
+        except Exception as e:
+            logger.warning("Now-playing state read failed: %s", e)
+            return
+        if raw:
+            self.publish(json.loads(raw))
+
+    async def run(self):
+        failures = 0
+        next_poll = 0.0
+        leading = False
+        try:
+            while True:
+                if not self.subscribers:
+                    self._idle_since = self._idle_since or time.monotonic()
+                    if time.monotonic() - self._idle_since > NOW_PLAYING_LINGER_SECONDS:
+                        return
+                else:
+                    self._idle_since = None
+
+                now = time.monotonic()
+                if now >= next_poll or not leading:
+                    if await self._is_leader():
+                        if not leading:
+                            NOW_PLAYING_POLLERS.inc()
+                            leading = True
+                        if now >= next_poll:
+                            interval, failures = await self._lead_once(failures)
+                            next_poll = time.monotonic() + interval
+                    else:
+                        if leading:
+                            NOW_PLAYING_POLLERS.dec()
+                            leading = False
+                        await self._follow_once()
+
+                if leading:
+                    # sleep until the next poll, but wake early enough to notice idling out
+                    await asyncio.sleep(min(max(next_poll - time.monotonic(), 0), NOW_PLAYING_LINGER_SECONDS))
+                else:
+                    await asyncio.sleep(NOW_PLAYING_FOLLOW_INTERVAL)
+        finally:
+            if leading:
+                NOW_PLAYING_POLLERS.dec()
+                try:
+                    await redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, self._lock_key, self._lock_token)
+                except Exception as e:
+                    logger.warning("Now-playing poller lock release failed: %s", e)
+
+
+class NowPlayingHub:
+    def __init__(self):
+        self._pollers: Dict[str, _UserPoller] = {}
+
+    def _poller(self, user_id: str) -> _UserPoller:
+        poller = self._pollers.get(user_id)
+        if poller is None or poller.task is None or poller.task.done():
+            poller = _UserPoller(user_id)
+            poller.task = asyncio.create_task(poller.run())
+            poller.task.add_done_callback(lambda _: self._drop(user_id, poller))
+            self._pollers[user_id] = poller
+        return poller
+
+    def _drop(self, user_id: str, poller: _UserPoller):
+        if self._pollers.get(user_id) is poller:
+            del self._pollers[user_id]
+
+    async def subscribe(self, user_id: str) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Yields the current state straight away, then every change. Yields None when nothing has
+        changed for NOW_PLAYING_KEEPALIVE_SECONDS, so the caller can send a keep-alive.
+        """
+        poller = self._poller(user_id)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        poller.subscribers.add(queue)
+        NOW_PLAYING_STREAMS.inc()
+        try:
+            if poller.latest is not None:
+                yield poller.latest
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), NOW_PLAYING_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield None
+                if poller.task.done():
+                    # the poller idled out between our reads; attach to a fresh one
+                    poller.subscribers.discard(queue)
+                    poller = self._poller(user_id)
+                    poller.subscribers.add(queue)
+        finally:
+            poller.subscribers.discard(queue)
+            NOW_PLAYING_STREAMS.dec()
+
+    async def close(self):
+        for poller in list(self._pollers.values()):
+            poller.task.cancel()
+        await asyncio.gather(*(p.task for p in list(self._pollers.values())), return_exceptions=True)
+
+
+now_playing_hub = NowPlayingHub()
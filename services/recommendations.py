@@ -0,0 +1,154 @@
+"""Recovery-aware track recommendations: the user's own tracks ranked against a Whoop-driven audio feature target"""
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+
+import asyncio
+import logging
+
+import numpy as np
+
+from auth.user_cache import UserSnapshot
+from databases.database import AsyncSessionLocal
+from integrations.spotify import SpotifyIntegration
+from services.track_features import FEATURES, get_track_features
+from services.whoop_sync import WhoopSyncEngine
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RECOMMENDATION_SOURCE_LIMIT = 50  # Spotify's maximum page size for each source
+
+# how much each feature counts in the distance, in FEATURES order
+FEATURE_WEIGHTS = np.array([1.0, 1.5, 1.0, 0.5, 0.5])
+# BPM mapped onto 0..1 so tempo is on the same scale as the other features
+TEMPO_RANGE = (60.0, 200.0)
+
+# source name -> (Spotify endpoint, how to get the tracks out of its response)
+SOURCES = {
+    "recently_played": ("me/player/recently-played", lambda payload: [item.get("track") for item in payload.get("items", [])]),
+    "top": ("me/top/tracks", lambda payload: payload.get("items", [])),
+    "saved": ("me/tracks", lambda payload: [item.get("track") for item in payload.get("items", [])]),
+}
+
+
+def readiness(recovery: Optional[float], strain: Optional[float], sleep: Optional[float]) -> float:
+    """
+    0 (rest day) to 1 (go hard) from Whoop recovery %, the current cycle's strain (0-21) and
+    sleep performance %. Missing inputs count as neutral.
+    """
+    score = recovery / 100 if recovery is not None else 0.5
+    if sleep is not None:
+        score = 0.75 * score + 0.25 * sleep / 100
+    if strain is not None:
+        # a day that is already hard calls for something calmer
+        score -= 0.2 * max(strain - 10, 0) / 11
+    return float(np.clip(score, 0, 1))
+
+def target_features(level: float) -> Dict[str, float]:
+    return {
+        "tempo": 85 + 70 * level,
+        "energy": 0.3 + 0.6 * level,
+        "valence": 0.4 + 0.4 * level,
+        "danceability": 0.4 + 0.4 * level,
+        "acousticness": 0.6 - 0.5 * level,
+    }
+
+def _vectorize(rows: List[Dict[str, float]]) -> np.ndarray:
+    """len(rows) x len(FEATURES) matrix on a common 0..1 scale"""
+    matrix = np.array([[row.get(name) or 0.0 for name in FEATURES] for row in rows], dtype=float)
+    low, high = TEMPO_RANGE
+    matrix[:, 0] = np.clip((matrix[:, 0] - low) / (high - low), 0, 1)
+    return matrix
+
+def rank_tracks(target: Dict[str, float], features: List[Dict[str, float]]) -> tuple:
+    """(indices of features best first, score of each row); scores run from 0 to 1 (exact match)"""
+    if not features:
+        return np.array([], dtype=int), np.array([])
+    diff = _vectorize(features) - _vectorize([target])
+    distance = np.sqrt((diff ** 2) @ FEATURE_WEIGHTS / FEATURE_WEIGHTS.sum())
+    scores = 1 - distance
+    return np.argsort(-scores, kind="stable"), scores
+
+
+async def _whoop_inputs(user: UserSnapshot) -> Dict[str, Optional[float]]:
+    """Latest recovery score, current cycle strain and last night's sleep performance"""
+    inputs = {"recovery": None, "strain": None, "sleep": None}
+    if not user.whoop_user_id:
+        return inputs
+    user_id = user.user_id
+    async with AsyncSessionLocal() as db:
+        for name, collection, field in (
+            ("recovery", "recovery", "recovery_score"),
+            ("strain", "cycle", "strain"),
+            ("sleep", "sleep", "sleep_performance_percentage"),
+        ):
+            await WhoopSyncEngine.ensure_synced(db, user_id, collection)
+            records = await WhoopSyncEngine.get_records(db, user_id, collection, 3)
+            # naps don't say much about the night's sleep
+            record = next((r for r in records if not r.get("nap")), None)
+            if record:
+                inputs[name] = (record.get("score") or {}).get(field)
+    return inputs
+
+async def _source_tracks(user_id: str, source: str) -> List[Dict[str, Any]]:
+    endpoint, extract = SOURCES[source]
+    # sources load concurrently and an AsyncSession can't be shared, so each gets its own
+    async with AsyncSessionLocal() as db:
+        payload = await SpotifyIntegration.make_spotify_api_request(
+            db, user_id, endpoint, {"limit": RECOMMENDATION_SOURCE_LIMIT}
+        ) or {}
+    return [track for track in extract(payload) if track and track.get("id")]
+
+
+async def recommend(user: UserSnapshot, limit: int = 20) -> Dict[str, Any]:
+    """A ranked playlist from the user's own tracks for how recovered they are today"""
+    inputs, *source_results = await asyncio.gather(
+        _whoop_inputs(user),
+        *(_source_tracks(user.user_id, source) for source in SOURCES),
+        return_exceptions=True
+    )
+
+    if isinstance(inputs, Exception):
+        logger.warning("Whoop inputs unavailable, using a neutral target: %s", inputs, extra={"user_id": user.user_id})
+        inputs = {"recovery": None, "strain": None, "sleep": None}
+
+    tracks: Dict[str, Dict[str, Any]] = {}
+    sources: Dict[str, List[str]] = {}
+    for source, result in zip(SOURCES, source_results):
+        if isinstance(result, Exception):
+            logger.warning("Recommendation source %s failed: %s", source, result, extra={"user_id": user.user_id})
+            continue
+        for track in result:
+            tracks.setdefault(track["id"], track)
+            sources.setdefault(track["id"], []).append(source)
+    if not tracks:
+        failures = [result for result in source_results if isinstance(result, Exception)]
+        if failures:
+            raise failures[0]
+
+    level = readiness(inputs["recovery"], inputs["strain"], inputs["sleep"])
+    target = target_features(level)
+    features = await get_track_features(user.user_id, list(tracks))
+    scored_ids = [track_id for track_id in tracks if features.get(track_id)]
+    order, scores = rank_tracks(target, [features[track_id] for track_id in scored_ids])
+
+    playlist = []
+    for index in order[:limit]:
+        track_id = scored_ids[index]
+        track = tracks[track_id]
+        playlist.append({
+            "id": track_id,
+            "name": track.get("name"),
+            "artists": [artist.get("name") for artist in track.get("artists", [])],
+            "uri": track.get("uri"),
+            "score": round(float(scores[index]), 4),
+            "features": features[track_id],
+            "sources": sources[track_id],
+        })
+    return {
+        "readiness": round(level, 3),
+        "inputs": inputs,
+        "target": {name: round(value, 3) for name, value in target.items()},
+        "tracks": playlist,
+    }
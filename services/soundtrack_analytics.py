@@ -0,0 +1,291 @@
+"""Workout soundtracks: Whoop workouts joined with the Spotify plays that overlapped them, for aggregate analytics"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from sqlalchemy import select, delete, func, case, literal_column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+import asyncio
+import logging
+import os
+
+import numpy as np
+
+from databases.database import AsyncSessionLocal, DataSyncState, SpotifyPlay, WhoopWorkout, WorkoutSoundtrack
+from integrations.rate_limiter import background_priority
+from services.track_features import get_track_features
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# longest track we expect; bounds how far before a workout a play may have started
+MAX_PLAY_SECONDS = 3600
+TEMPO_BUCKET_BPM = 20
+INSERT_BATCH = 2000
+
+SOUNDTRACK_SOURCE = "analytics:workout_soundtrack"
+
+HIGH_ZONES = ("zone_four_milli", "zone_five_milli")
+ALL_ZONES = ("zone_zero_milli", "zone_one_milli", "zone_two_milli", "zone_three_milli", *HIGH_ZONES)
+
+# user_id -> earliest changed workout start / play time still waiting to be re-joined
+_pending_refreshes: Dict[str, Optional[datetime]] = {}
+_refresh_tasks: Dict[str, asyncio.Task] = {}
+
+
+def join_intervals(
+    w_start: np.ndarray,
+    w_end: np.ndarray,
+    p_start: np.ndarray,
+    p_end: np.ndarray,
+    max_play: float
+) -> tuple:
+    """
+    Overlapping (workout, play) pairs as (workout indices, play indices, overlap seconds).
+    p_start must be sorted; no play may be longer than max_play.
+    """
+    lo = np.searchsorted(p_start, w_start - max_play, side="left")
+    hi = np.searchsorted(p_start, w_end, side="left")
+    counts = np.maximum(hi - lo, 0)
+    total = int(counts.sum())
+    if total == 0:
+        empty = np.array([], dtype=int)
+        return empty, empty, np.array([])
+
+    w_idx = np.repeat(np.arange(len(w_start)), counts)
+    # position of each pair within its workout's candidate range
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    p_idx = np.repeat(lo, counts) + offsets
+    overlap = np.minimum(w_end[w_idx], p_end[p_idx]) - np.maximum(w_start[w_idx], p_start[p_idx])
+    keep = overlap > 0
+    return w_idx[keep], p_idx[keep], overlap[keep]
+
+def _high_zone_share(workout_data: Dict[str, Any]) -> Optional[float]:
+    zones = ((workout_data or {}).get("score") or {}).get("zone_durations") or {}
+    total = sum(zones.get(zone) or 0 for zone in ALL_ZONES)
+    if not total:
+        return None
+    return sum(zones.get(zone) or 0 for zone in HIGH_ZONES) / total
+
+def _earliest(a: Optional[datetime], b: Optional[datetime]) -> Optional[datetime]:
+    # None means "from the beginning"
+    if a is None or b is None:
+        return None
+    return min(a, b)
+
+def _primary_artist(play_data: Dict[str, Any]) -> Optional[str]:
+    artists = ((play_data or {}).get("track") or {}).get("artists") or []
+    return artists[0].get("name") if artists else None
+
+
+class SoundtrackAnalytics:
+    @staticmethod
+    async def refresh(db: AsyncSession, fitpro_user_id: str, changed_since: Optional[datetime] = None) -> int:
+        """
+        Re-join every workout that could overlap a workout or play from `changed_since` onwards
+        (everything when None) and replace their rows; returns rows written
+        """
+        since = changed_since
+        if since is not None:
+            # a changed play can overlap a workout that started before it
+            earliest = (await db.execute(
+                select(func.min(WhoopWorkout.start_time)).where(
+                    WhoopWorkout.user_id == fitpro_user_id,
+                    WhoopWorkout.end_time > since - timedelta(seconds=MAX_PLAY_SECONDS)
+                )
+            )).scalar()
+            since = min(since, earliest) if earliest else since
+
+        query = select(
+            WhoopWorkout.workout_id, WhoopWorkout.start_time, WhoopWorkout.end_time,
+            WhoopWorkout.strain, WhoopWorkout.average_heart_rate, WhoopWorkout.data
+        ).where(WhoopWorkout.user_id == fitpro_user_id, WhoopWorkout.end_time.isnot(None))
+        if since:
+            query = query.where(WhoopWorkout.start_time >= since)
+        workouts = (await db.execute(query.order_by(WhoopWorkout.start_time))).all()
+
+        rows = []
+        if workouts:
+            first_start = workouts[0].start_time
+            last_end = max(workout.end_time for workout in workouts)
+            plays = (await db.execute(
+                select(SpotifyPlay.played_at, SpotifyPlay.duration_ms, SpotifyPlay.track_id, SpotifyPlay.track_name, SpotifyPlay.data)
+                .where(
+                    SpotifyPlay.user_id == fitpro_user_id,
+                    SpotifyPlay.played_at > first_start,
+                    SpotifyPlay.played_at < last_end + timedelta(seconds=MAX_PLAY_SECONDS)
+                )
+            )).all()
+            rows = await SoundtrackAnalytics._join(fitpro_user_id, workouts, plays)
+
+        stale = delete(WorkoutSoundtrack).where(WorkoutSoundtrack.user_id == fitpro_user_id)
+        if since:
+            stale = stale.where(WorkoutSoundtrack.workout_start >= since)
+        await db.execute(stale)
+        for i in range(0, len(rows), INSERT_BATCH):
+            await db.execute(pg_insert(WorkoutSoundtrack).values(rows[i:i + INSERT_BATCH]))
+
+        state_stmt = pg_insert(DataSyncState).values(
+            user_id=fitpro_user_id,
+            source=SOUNDTRACK_SOURCE,
+            last_synced_at=func.now()
+        )
+        state_stmt = state_stmt.on_conflict_do_update(
+            index_elements=["user_id", "source"],
+            set_={"last_synced_at": func.now()}
+        )
+        await db.execute(state_stmt)
+        await db.commit()
+        return len(rows)
+
+    @staticmethod
+    async def _join(fitpro_user_id: str, workouts: list, plays: list) -> List[Dict[str, Any]]:
+        if not plays:
+            return []
+        # Spotify stamps a play when it finishes, so it covers [played_at - duration, played_at]
+        p_end = np.array([play.played_at.timestamp() for play in plays])
+        p_duration = np.array([min((play.duration_ms or 0) / 1000, MAX_PLAY_SECONDS) for play in plays])
+        p_start = p_end - p_duration
+        order = np.argsort(p_start, kind="stable")
+        p_start, p_end = p_start[order], p_end[order]
+
+        w_start = np.array([workout.start_time.timestamp() for workout in workouts])
+        w_end = np.array([workout.end_time.timestamp() for workout in workouts])
+        w_idx, p_idx, overlap = join_intervals(w_start, w_end, p_start, p_end, MAX_PLAY_SECONDS)
+        if not len(w_idx):
+            return []
+
+        track_ids = sorted({plays[order[p]].track_id for p in p_idx})
+        try:
+            features = await get_track_features(fitpro_user_id, track_ids)
+        except Exception as e:
+            logger.warning("Track features unavailable for soundtrack analytics: %s", e, extra={"user_id": fitpro_user_id})
+            features = {}
+
+        zone_share = {}
+        rows = []
+        for w, p, seconds in zip(w_idx.tolist(), p_idx.tolist(), overlap.tolist()):
+            workout = workouts[w]
+            play = plays[order[p]]
+            if w not in zone_share:
+                zone_share[w] = _high_zone_share(workout.data)
+            rows.append({
+                "user_id": fitpro_user_id,
+                "workout_id": workout.workout_id,
+                "played_at": play.played_at,
+                "workout_start": workout.start_time,
+                "track_id": play.track_id,
+                "track_name": play.track_name,
+                "artist_name": _primary_artist(play.data),
+                "tempo": (features.get(play.track_id) or {}).get("tempo"),
+                "overlap_seconds": seconds,
+                "strain": workout.strain,
+                "average_heart_rate": workout.average_heart_rate,
+                "high_zone_share": zone_share[w],
+            })
+        return rows
+
+    @staticmethod
+    async def _background_refresh(fitpro_user_id: str):
+        # changes that land while a refresh runs are picked up by the next loop iteration
+        while fitpro_user_id in _pending_refreshes:
+            since = _pending_refreshes.pop(fitpro_user_id)
+            try:
+                with background_priority():
+                    async with AsyncSessionLocal() as db:
+                        await SoundtrackAnalytics.refresh(db, fitpro_user_id, since)
+            except Exception as e:
+                logger.error("Soundtrack analytics refresh failed: %s", e, extra={"user_id": fitpro_user_id})
+
+    @staticmethod
+    def schedule_refresh(fitpro_user_id: str, changed_since: Optional[datetime] = None):
+        """
+        Re-join from `changed_since` (the earliest changed workout start or play) in the background,
+        one refresh per user at a time
+        """
+        since = changed_since
+        if fitpro_user_id in _pending_refreshes:
+            since = _earliest(since, _pending_refreshes[fitpro_user_id])
+        _pending_refreshes[fitpro_user_id] = since
+        if fitpro_user_id in _refresh_tasks:
+            return
+        task = asyncio.create_task(SoundtrackAnalytics._background_refresh(fitpro_user_id))
+        _refresh_tasks[fitpro_user_id] = task
+        task.add_done_callback(lambda _: _refresh_tasks.pop(fitpro_user_id, None))
+
+    @staticmethod
+    async def ensure_fresh(db: AsyncSession, fitpro_user_id: str):
+        """
+        A user's first read materializes inline; after that syncs keep the table current.
+        A refresh already in flight for the user is waited for, so the read includes what it adds.
+        """
+        task = _refresh_tasks.get(fitpro_user_id)
+        if task is not None:
+            await asyncio.shield(task)
+        state = await db.get(DataSyncState, (fitpro_user_id, SOUNDTRACK_SOURCE))
+        if state is None or state.last_synced_at is None:
+            await SoundtrackAnalytics.refresh(db, fitpro_user_id)
+
+    @staticmethod
+    async def aggregate(
+        db: AsyncSession,
+        fitpro_user_id: str,
+        by: str = "track",
+        min_strain: Optional[float] = None,
+        order_by: str = "strain",
+        limit: int = 20
+    ) -> List[Dict[str, Any]]:
+        """
+        Per track, artist or tempo bucket: workouts it played in, minutes heard, overlap-weighted
+        average strain / heart rate / share of time in zones 4-5, and peak strain.
+        """
+        table = WorkoutSoundtrack
+        if by == "track":
+            keys = [table.track_id, func.max(table.track_name).label("track_name"), func.max(table.artist_name).label("artist_name")]
+            group = [table.track_id]
+        elif by == "artist":
+            keys = [table.artist_name]
+            group = [table.artist_name]
+        else:
+            bucket = (func.floor(table.tempo / TEMPO_BUCKET_BPM) * TEMPO_BUCKET_BPM).label("tempo_bucket")
+            keys = [bucket]
+            group = [bucket]
+
+        def weighted(column):
+            # weight by overlap, counting only rows where the metric is known
+            known = func.sum(case((column.isnot(None), table.overlap_seconds), else_=0))
+            return func.sum(column * table.overlap_seconds) / func.nullif(known, 0)
+
+        minutes = (func.sum(table.overlap_seconds) / 60).label("minutes")
+        avg_strain = weighted(table.strain).label("avg_strain")
+        query = (
+            select(
+                *keys,
+                func.count(func.distinct(table.workout_id)).label("workouts"),
+                minutes,
+                avg_strain,
+                func.max(table.strain).label("max_strain"),
+                weighted(table.average_heart_rate).label("avg_heart_rate"),
+                weighted(table.high_zone_share).label("high_zone_share"),
+            )
+            .where(table.user_id == fitpro_user_id)
+            .group_by(*group)
+        )
+        if by == "tempo":
+            query = query.where(table.tempo.isnot(None))
+        if min_strain is not None:
+            query = query.where(table.strain >= min_strain)
+        ordering = {"strain": avg_strain, "minutes": minutes, "workouts": literal_column("workouts")}[order_by]
+        query = query.order_by(ordering.desc().nulls_last(), minutes.desc()).limit(limit)
+
+        result = await db.execute(query)
+        aggregates = []
+        for row in result.mappings().all():
+            entry = dict(row)
+            for name in ("minutes", "avg_strain", "avg_heart_rate", "high_zone_share", "tempo_bucket"):
+                if entry.get(name) is not None:
+                    entry[name] = round(float(entry[name]), 3)
+            aggregates.append(entry)
+        return aggregates
@@ -0,0 +1,278 @@
+"""Local Spotify listening history, synced from recently-played by cursor (Spotify only keeps the last 50 plays)"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+import argparse
+import asyncio
+import logging
+import time
+import os
+
+from databases.database import AsyncSessionLocal, DataSyncState, SpotifyPlay, User
+from integrations.spotify import SpotifyIntegration
+from integrations.http_client import close_http_clients
+from integrations.rate_limiter import background_priority
+from monitoring.log import setup_logging
+from services.soundtrack_analytics import SoundtrackAnalytics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SPOTIFY_HISTORY_PAGE_SIZE = 50  # Spotify's maximum page size
+SPOTIFY_HISTORY_MAX_PAGES = int(os.getenv("SPOTIFY_HISTORY_MAX_PAGES", "20"))
+SPOTIFY_HISTORY_STALE_SECONDS = int(os.getenv("SPOTIFY_HISTORY_STALE_SECONDS", "900"))
+# 50 plays is a couple of hours of listening; sync everyone well inside that
+SPOTIFY_HISTORY_SYNC_INTERVAL_SECONDS = int(os.getenv("SPOTIFY_HISTORY_SYNC_INTERVAL_SECONDS", "1800"))
+SPOTIFY_HISTORY_SYNC_CONCURRENCY = int(os.getenv("SPOTIFY_HISTORY_SYNC_CONCURRENCY", "5"))
+SPOTIFY_HISTORY_USER_BATCH = 500
+
+HISTORY_SOURCE = "spotify:recently_played"
+
+_background_syncs = set()
+
+
+def _ts(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+def _ms(value: datetime) -> int:
+    return int(value.timestamp() * 1000)
+
+def _play_row(user_id: str, item: Dict[str, Any]) -> Dict[str, Any]:
+    track = item.get("track") or {}
+    return {
+        "user_id": user_id,
+        "played_at": _ts(item["played_at"]),
+        "track_id": track["id"],
+        "track_name": track.get("name"),
+        "artist_names": ", ".join(artist.get("name", "") for artist in track.get("artists", [])),
+        "album_name": (track.get("album") or {}).get("name"),
+        "duration_ms": track.get("duration_ms"),
+        "context_uri": (item.get("context") or {}).get("uri"),
+        "data": item,
+    }
+
+def play_to_dict(play: SpotifyPlay) -> Dict[str, Any]:
+    return {
+        "played_at": play.played_at.isoformat(),
+        "track_id": play.track_id,
+        "track_name": play.track_name,
+        "artists": play.artist_names,
+        "album": play.album_name,
+        "duration_ms": play.duration_ms,
+        "context_uri": play.context_uri,
+    }
+
+
+class SpotifyHistorySync:
+    @staticmethod
+    async def insert_plays(db: AsyncSession, rows: List[Dict[str, Any]]) -> int:
+        """Bulk insert in one statement; plays we already hold are skipped. Returns rows inserted"""
+        if not rows:
+            return 0
+        stmt = (
+            pg_insert(SpotifyPlay)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=["user_id", "played_at"])
+            .returning(SpotifyPlay.played_at)
+        )
+        result = await db.execute(stmt)
+        return len(result.all())
+
+    @staticmethod
+    async def sync_user(db: AsyncSession, fitpro_user_id: str) -> int:
+        """Pull plays newer than the user's cursor (or everything Spotify has, the first time)"""
+        state = await db.get(DataSyncState, (fitpro_user_id, HISTORY_SOURCE))
+        cursor = state.cursor if state else None
+        newest = state.high_water_mark if state else None
+
+        params = {"limit": SPOTIFY_HISTORY_PAGE_SIZE}
+        if cursor:
+            params["after"] = cursor
+        inserted = 0
+        oldest_inserted = None
+        for _ in range(SPOTIFY_HISTORY_MAX_PAGES):
+            page = await SpotifyIntegration.make_spotify_api_request(
+                db, fitpro_user_id, "me/player/recently-played", params, use_cache=False
+            ) or {}
+            items = [item for item in page.get("items") or [] if (item.get("track") or {}).get("id")]
+            rows = [_play_row(fitpro_user_id, item) for item in items]
+            if rows:
+                page_inserted = await SpotifyHistorySync.insert_plays(db, rows)
+                await db.commit()
+                if page_inserted:
+                    inserted += page_inserted
+                    page_oldest = min(row["played_at"] for row in rows)
+                    if oldest_inserted is None or page_oldest < oldest_inserted:
+                        oldest_inserted = page_oldest
+                page_newest = max(row["played_at"] for row in rows)
+                if newest is None or page_newest > newest:
+                    newest = page_newest
+
+            cursors = page.get("cursors") or {}
+            if len(page.get("items") or []) < SPOTIFY_HISTORY_PAGE_SIZE:
+                break
+            # forward from the cursor on incremental syncs, backwards through Spotify's window on the first
+            direction = "after" if cursor else "before"
+            if not cursors.get(direction):
+                break
+            params[direction] = cursors[direction]
+
+        state_stmt = pg_insert(DataSyncState).values(
+            user_id=fitpro_user_id,
+            source=HISTORY_SOURCE,
+            high_water_mark=newest,
+            cursor=str(_ms(newest)) if newest else None,
+            last_synced_at=func.now()
+        )
+        state_stmt = state_stmt.on_conflict_do_update(
+            index_elements=["user_id", "source"],
+            set_={
+                "high_water_mark": state_stmt.excluded.high_water_mark,
+                "cursor": state_stmt.excluded.cursor,
+                "last_synced_at": func.now()
+            }
+        )
+        await db.execute(state_stmt)
+        await db.commit()
+        if state is not None:
+            await db.refresh(state)
+        if inserted:
+            SoundtrackAnalytics.schedule_refresh(fitpro_user_id, oldest_inserted)
+        return inserted
+
+    @staticmethod
+    async def _background_sync(fitpro_user_id: str):
+        try:
+            with background_priority():
+                async with AsyncSessionLocal() as db:
+                    await SpotifyHistorySync.sync_user(db, fitpro_user_id)
+        except Exception as e:
+            logger.error("Background Spotify history sync failed: %s", e, extra={"user_id": fitpro_user_id})
+
+    @staticmethod
+    def schedule_sync(fitpro_user_id: str):
+        """Sync in the background, at most one running sync per user"""
+        if fitpro_user_id in _background_syncs:
+            return
+        _background_syncs.add(fitpro_user_id)
+        task = asyncio.create_task(SpotifyHistorySync._background_sync(fitpro_user_id))
+        task.add_done_callback(lambda _: _background_syncs.discard(fitpro_user_id))
+
+    @staticmethod
+    async def ensure_synced(db: AsyncSession, fitpro_user_id: str):
+        """First read syncs inline; afterwards the local copy is served and refreshed in the background when stale"""
+        state = await db.get(DataSyncState, (fitpro_user_id, HISTORY_SOURCE))
+        if state is None or state.last_synced_at is None:
+            await SpotifyHistorySync.sync_user(db, fitpro_user_id)
+            return
+
+        age = (datetime.now(timezone.utc) - state.last_synced_at).total_seconds()
+        if age > SPOTIFY_HISTORY_STALE_SECONDS:
+            SpotifyHistorySync.schedule_sync(fitpro_user_id)
+
+    @staticmethod
+    async def get_plays(
+        db: AsyncSession,
+        fitpro_user_id: str,
+        limit: int = 50,
+        before: Optional[datetime] = None,
+        after: Optional[datetime] = None
+    ) -> List[SpotifyPlay]:
+        """Newest-first plays in (after, before), served by the (user_id, played_at) key"""
+        query = select(SpotifyPlay).where(SpotifyPlay.user_id == fitpro_user_id)
+        if before:
+            query = query.where(SpotifyPlay.played_at < before)
+        if after:
+            query = query.where(SpotifyPlay.played_at > after)
+        result = await db.execute(query.order_by(SpotifyPlay.played_at.desc()).limit(limit))
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def get_top_tracks(db: AsyncSession, fitpro_user_id: str, days: int = 30, limit: int = 20) -> List[Dict[str, Any]]:
+        """Most played tracks over the last `days` days"""
+        since = datetime.now(timezone.utc) - timedelta(days=days)
+        plays = func.count().label("plays")
+        result = await db.execute(
+            select(
+                SpotifyPlay.track_id,
+                func.max(SpotifyPlay.track_name),
+                func.max(SpotifyPlay.artist_names),
+                plays,
+                func.max(SpotifyPlay.played_at)
+            )
+            .where(SpotifyPlay.user_id == fitpro_user_id, SpotifyPlay.played_at >= since)
+            .group_by(SpotifyPlay.track_id)
+            .order_by(plays.desc(), func.max(SpotifyPlay.played_at).desc())
+            .limit(limit)
+        )
+        return [
+            {"track_id": track_id, "track_name": name, "artists": artists, "plays": count, "last_played_at": last.isoformat()}
+            for track_id, name, artists, count, last in result.all()
+        ]
+
+
+async def sync_all_users(concurrency: int = SPOTIFY_HISTORY_SYNC_CONCURRENCY) -> Dict[str, int]:
+    """One pass over every user with Spotify linked; returns per-run counts"""
+    stats = {"users": 0, "plays": 0, "failed": 0}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(user_id: str):
+        async with semaphore:
+            try:
+                with background_priority():
+                    async with AsyncSessionLocal() as db:
+                        stats["plays"] += await SpotifyHistorySync.sync_user(db, user_id)
+            except Exception as e:
+                stats["failed"] += 1
+                logger.warning("Spotify history sync failed: %s", e, extra={"user_id": user_id})
+
+    last_user_id = None
+    while True:
+        async with AsyncSessionLocal() as db:
+            query = select(User.user_id).where(User.spotify_user_id.isnot(None))
+            if last_user_id:
+                query = query.where(User.user_id > last_user_id)
+            result = await db.execute(query.order_by(User.user_id).limit(SPOTIFY_HISTORY_USER_BATCH))
+            user_ids = list(result.scalars().all())
+        if not user_ids:
+            break
+        stats["users"] += len(user_ids)
+        await asyncio.gather(*(run(user_id) for user_id in user_ids))
+        last_user_id = user_ids[-1]
+    return stats
+
+async def run_history_sync(interval_seconds: int = SPOTIFY_HISTORY_SYNC_INTERVAL_SECONDS, once: bool = False):
+    while True:
+        started = time.monotonic()
+        try:
+            stats = await sync_all_users()
+            logger.info(
+                "Spotify history sync pass finished",
+                extra={**stats, "duration_s": round(time.monotonic() - started, 2)}
+            )
+        except Exception:
+            logger.exception("Spotify history sync pass failed")
+
+        if once:
+            return
+        await asyncio.sleep(max(interval_seconds - (time.monotonic() - started), 0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Capture Spotify listening history for every linked user")
+    parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+    args = parser.parse_args()
+    setup_logging()
+
+    async def main():
+        try:
+            await run_history_sync(once=args.once)
+        finally:
+            await close_http_clients()
+
+    asyncio.run(main())
@@ -0,0 +1,228 @@
+"""Refreshes OAuth tokens shortly before they expire; runs in the API or as `python -m services.token_refresher`"""
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, and_, or_
+from dotenv import load_dotenv
+
+import argparse
+import asyncio
+import logging
+import time
+import os
+
+from databases.database import AsyncSessionLocal, OAuthToken, redis_client
+from databases.db_service import store_oauth_tokens
+from integrations.whoop import WhoopIntegration
+from integrations.spotify import SpotifyIntegration
+from integrations.http_client import close_http_clients
+from integrations.rate_limiter import background_priority
+from monitoring.log import setup_logging
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TOKEN_REFRESHER_ENABLED = os.getenv("TOKEN_REFRESHER_ENABLED", "true").lower() == "true"
+TOKEN_REFRESH_INTERVAL_SECONDS = int(os.getenv("TOKEN_REFRESH_INTERVAL_SECONDS", "60"))
+TOKEN_REFRESH_WINDOW_SECONDS = int(os.getenv("TOKEN_REFRESH_WINDOW_SECONDS", "600"))
+TOKEN_REFRESH_BATCH_SIZE = int(os.getenv("TOKEN_REFRESH_BATCH_SIZE", "100"))
+TOKEN_REFRESH_CONCURRENCY = int(os.getenv("TOKEN_REFRESH_CONCURRENCY", "5"))
+TOKEN_REFRESH_RATE_PER_SECOND = float(os.getenv("TOKEN_REFRESH_RATE_PER_SECOND", "5"))
+# after a failed refresh, leave the token alone for this long before retrying
+TOKEN_REFRESH_FAILURE_BACKOFF_SECONDS = int(os.getenv("TOKEN_REFRESH_FAILURE_BACKOFF_SECONDS", "900"))
+# refreshed tokens arriving within this long of each other are written in one statement;
+# keep it well under REFRESH_LOCK_TTL_MS, since each refresh holds its lock until its token is written
+TOKEN_REFRESH_WRITE_LINGER_SECONDS = float(os.getenv("TOKEN_REFRESH_WRITE_LINGER_SECONDS", "0.2"))
+
+LEADER_LOCK_KEY = "token_refresher:leader"
+
+REFRESHERS = {
+    'whoop': WhoopIntegration.refresh_whoop_token,
+    'spotify': SpotifyIntegration.refresh_spotify_token,
+}
+
+# (user_id, provider) -> monotonic time before which we don't retry
+_failure_backoff: Dict[Tuple[str, str], float] = {}
+
+
+async def find_expiring_tokens(
+    db,
+    window_seconds: int,
+    limit: int,
+    after: Optional[Tuple[datetime, str]] = None
+) -> List[Tuple[str, str, str, datetime]]:
+    """One keyset page of (token_id, user_id, provider, expires_at), soonest expiry first"""
+    horizon = datetime.now(timezone.utc) + timedelta(seconds=window_seconds)
+    conditions = [
+        OAuthToken.expires_at.isnot(None),
+        OAuthToken.expires_at < horizon,
+        OAuthToken.refresh_token_encrypted.isnot(None),
+    ]
+    if after:
+        after_expires_at, after_token_id = after
+        conditions.append(or_(
+            OAuthToken.expires_at > after_expires_at,
+            and_(OAuthToken.expires_at == after_expires_at, OAuthToken.token_id > after_token_id)
+        ))
+
+    result = await db.execute(
+        select(OAuthToken.token_id, OAuthToken.user_id, OAuthToken.provider_name, OAuthToken.expires_at)
+        .where(*conditions)
+        .order_by(OAuthToken.expires_at, OAuthToken.token_id)
+        .limit(limit)
+    )
+    return [tuple(row) for row in result.all()]
+
+
+class _TokenWriteBatch:
+    """Collects a batch's refreshed tokens and writes them with store_oauth_tokens, one statement per linger window"""
+
+    def __init__(self, linger_seconds: float = TOKEN_REFRESH_WRITE_LINGER_SECONDS):
+        self.linger_seconds = linger_seconds
+        self.pending: List[Tuple[dict, asyncio.Future]] = []
+        self.flush_task: Optional[asyncio.Task] = None
+
+    async def store(self, **token):
+        """Returns once the token is committed, so the caller's refresh lock covers the write"""
+        written = asyncio.get_running_loop().create_future()
+        self.pending.append((token, written))
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush())
+        await written
+
+    async def _flush(self):
+        await asyncio.sleep(self.linger_seconds)
+        batch, self.pending = self.pending, []
+        # tokens arriving during the write start the next flush
+        self.flush_task = None
+        try:
+            async with AsyncSessionLocal() as db:
+                await store_oauth_tokens(db, [token for token, _ in batch])
+        except Exception as e:
+            for _, written in batch:
+                written.set_exception(e)
+        else:
+            for _, written in batch:
+                written.set_result(None)
+
+
+async def _refresh_one(user_id: str, provider: str, writes: Optional[_TokenWriteBatch] = None) -> bool:
+    refresh = REFRESHERS.get(provider)
+    if refresh is None:
+        return False
+
+    # each refresh gets its own session so a batch can run concurrently
+    with background_priority():
+        async with AsyncSessionLocal() as db:
+            try:
+                return await refresh(db, user_id, store_token=writes.store if writes else None)
+            except Exception as e:
+                logger.error("Background %s refresh failed: %s", provider, e, extra={"user_id": user_id})
+                return False
+
+
+async def refresh_expiring_tokens(
+    window_seconds: int = TOKEN_REFRESH_WINDOW_SECONDS,
+    batch_size: int = TOKEN_REFRESH_BATCH_SIZE
+) -> Dict[str, int]:
+    """Refresh every token expiring within the window; returns per-run counts"""
+    stats = {"scanned": 0, "refreshed": 0, "failed": 0, "skipped": 0}
+    semaphore = asyncio.Semaphore(TOKEN_REFRESH_CONCURRENCY)
+    start_interval = 1 / TOKEN_REFRESH_RATE_PER_SECOND if TOKEN_REFRESH_RATE_PER_SECOND > 0 else 0
+
+    async def run(user_id: str, provider: str, writes: _TokenWriteBatch):
+        async with semaphore:
+            if await _refresh_one(user_id, provider, writes):
+                stats["refreshed"] += 1
+                _failure_backoff.pop((user_id, provider), None)
+            else:
+                stats["failed"] += 1
+                _failure_backoff[(user_id, provider)] = time.monotonic() + TOKEN_REFRESH_FAILURE_BACKOFF_SECONDS
+
+    cursor = None
+    while True:
+        async with AsyncSessionLocal() as db:
+            rows = await find_expiring_tokens(db, window_seconds, batch_size, cursor)
+        if not rows:
+            break
+
+        tasks = []
+        writes = _TokenWriteBatch()
+        for token_id, user_id, provider, expires_at in rows:
+            stats["scanned"] += 1
+            if _failure_backoff.get((user_id, provider), 0) > time.monotonic():
+                stats["skipped"] += 1
+                continue
+            tasks.append(asyncio.create_task(run(user_id, provider, writes)))
+            if start_interval:
+                await asyncio.sleep(start_interval)
+        await asyncio.gather(*tasks)
+
+        last = rows[-1]
+        cursor = (last[3], last[0])
+        if len(rows) < batch_size:
+            break
+
+    return stats
+
+
+async def acquire_refresher_leadership(ttl_seconds: int) -> bool:
+    """Only one worker per interval, in-API refresher or refresh job, does the scan; others skip their turn"""
+    try:
+        return bool(await redis_client.set(LEADER_LOCK_KEY, str(os.getpid()), nx=True, ex=ttl_seconds))
+    except Exception as e:
+        logger.warning("Token refresher leader lock unavailable, running anyway: %s", e)
+        return True
+
+
+async def run_token_refresher(interval_seconds: int = TOKEN_REFRESH_INTERVAL_SECONDS, once: bool = False):
+    while True:
+        if await acquire_refresher_leadership(interval_seconds):
+            started = time.monotonic()
+            try:
+                stats = await refresh_expiring_tokens()
+                if stats["scanned"]:
+                    logger.info(
+                        "Token refresher pass finished",
+                        extra={**stats, "duration_s": round(time.monotonic() - started, 2)}
+                    )
+            except Exception as e:
+                logger.exception("Token refresher run failed")
+
+        if once:
+            return
+        await asyncio.sleep(interval_seconds)
+
+
+_refresher_task: Optional[asyncio.Task] = None
+
+def start_token_refresher():
+    global _refresher_task
+    if TOKEN_REFRESHER_ENABLED and _refresher_task is None:
+        _refresher_task = asyncio.create_task(run_token_refresher())
+
+async def stop_token_refresher():
+    global _refresher_task
+    if _refresher_task is None:
+        return
+    _refresher_task.cancel()
+    try:
+        await _refresher_task
+    except asyncio.CancelledError:
+        pass
+    _refresher_task = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh OAuth tokens that are about to expire")
+    parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+    args = parser.parse_args()
+    setup_logging()
+
+    async def main():
+        try:
+            await run_token_refresher(once=args.once)
+        finally:
+            await close_http_clients()
+
+    asyncio.run(main())
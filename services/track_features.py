@@ -0,0 +1,74 @@
+"""Spotify audio features per track, cached in Redis and shared across users"""
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+
+import json
+import logging
+import os
+
+from databases.database import AsyncSessionLocal, redis_client
+from integrations.spotify import SpotifyIntegration
+from monitoring.metrics import CACHE_REQUESTS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TRACK_FEATURES_TTL = int(os.getenv("TRACK_FEATURES_TTL", str(30 * 24 * 3600)))
+# Spotify has no features for some tracks (local files, podcasts); don't ask again for a while
+TRACK_FEATURES_MISSING_TTL = int(os.getenv("TRACK_FEATURES_MISSING_TTL", str(24 * 3600)))
+AUDIO_FEATURES_BATCH = 100  # Spotify's maximum ids per audio-features call
+
+TRACK_FEATURES_KEY_PREFIX = "track_features:"
+
+# the subset of Spotify's audio features we keep
+FEATURES = ("tempo", "energy", "valence", "danceability", "acousticness")
+
+
+async def get_track_features(user_id: str, track_ids: List[str]) -> Dict[str, Optional[Dict[str, float]]]:
+    """Audio features per track id (None where Spotify has none), fetching only cache misses"""
+    features: Dict[str, Optional[Dict[str, float]]] = {}
+    if not track_ids:
+        return features
+    try:
+        cached = await redis_client.mget([TRACK_FEATURES_KEY_PREFIX + track_id for track_id in track_ids])
+    except Exception as e:
+        logger.warning("Track features cache read failed: %s", e)
+        cached = [None] * len(track_ids)
+
+    missing = []
+    for track_id, raw in zip(track_ids, cached):
+        if raw is None:
+            missing.append(track_id)
+        else:
+            features[track_id] = json.loads(raw)
+    CACHE_REQUESTS.labels("track_features", "hit").inc(len(features))
+    CACHE_REQUESTS.labels("track_features", "miss").inc(len(missing))
+    if not missing:
+        return features
+
+    fetched = {}
+    async with AsyncSessionLocal() as db:
+        for i in range(0, len(missing), AUDIO_FEATURES_BATCH):
+            batch = missing[i:i + AUDIO_FEATURES_BATCH]
+            payload = await SpotifyIntegration.make_spotify_api_request(
+                db, user_id, "audio-features", {"ids": ",".join(batch)}, use_cache=False
+            ) or {}
+            found = {item["id"]: item for item in payload.get("audio_features") or [] if item}
+            for track_id in batch:
+                item = found.get(track_id)
+                fetched[track_id] = {name: item.get(name) for name in FEATURES} if item else None
+    features.update(fetched)
+
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for track_id, value in fetched.items():
+                pipe.set(
+                    TRACK_FEATURES_KEY_PREFIX + track_id,
+                    json.dumps(value),
+                    ex=TRACK_FEATURES_TTL if value else TRACK_FEATURES_MISSING_TTL
+                )
+            await pipe.execute()
+    except Exception as e:
+        logger.warning("Track features cache write failed: %s", e)
+    return features
@@ -0,0 +1,260 @@
+"""Daily and weekly Whoop rollups behind the trends endpoint, refreshed incrementally after each sync"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from sqlalchemy import select, func, cast, and_, literal, Date, Interval
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+import asyncio
+import logging
+
+from databases.database import (
+    AsyncSessionLocal,
+    DataSyncState,
+    WhoopCycle,
+    WhoopDailyRollup,
+    WhoopRecovery,
+    WhoopSleep,
+    WhoopWeeklyRollup,
+    WhoopWorkout,
+)
+from integrations.rate_limiter import background_priority
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("recovery_score", "hrv_rmssd_milli", "resting_heart_rate", "sleep_performance_percentage", "strain")
+TREND_WINDOWS = (7, 30, 90)
+# the current week is compared against the BASELINE_DAYS before it
+BASELINE_DAYS = 30
+# recoveries are created the morning after their cycle starts and days are local, so refreshes
+# start a little before the earliest record a sync could have touched
+ROLLUP_MARGIN_DAYS = 1
+
+ROLLUP_SOURCE = "rollup:whoop"
+
+# user_id -> earliest day still waiting to be recomputed
+_pending_refreshes: Dict[str, Optional[date]] = {}
+_refresh_tasks: Dict[str, asyncio.Task] = {}
+
+
+def _cycle_day(cycle):
+    """
+    The local day a cycle belongs to: cycles begin when the user falls asleep, so it is the local
+    date twelve hours after the start (a cycle beginning 23:00 Monday is Tuesday)
+    """
+    offset = cast(func.coalesce(cycle.data["timezone_offset"].astext, "+00:00"), Interval)
+    return cast(func.timezone("UTC", cycle.start_time) + offset + timedelta(hours=12), Date)
+
+def _week_start(day):
+    return cast(func.date_trunc("week", day), Date)
+
+def _earliest(a: Optional[date], b: Optional[date]) -> Optional[date]:
+    # None means "from the beginning"
+    if a is None or b is None:
+        return None
+    return min(a, b)
+
+def _round(value) -> Optional[float]:
+    return round(float(value), 2) if value is not None else None
+
+
+class WhoopRollups:
+    @staticmethod
+    async def refresh(db: AsyncSession, fitpro_user_id: str, since: Optional[date] = None):
+        """Recompute daily rollups from `since` (everything when None) and the weeks that contain them"""
+        # one refresh per user at a time across workers, so a refresh that read older data can't
+        # overwrite a newer one; each statement below sees everything committed before the lock
+        await db.execute(select(func.pg_advisory_xact_lock(func.hashtext(f"{ROLLUP_SOURCE}:{fitpro_user_id}"))))
+        cycle_day = _cycle_day(WhoopCycle).label("day")
+        cycles = (
+            select(
+                cycle_day,
+                func.avg(WhoopRecovery.recovery_score).label("recovery_score"),
+                func.avg(WhoopRecovery.hrv_rmssd_milli).label("hrv_rmssd_milli"),
+                func.avg(WhoopRecovery.resting_heart_rate).label("resting_heart_rate"),
+                func.avg(WhoopSleep.sleep_performance_percentage).label("sleep_performance_percentage"),
+                func.max(WhoopCycle.strain).label("strain"),
+            )
+            .select_from(WhoopCycle)
+            .outerjoin(WhoopRecovery, WhoopRecovery.cycle_id == WhoopCycle.cycle_id)
+            .outerjoin(WhoopSleep, and_(WhoopSleep.cycle_id == WhoopCycle.cycle_id, WhoopSleep.nap.isnot(True)))
+            .where(WhoopCycle.user_id == fitpro_user_id)
+            .group_by(cycle_day)
+        )
+        # a workout counts for the cycle it started in
+        workouts = (
+            select(cycle_day, func.count().label("workouts"))
+            .select_from(WhoopCycle)
+            .join(WhoopWorkout, and_(
+                WhoopWorkout.user_id == WhoopCycle.user_id,
+                WhoopWorkout.start_time >= WhoopCycle.start_time,
+                func.coalesce(WhoopCycle.end_time, func.now()) > WhoopWorkout.start_time
+            ))
+            .where(WhoopCycle.user_id == fitpro_user_id)
+            .group_by(cycle_day)
+        )
+        if since:
+            # whole days only; the start_time bound keeps the (user_id, start_time) index usable
+            bound = datetime.combine(since - timedelta(days=2), datetime.min.time(), tzinfo=timezone.utc)
+            cycles = cycles.where(WhoopCycle.start_time >= bound, cycle_day >= since)
+            workouts = workouts.where(WhoopCycle.start_time >= bound, cycle_day >= since)
+        cycles = cycles.subquery()
+        workouts = workouts.subquery()
+
+        daily = pg_insert(WhoopDailyRollup).from_select(
+            ["user_id", "day", *METRICS, "workouts"],
+            select(
+                literal(fitpro_user_id),
+                cycles.c.day,
+                *(cycles.c[name] for name in METRICS),
+                func.coalesce(workouts.c.workouts, 0)
+            ).select_from(cycles.outerjoin(workouts, workouts.c.day == cycles.c.day))
+        )
+        daily = daily.on_conflict_do_update(
+            index_elements=["user_id", "day"],
+            set_={
+                **{name: daily.excluded[name] for name in (*METRICS, "workouts")},
+                "updated_at": func.now()
+            }
+        )
+        await db.execute(daily)
+
+        week = _week_start(WhoopDailyRollup.day).label("week_start")
+        weeks = (
+            select(
+                literal(fitpro_user_id),
+                week,
+                func.count(),
+                *(func.avg(getattr(WhoopDailyRollup, name)) for name in METRICS),
+                func.sum(WhoopDailyRollup.workouts)
+            )
+            .where(WhoopDailyRollup.user_id == fitpro_user_id)
+            .group_by(week)
+        )
+        if since:
+            weeks = weeks.where(WhoopDailyRollup.day >= _week_start(literal(since, Date)))
+        weekly = pg_insert(WhoopWeeklyRollup).from_select(
+            ["user_id", "week_start", "days", *METRICS, "workouts"], weeks
+        )
+        weekly = weekly.on_conflict_do_update(
+            index_elements=["user_id", "week_start"],
+            set_={
+                **{name: weekly.excluded[name] for name in ("days", *METRICS, "workouts")},
+                "updated_at": func.now()
+            }
+        )
+        await db.execute(weekly)
+
+        state_stmt = pg_insert(DataSyncState).values(
+            user_id=fitpro_user_id,
+            source=ROLLUP_SOURCE,
+            last_synced_at=func.now()
+        )
+        state_stmt = state_stmt.on_conflict_do_update(
+            index_elements=["user_id", "source"],
+            set_={"last_synced_at": func.now()}
+        )
+        await db.execute(state_stmt)
+        await db.commit()
+
+    @staticmethod
+    async def _background_refresh(fitpro_user_id: str):
+        # syncs that land while a refresh runs are picked up by the next loop iteration
+        while fitpro_user_id in _pending_refreshes:
+            since = _pending_refreshes.pop(fitpro_user_id)
+            try:
+                with background_priority():
+                    async with AsyncSessionLocal() as db:
+                        await WhoopRollups.refresh(db, fitpro_user_id, since)
+            except Exception as e:
+                logger.error("Whoop rollup refresh failed: %s", e, extra={"user_id": fitpro_user_id})
+
+    @staticmethod
+    def schedule_refresh(fitpro_user_id: str, changed_since: Optional[datetime] = None):
+        """Recompute rollups from the day of `changed_since` in the background, one refresh per user at a time"""
+        since = changed_since.date() - timedelta(days=ROLLUP_MARGIN_DAYS) if changed_since else None
+        if fitpro_user_id in _pending_refreshes:
+            since = _earliest(since, _pending_refreshes[fitpro_user_id])
+        _pending_refreshes[fitpro_user_id] = since
+        if fitpro_user_id in _refresh_tasks:
+            return
+        task = asyncio.create_task(WhoopRollups._background_refresh(fitpro_user_id))
+        _refresh_tasks[fitpro_user_id] = task
+        task.add_done_callback(lambda _: _refresh_tasks.pop(fitpro_user_id, None))
+
+    @staticmethod
+    async def ensure_fresh(db: AsyncSession, fitpro_user_id: str):
+        """
+        A user's first trends read builds their rollups inline; after that syncs keep them current.
+        A refresh already in flight for the user is waited for, so the read includes what it adds.
+        """
+        task = _refresh_tasks.get(fitpro_user_id)
+        if task is not None:
+            await asyncio.shield(task)
+        state = await db.get(DataSyncState, (fitpro_user_id, ROLLUP_SOURCE))
+        if state is None or state.last_synced_at is None:
+            await WhoopRollups.refresh(db, fitpro_user_id)
+
+    @staticmethod
+    async def get_trends(db: AsyncSession, fitpro_user_id: str, weeks: int = 12) -> Dict[str, Any]:
+        """
+        7/30/90-day averages, the baseline (the BASELINE_DAYS before the last 7 days) with the last
+        7 days' delta from it, and the most recent weekly rollups. Two indexed reads of the rollups.
+        """
+        today = datetime.now(timezone.utc).date()
+        day = WhoopDailyRollup.day
+        in_window = {n: day > today - timedelta(days=n) for n in TREND_WINDOWS}
+        in_baseline = and_(day <= today - timedelta(days=7), day > today - timedelta(days=7 + BASELINE_DAYS))
+
+        columns = []
+        for n, condition in in_window.items():
+            columns.append(func.count().filter(condition).label(f"{n}d:days"))
+            columns.append(func.sum(WhoopDailyRollup.workouts).filter(condition).label(f"{n}d:workouts"))
+            columns.extend(
+                func.avg(getattr(WhoopDailyRollup, name)).filter(condition).label(f"{n}d:{name}")
+                for name in METRICS
+            )
+        columns.append(func.count().filter(in_baseline).label("baseline:days"))
+        columns.extend(
+            func.avg(getattr(WhoopDailyRollup, name)).filter(in_baseline).label(f"baseline:{name}")
+            for name in METRICS
+        )
+        oldest = today - timedelta(days=max(*TREND_WINDOWS, 7 + BASELINE_DAYS))
+        row = (await db.execute(
+            select(*columns).where(WhoopDailyRollup.user_id == fitpro_user_id, day > oldest)
+        )).mappings().one()
+
+        windows = {
+            f"{n}d": {
+                "days": row[f"{n}d:days"],
+                "workouts": int(row[f"{n}d:workouts"] or 0),
+                **{name: _round(row[f"{n}d:{name}"]) for name in METRICS}
+            }
+            for n in TREND_WINDOWS
+        }
+        baseline = {"days": row["baseline:days"], **{name: _round(row[f"baseline:{name}"]) for name in METRICS}}
+        delta = {
+            name: _round(windows["7d"][name] - baseline[name])
+            if windows["7d"][name] is not None and baseline[name] is not None else None
+            for name in METRICS
+        }
+
+        result = await db.execute(
+            select(WhoopWeeklyRollup)
+            .where(WhoopWeeklyRollup.user_id == fitpro_user_id)
+            .order_by(WhoopWeeklyRollup.week_start.desc())
+            .limit(weeks)
+        )
+        weekly: List[Dict[str, Any]] = [
+            {
+                "week_start": rollup.week_start.isoformat(),
+                "days": rollup.days,
+                "workouts": rollup.workouts,
+                **{name: _round(getattr(rollup, name)) for name in METRICS}
+            }
+            for rollup in result.scalars().all()
+        ]
+        return {"as_of": today.isoformat(), "windows": windows, "baseline": baseline, "delta": delta, "weekly": weekly}
@@ -0,0 +1,280 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+import asyncio
+import logging
+import os
+
+from databases.database import (
+    AsyncSessionLocal,
+    DataSyncState,
+    WhoopCycle,
+    WhoopRecovery,
+    WhoopSleep,
+    WhoopWorkout,
+)
+from integrations.whoop import WhoopIntegration
+from integrations.rate_limiter import background_priority
+from services.soundtrack_analytics import SoundtrackAnalytics
+from services.whoop_rollups import WhoopRollups
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WHOOP_SYNC_PAGE_SIZE = 25  # Whoop's maximum page size
+WHOOP_SYNC_INITIAL_DAYS = int(os.getenv("WHOOP_SYNC_INITIAL_DAYS", "30"))
+# Whoop re-scores recent records, so each sync re-reads a little before the high-water mark
+WHOOP_SYNC_LOOKBACK_HOURS = int(os.getenv("WHOOP_SYNC_LOOKBACK_HOURS", "72"))
+WHOOP_SYNC_STALE_SECONDS = int(os.getenv("WHOOP_SYNC_STALE_SECONDS", "900"))
+WHOOP_SYNC_MAX_PAGES = int(os.getenv("WHOOP_SYNC_MAX_PAGES", "200"))
+
+
+def _ts(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+def _iso(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+def _cycle_row(user_id: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    score = record.get("score") or {}
+    return {
+        "cycle_id": record["id"],
+        "user_id": user_id,
+        "start_time": _ts(record["start"]),
+        "end_time": _ts(record.get("end")),
+        "score_state": record.get("score_state"),
+        "strain": score.get("strain"),
+        "kilojoule": score.get("kilojoule"),
+        "average_heart_rate": score.get("average_heart_rate"),
+        "max_heart_rate": score.get("max_heart_rate"),
+        "data": record,
+        "whoop_updated_at": _ts(record["updated_at"]),
+    }
+
+def _recovery_row(user_id: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    score = record.get("score") or {}
+    return {
+        "cycle_id": record["cycle_id"],
+        "sleep_id": record.get("sleep_id"),
+        "user_id": user_id,
+        "score_state": record.get("score_state"),
+        "recovery_score": score.get("recovery_score"),
+        "resting_heart_rate": score.get("resting_heart_rate"),
+        "hrv_rmssd_milli": score.get("hrv_rmssd_milli"),
+        "spo2_percentage": score.get("spo2_percentage"),
+        "skin_temp_celsius": score.get("skin_temp_celsius"),
+        "data": record,
+        "whoop_created_at": _ts(record["created_at"]),
+        "whoop_updated_at": _ts(record["updated_at"]),
+    }
+
+def _sleep_row(user_id: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    score = record.get("score") or {}
+    return {
+        "sleep_id": record["id"],
+        "cycle_id": record.get("cycle_id"),
+        "user_id": user_id,
+        "start_time": _ts(record["start"]),
+        "end_time": _ts(record.get("end")),
+        "nap": record.get("nap", False),
+        "score_state": record.get("score_state"),
+        "sleep_performance_percentage": score.get("sleep_performance_percentage"),
+        "sleep_efficiency_percentage": score.get("sleep_efficiency_percentage"),
+        "data": record,
+        "whoop_updated_at": _ts(record["updated_at"]),
+    }
+
+def _workout_row(user_id: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    score = record.get("score") or {}
+    return {
+        "workout_id": record["id"],
+        "user_id": user_id,
+        "start_time": _ts(record["start"]),
+        "end_time": _ts(record.get("end")),
+        "sport_name": record.get("sport_name"),
+        "score_state": record.get("score_state"),
+        "strain": score.get("strain"),
+        "average_heart_rate": score.get("average_heart_rate"),
+        "max_heart_rate": score.get("max_heart_rate"),
+        "data": record,
+        "whoop_updated_at": _ts(record["updated_at"]),
+    }
+
+# endpoint: Whoop v2 collection path; key: primary key column; mark: column the high-water mark tracks
+COLLECTIONS = {
+    "cycle": {"endpoint": "cycle", "model": WhoopCycle, "key": "cycle_id", "mark": "start_time", "to_row": _cycle_row},
+    "recovery": {"endpoint": "recovery", "model": WhoopRecovery, "key": "cycle_id", "mark": "whoop_created_at", "to_row": _recovery_row},
+    "sleep": {"endpoint": "activity/sleep", "model": WhoopSleep, "key": "sleep_id", "mark": "start_time", "to_row": _sleep_row},
+    "workout": {"endpoint": "activity/workout", "model": WhoopWorkout, "key": "workout_id", "mark": "start_time", "to_row": _workout_row},
+}
+
+_background_syncs = set()
+
+
+class WhoopSyncEngine:
+    @staticmethod
+    def _source(collection: str) -> str:
+        return f"whoop:{collection}"
+
+    @staticmethod
+    async def upsert_records(db: AsyncSession, collection: str, rows: List[Dict[str, Any]]):
+        """Bulk upsert in one statement; rows Whoop hasn't changed since our copy are left alone"""
+        if not rows:
+            return
+        config = COLLECTIONS[collection]
+        table = config["model"].__table__
+
+        stmt = pg_insert(table).values(rows)
+        update_columns = {name: stmt.excluded[name] for name in rows[0] if name != config["key"]}
+        update_columns["synced_at"] = func.now()
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[config["key"]],
+            set_=update_columns,
+            where=table.c.whoop_updated_at < stmt.excluded.whoop_updated_at
+        )
+        await db.execute(stmt)
+
+    @staticmethod
+    async def sync_collection(db: AsyncSession, fitpro_user_id: str, collection: str) -> int:
+        """Page through one Whoop collection from the user's high-water mark; returns records seen"""
+        config = COLLECTIONS[collection]
+        source = WhoopSyncEngine._source(collection)
+
+        state = await db.get(DataSyncState, (fitpro_user_id, source))
+        if state and state.high_water_mark:
+            start = state.high_water_mark - timedelta(hours=WHOOP_SYNC_LOOKBACK_HOURS)
+        else:
+            start = datetime.now(timezone.utc) - timedelta(days=WHOOP_SYNC_INITIAL_DAYS)
+        high_water_mark = state.high_water_mark if state else None
+
+        params = {"limit": WHOOP_SYNC_PAGE_SIZE, "start": _iso(start)}
+        seen = 0
+        for _ in range(WHOOP_SYNC_MAX_PAGES):
+            page = await WhoopIntegration.make_api_request(
+                db, fitpro_user_id, config["endpoint"], params, use_cache=False
+            ) or {}
+            rows = [config["to_row"](fitpro_user_id, record) for record in page.get("records", [])]
+
+            if rows:
+                await WhoopSyncEngine.upsert_records(db, collection, rows)
+                await db.commit()
+                seen += len(rows)
+                page_mark = max(row[config["mark"]] for row in rows)
+                if high_water_mark is None or page_mark > high_water_mark:
+                    high_water_mark = page_mark
+
+            next_token = page.get("next_token")
+            if not next_token:
+                break
+            params["nextToken"] = next_token
+
+        state_stmt = pg_insert(DataSyncState).values(
+            user_id=fitpro_user_id,
+            source=source,
+            high_water_mark=high_water_mark,
+            last_synced_at=func.now()
+        )
+        state_stmt = state_stmt.on_conflict_do_update(
+            index_elements=["user_id", "source"],
+            set_={"high_water_mark": state_stmt.excluded.high_water_mark, "last_synced_at": func.now()}
+        )
+        await db.execute(state_stmt)
+        await db.commit()
+        if state is not None:
+            await db.refresh(state)
+        if seen:
+            WhoopSyncEngine._records_changed(fitpro_user_id, collection, start)
+        return seen
+
+    @staticmethod
+    def _records_changed(fitpro_user_id: str, collection: str, since: datetime):
+        """Refresh what is derived from the store after records from `since` onwards changed"""
+        WhoopRollups.schedule_refresh(fitpro_user_id, since)
+        if collection == "workout":
+            SoundtrackAnalytics.schedule_refresh(fitpro_user_id, since)
+
+    @staticmethod
+    async def apply_records(db: AsyncSession, fitpro_user_id: str, collection: str, records: List[Dict[str, Any]]):
+        """Upsert individual Whoop records, e.g. ones a webhook said changed, without a collection sync"""
+        if not records:
+            return
+        config = COLLECTIONS[collection]
+        rows = [config["to_row"](fitpro_user_id, record) for record in records]
+        await WhoopSyncEngine.upsert_records(db, collection, rows)
+        await db.commit()
+        WhoopSyncEngine._records_changed(fitpro_user_id, collection, min(row[config["mark"]] for row in rows))
+
+    @staticmethod
+    async def delete_record(db: AsyncSession, fitpro_user_id: str, collection: str, record_id: Any, column: Optional[str] = None) -> bool:
+        """Delete one record by its key (or another unique column); returns whether it was stored"""
+        config = COLLECTIONS[collection]
+        model = config["model"]
+        result = await db.execute(
+            delete(model)
+            .where(model.user_id == fitpro_user_id, getattr(model, column or config["key"]) == record_id)
+            .returning(getattr(model, config["mark"]))
+        )
+        marks = result.scalars().all()
+        await db.commit()
+        if marks:
+            WhoopSyncEngine._records_changed(fitpro_user_id, collection, min(marks))
+        return bool(marks)
+
+    @staticmethod
+    async def sync_user(db: AsyncSession, fitpro_user_id: str) -> Dict[str, int]:
+        return {
+            collection: await WhoopSyncEngine.sync_collection(db, fitpro_user_id, collection)
+            for collection in COLLECTIONS
+        }
+
+    @staticmethod
+    async def _background_sync(fitpro_user_id: str, collection: str):
+        try:
+            with background_priority():
+                async with AsyncSessionLocal() as db:
+                    await WhoopSyncEngine.sync_collection(db, fitpro_user_id, collection)
+        except Exception as e:
+            logger.error("Background Whoop %s sync failed: %s", collection, e, extra={"user_id": fitpro_user_id})
+
+    @staticmethod
+    def schedule_sync(fitpro_user_id: str, collection: str):
+        """Sync in the background, at most one running sync per (user, collection)"""
+        key = (fitpro_user_id, collection)
+        if key in _background_syncs:
+            return
+        _background_syncs.add(key)
+        task = asyncio.create_task(WhoopSyncEngine._background_sync(fitpro_user_id, collection))
+        task.add_done_callback(lambda _: _background_syncs.discard(key))
+
+    @staticmethod
+    async def ensure_synced(db: AsyncSession, fitpro_user_id: str, collection: str):
+        """
+        First read for a user syncs inline; afterwards the local copy is served
+        immediately and refreshed in the background once it is stale.
+        """
+        state = await db.get(DataSyncState, (fitpro_user_id, WhoopSyncEngine._source(collection)))
+        if state is None or state.last_synced_at is None:
+            await WhoopSyncEngine.sync_collection(db, fitpro_user_id, collection)
+            return
+
+        age = (datetime.now(timezone.utc) - state.last_synced_at).total_seconds()
+        if age > WHOOP_SYNC_STALE_SECONDS:
+            WhoopSyncEngine.schedule_sync(fitpro_user_id, collection)
+
+    @staticmethod
+    async def get_records(db: AsyncSession, fitpro_user_id: str, collection: str, limit: int = 25) -> List[Dict[str, Any]]:
+        """Newest-first raw Whoop records from the local store"""
+        config = COLLECTIONS[collection]
+        model = config["model"]
+        result = await db.execute(
+            select(model.data)
+            .where(model.user_id == fitpro_user_id)
+            .order_by(getattr(model, config["mark"]).desc())
+            .limit(limit)
+        )
+        return list(result.scalars().all())
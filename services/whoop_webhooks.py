@@ -0,0 +1,218 @@
+"""Applies queued Whoop webhook events to the local Whoop store; runs in the API or as `python -m services.whoop_webhooks`"""
+from typing import Any, Dict, Optional
+from sqlalchemy import select
+from redis.exceptions import ResponseError
+from dotenv import load_dotenv
+
+import argparse
+import asyncio
+import logging
+import socket
+import os
+
+from databases.database import AsyncSessionLocal, User, redis_client
+from integrations.whoop import WhoopIntegration
+from integrations.http_client import close_http_clients
+from integrations.rate_limiter import background_priority
+from monitoring.log import setup_logging
+from monitoring.metrics import WHOOP_WEBHOOK_EVENTS
+from services.whoop_sync import COLLECTIONS, WhoopSyncEngine
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WHOOP_WEBHOOK_CONSUMERS_ENABLED = os.getenv("WHOOP_WEBHOOK_CONSUMERS_ENABLED", "true").lower() == "true"
+WHOOP_WEBHOOK_CONSUMERS = int(os.getenv("WHOOP_WEBHOOK_CONSUMERS", "4"))
+WHOOP_WEBHOOK_BATCH_SIZE = int(os.getenv("WHOOP_WEBHOOK_BATCH_SIZE", "10"))
+WHOOP_WEBHOOK_CLAIM_IDLE_SECONDS = int(os.getenv("WHOOP_WEBHOOK_CLAIM_IDLE_SECONDS", "60"))
+WHOOP_WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WHOOP_WEBHOOK_MAX_ATTEMPTS", "5"))
+WHOOP_WEBHOOK_STREAM_MAXLEN = int(os.getenv("WHOOP_WEBHOOK_STREAM_MAXLEN", "100000"))
+BLOCK_MS = 5000
+
+STREAM_KEY = "whoop:webhooks"
+DEAD_LETTER_KEY = "whoop:webhooks:dead"
+CONSUMER_GROUP = "whoop-webhook-consumers"
+
+# event type -> collection; Whoop sends "<collection>.updated" and "<collection>.deleted"
+EVENT_COLLECTIONS = {"workout": "workout", "sleep": "sleep", "recovery": "recovery"}
+EVENT_TYPES = {f"{name}.{action}" for name in EVENT_COLLECTIONS for action in ("updated", "deleted")}
+
+
+async def enqueue_event(event: Dict[str, Any]) -> str:
+    """Append a verified webhook to the stream; returns the stream entry id"""
+    fields = {
+        "type": event["type"],
+        "user_id": str(event["user_id"]),
+        "id": str(event["id"]),
+        "trace_id": str(event.get("trace_id") or ""),
+    }
+    entry_id = await redis_client.xadd(STREAM_KEY, fields, maxlen=WHOOP_WEBHOOK_STREAM_MAXLEN, approximate=True)
+    return entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+
+
+async def _fitpro_user_id(db, whoop_user_id: str) -> Optional[str]:
+    result = await db.execute(select(User.user_id).where(User.whoop_user_id == whoop_user_id))
+    return result.scalar_one_or_none()
+
+async def process_event(event: Dict[str, str]) -> str:
+    """Apply one event to the local Whoop store; returns the outcome"""
+    collection, _, action = event["type"].partition(".")
+    collection = EVENT_COLLECTIONS[collection]
+    record_id = event["id"]
+
+    async with AsyncSessionLocal() as db:
+        user_id = await _fitpro_user_id(db, event["user_id"])
+        if user_id is None:
+            # unlinked since the event was sent
+            return "unknown_user"
+
+        if action == "deleted":
+            # recovery events are keyed by the recovery's sleep id
+            column = "sleep_id" if collection == "recovery" else None
+            deleted = await WhoopSyncEngine.delete_record(db, user_id, collection, record_id, column)
+            return "deleted" if deleted else "not_stored"
+
+        if collection == "recovery":
+            sleep = await WhoopIntegration.make_api_request(db, user_id, f"activity/sleep/{record_id}", use_cache=False)
+            recovery = await WhoopIntegration.make_api_request(
+                db, user_id, f"cycle/{sleep['cycle_id']}/recovery", use_cache=False
+            )
+            await WhoopSyncEngine.apply_records(db, user_id, "sleep", [sleep])
+            await WhoopSyncEngine.apply_records(db, user_id, "recovery", [recovery])
+        else:
+            endpoint = COLLECTIONS[collection]["endpoint"]
+            record = await WhoopIntegration.make_api_request(db, user_id, f"{endpoint}/{record_id}", use_cache=False)
+            await WhoopSyncEngine.apply_records(db, user_id, collection, [record])
+        return "applied"
+
+
+def _decode(fields: Dict[bytes, bytes]) -> Dict[str, str]:
+    return {key.decode(): value.decode() for key, value in fields.items()}
+
+async def _handle(entry_id: bytes, fields: Dict[bytes, bytes]):
+    event = _decode(fields)
+    try:
+        with background_priority():
+            outcome = await process_event(event)
+    except Exception as e:
+        # stays pending; the reclaimer retries it
+        WHOOP_WEBHOOK_EVENTS.labels(event.get("type"), "failed").inc()
+        logger.warning(
+            "Whoop webhook event failed: %s", e,
+            extra={"entry_id": entry_id.decode(), "event_type": event.get("type"), "trace_id": event.get("trace_id")}
+        )
+        return
+    await redis_client.xack(STREAM_KEY, CONSUMER_GROUP, entry_id)
+    WHOOP_WEBHOOK_EVENTS.labels(event.get("type"), outcome).inc()
+
+async def _dead_letter(entry_id: bytes, fields: Dict[bytes, bytes]):
+    event = _decode(fields)
+    await redis_client.xadd(
+        DEAD_LETTER_KEY, {**event, "entry_id": entry_id.decode()}, maxlen=WHOOP_WEBHOOK_STREAM_MAXLEN, approximate=True
+    )
+    await redis_client.xack(STREAM_KEY, CONSUMER_GROUP, entry_id)
+    WHOOP_WEBHOOK_EVENTS.labels(event.get("type"), "dead_lettered").inc()
+    logger.error(
+        "Whoop webhook event dead-lettered after %d attempts", WHOOP_WEBHOOK_MAX_ATTEMPTS,
+        extra={"entry_id": entry_id.decode(), "event_type": event.get("type"), "trace_id": event.get("trace_id")}
+    )
+
+
+async def _ensure_group():
+    try:
+        await redis_client.xgroup_create(STREAM_KEY, CONSUMER_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+async def _consume(consumer: str):
+    while True:
+        try:
+            response = await redis_client.xreadgroup(
+                CONSUMER_GROUP, consumer, {STREAM_KEY: ">"}, count=WHOOP_WEBHOOK_BATCH_SIZE, block=BLOCK_MS
+            )
+        except Exception as e:
+            logger.warning("Reading Whoop webhook stream failed: %s", e)
+            await asyncio.sleep(BLOCK_MS / 1000)
+            continue
+        for _, entries in response or []:
+            for entry_id, fields in entries:
+                try:
+                    await _handle(entry_id, fields)
+                except Exception as e:
+                    # not acked, so the reclaimer will pick it up
+                    logger.warning("Acking Whoop webhook event failed: %s", e, extra={"entry_id": entry_id.decode()})
+
+async def _reclaim(consumer: str):
+    """Retry entries other consumers left pending too long; dead-letter the ones out of attempts"""
+    idle_ms = WHOOP_WEBHOOK_CLAIM_IDLE_SECONDS * 1000
+    while True:
+        await asyncio.sleep(WHOOP_WEBHOOK_CLAIM_IDLE_SECONDS / 2)
+        try:
+            pending = await redis_client.xpending_range(
+                STREAM_KEY, CONSUMER_GROUP, min="-", max="+", count=100, idle=idle_ms
+            )
+            for entry in pending:
+                # claiming with min idle time means only one reclaimer wins each entry
+                claimed = await redis_client.xclaim(STREAM_KEY, CONSUMER_GROUP, consumer, idle_ms, [entry["message_id"]])
+                for entry_id, fields in claimed:
+                    if not fields:
+                        # trimmed from the stream before it could be applied
+                        await redis_client.xack(STREAM_KEY, CONSUMER_GROUP, entry_id)
+                    elif entry["times_delivered"] >= WHOOP_WEBHOOK_MAX_ATTEMPTS:
+                        await _dead_letter(entry_id, fields)
+                    else:
+                        await _handle(entry_id, fields)
+        except Exception as e:
+            logger.warning("Reclaiming Whoop webhook events failed: %s", e)
+
+
+async def run_webhook_consumers(consumers: int = WHOOP_WEBHOOK_CONSUMERS):
+    while True:
+        try:
+            await _ensure_group()
+            break
+        except Exception as e:
+            logger.warning("Whoop webhook consumer group unavailable, retrying: %s", e)
+            await asyncio.sleep(BLOCK_MS / 1000)
+    prefix = f"{socket.gethostname()}-{os.getpid()}"
+    logger.info("Whoop webhook consumers started", extra={"consumers": consumers, "consumer_prefix": prefix})
+    await asyncio.gather(
+        *(_consume(f"{prefix}-{i}") for i in range(consumers)),
+        _reclaim(f"{prefix}-reclaim")
+    )
+
+
+_consumers_task: Optional[asyncio.Task] = None
+
+def start_webhook_consumers():
+    global _consumers_task
+    if WHOOP_WEBHOOK_CONSUMERS_ENABLED and _consumers_task is None:
+        _consumers_task = asyncio.create_task(run_webhook_consumers())
+
+async def stop_webhook_consumers():
+    global _consumers_task
+    if _consumers_task is None:
+        return
+    _consumers_task.cancel()
+    try:
+        await _consumers_task
+    except asyncio.CancelledError:
+        pass
+    _consumers_task = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply queued Whoop webhook events to the local Whoop store")
+    parser.add_argument("--consumers", type=int, default=WHOOP_WEBHOOK_CONSUMERS, help="concurrent stream consumers")
+    args = parser.parse_args()
+    setup_logging()
+
+    async def main():
+        try:
+            await run_webhook_consumers(args.consumers)
+        finally:
+            await close_http_clients()
+
+    asyncio.run(main())